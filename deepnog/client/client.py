@@ -47,6 +47,38 @@ from deepnog.utils.config import get_config
 __all__ = ['main',
            ]
 
+# Number of sequences per committed chunk in resumable inference
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Defaults of options, which argparse.Namespace objects created in Python may lack
+_INFER_DEFAULTS = {'max_tokens': None,
+                   'sort_window': 0,
+                   'stream': False,
+                   'keep_duplicate_ids': False,
+                   'chunk_size': None,
+                   'resume': False,
+                   'quantize': 'none',
+                   'calibration_file': None,
+                   'check_quantization': False,
+                   'fuse_levels': False,
+                   'top_k': 1,
+                   'top_k_format': 'long',
+                   'temperature': None,
+                   'backend': 'torch',
+                   'deduplicate': False,
+                   'cache': False,
+                   'cache_dir': None,
+                   'cache_size': None,
+                   'precision': 'fp32',
+                   }
+_TRAIN_DEFAULTS = {'max_tokens': None,
+                   'calibrate': False,
+                   'shared_memory': False,
+                   'precision': 'fp32',
+                   }
+_EXPORT_DEFAULTS = {'format': 'torchscript',
+                    }
+
 
 def _get_parser():
     """ Create a new argument parser.
@@ -74,6 +106,14 @@ def _get_parser():
         'train', help='Train a model for a custom database.')
     parser_infer = subparsers.add_parser(
         'infer', help='Infer protein orthologous groups')
+    parser_serve = subparsers.add_parser(
+        'serve', help='Answer inference requests over HTTP, keeping models in memory.')
+    parser_export = subparsers.add_parser(
+        'export', help='Export a model as frozen TorchScript or ONNX for faster inference.')
+    parser_embed = subparsers.add_parser(
+        'embed', help='Write protein embeddings (pooled network features) to a .npy file.')
+    parser_pack = subparsers.add_parser(
+        'pack', help='Encode labeled training sequences once for fast, memory-mapped loading.')
 
     # Arguments for both training and inference
     for p in [parser_train, parser_infer]:
@@ -112,9 +152,9 @@ def _get_parser():
                              'data loading. '
                              'Set to a value <= 0 to use single-process '
                              'data loading. '
-                             'Note: Only use multi-process data loading if '
-                             'you are calculating on a gpu '
-                             '(otherwise inefficient)!'))
+                             'Each worker parses a contiguous share of '
+                             'FASTA input files, so that several workers '
+                             'speed up parsing of large files.'))
         p.add_argument("-a", "--architecture",
                        default="deepnog",
                        choices=available_architectures,
@@ -133,6 +173,24 @@ def _get_parser():
                              'Larger batch sizes speed up the inference '
                              'and training on GPUs. '
                              'Batch size can influence the learning process.'))
+        p.add_argument("--max-tokens",
+                       type=int,
+                       metavar='N_RESIDUES',
+                       default=_INFER_DEFAULTS['max_tokens'],
+                       help=('Fill each batch with sequences of similar length, '
+                             'until the zero-padded batch would exceed N_RESIDUES '
+                             'residues (number of sequences times length of the '
+                             'longest sequence). This keeps memory requirements '
+                             'predictable regardless of sequence lengths. '
+                             'Overrides --batch-size.'))
+        p.add_argument("--precision",
+                       choices=['fp32', 'bf16'],
+                       default=_INFER_DEFAULTS['precision'],
+                       help=('Numerical precision of the network. bf16 runs '
+                             'convolutions and linear layers in bfloat16 (mixed '
+                             'precision), which is considerably faster on CPUs with '
+                             'AVX512-BF16/AMX support, with slightly different outputs. '
+                             'Requires PyTorch >= 1.10.'))
 
     # Arguments with different help for training vs. inference
     parser_infer.add_argument("-o", "--out",
@@ -163,7 +221,10 @@ def _get_parser():
                               default='2',
                               metavar='TAXONOMIC_LEVEL',
                               help="Taxonomic level to use in specified database, "
-                                   "e.g. 1 = root, 2 = bacteria")
+                                   "e.g. 1 = root, 2 = bacteria. "
+                                   "Several comma-separated levels (e.g. 1,2,1224) "
+                                   "are predicted in a single pass over the input, "
+                                   "and reported in long format with a 'tax' column.")
     parser_train.add_argument("-t", "--tax",
                               type=str,
                               required=True,
@@ -186,6 +247,120 @@ def _get_parser():
                               default="csv",
                               choices=["csv", "tsv", "legacy"],
                               help="Output file format")
+    parser_infer.add_argument("--sort-window",
+                              metavar='N_SEQUENCES',
+                              type=int,
+                              default=_INFER_DEFAULTS['sort_window'],
+                              help="Sort each window of N consecutive sequences by length, "
+                                   "and process sequences of similar length together. "
+                                   "This reduces the computational cost of zero-padding "
+                                   "sequences in a batch. Predictions are written in input "
+                                   "order nevertheless. Default: 0 (no sorting)")
+    parser_infer.add_argument("--stream",
+                              action='store_true',
+                              help="Write predictions to the output as they are computed, "
+                                   "instead of collecting all predictions in memory first. "
+                                   "Use this for very large input files. "
+                                   "Performance on test labels requires an output file.")
+    parser_infer.add_argument("--keep-duplicate-ids",
+                              action='store_true',
+                              help="Report all sequences, also those with an id seen before. "
+                                   "By default, only the first sequence per id is reported, "
+                                   "so that --stream and --chunk-size remember all ids, "
+                                   "which takes memory growing with the number of sequences.")
+    parser_infer.add_argument("--chunk-size",
+                              metavar='N_SEQUENCES',
+                              type=int,
+                              default=_INFER_DEFAULTS['chunk_size'],
+                              help="Process the input file in chunks of N sequences, and "
+                                   "commit the predictions of each chunk to the output file. "
+                                   "Progress is recorded in OUT_FILE.manifest.json, so that "
+                                   "interrupted runs can be continued with --resume. "
+                                   "Requires uncompressed FASTA input and an output file. "
+                                   f"Default: no chunks, or {DEFAULT_CHUNK_SIZE} with --resume")
+    parser_infer.add_argument("--resume",
+                              action='store_true',
+                              help="Continue an interrupted chunked inference run "
+                                   "after its last committed chunk. Refused, if the model "
+                                   "or settings that change the output (e.g. thresholds, "
+                                   "formats, --top-k) differ from the interrupted run.")
+    parser_infer.add_argument("--quantize",
+                              choices=['none', 'dynamic', 'static'],
+                              default=_INFER_DEFAULTS['quantize'],
+                              help="Quantize the model to int8 for faster CPU inference. "
+                                   "'dynamic' quantizes linear layers (e.g. the large "
+                                   "classification layer), 'static' also convolutional "
+                                   "layers, calibrated on sample sequences "
+                                   "(see --calibration-file).")
+    parser_infer.add_argument("--calibration-file",
+                              metavar='FASTA_FILE',
+                              default=_INFER_DEFAULTS['calibration_file'],
+                              help="Sample sequences (FASTA) to calibrate static quantization, "
+                                   "and for --check-quantization. "
+                                   "Default: the first 1000 sequences of the input file.")
+    parser_infer.add_argument("--check-quantization",
+                              action='store_true',
+                              help="Log the agreement of quantized and float models on "
+                                   "the sequences of --calibration-file (required).")
+    parser_infer.add_argument("--fuse-levels",
+                              action='store_true',
+                              help="When predicting several taxonomic levels, evaluate the "
+                                   "convolutions of all levels' models in one grouped "
+                                   "convolution. Requires models of identical architecture "
+                                   "(falls back to separate models otherwise).")
+    parser_infer.add_argument("-k", "--top-k",
+                              metavar='K',
+                              type=int,
+                              default=_INFER_DEFAULTS['top_k'],
+                              help="Report the K best orthologous groups and their "
+                                   "confidences per sequence (see --top-k-format).")
+    parser_infer.add_argument("--top-k-format",
+                              choices=['long', 'wide'],
+                              default=_INFER_DEFAULTS['top_k_format'],
+                              help="Output format with --top-k > 1: one row per sequence "
+                                   "and rank (column 'rank'), or one row per sequence "
+                                   "with columns prediction_1, confidence_1, etc.")
+    parser_infer.add_argument("--temperature",
+                              metavar='TEMPERATURE',
+                              type=float,
+                              default=_INFER_DEFAULTS['temperature'],
+                              help="Divide network outputs by TEMPERATURE before the "
+                                   "softmax to calibrate confidences. By default, any "
+                                   "temperature stored in the model (deepnog train "
+                                   "--calibrate) is used. Predicted groups do not change.")
+    parser_infer.add_argument("--backend",
+                              choices=['torch', 'onnx'],
+                              default=_INFER_DEFAULTS['backend'],
+                              help="Run the network with PyTorch, or with onnxruntime on CPU. "
+                                   "The 'onnx' backend requires the optional onnxruntime "
+                                   "package, and a model exported with "
+                                   "'deepnog export --format onnx'.")
+    parser_infer.add_argument("--deduplicate",
+                              action='store_true',
+                              help="Pass identical sequences through the network only once, "
+                                   "and report their prediction for each of their sequence "
+                                   "ids. Speeds up inference on redundant inputs (e.g. "
+                                   "proteomes of closely related strains).")
+    parser_infer.add_argument("--cache",
+                              action='store_true',
+                              help="Store predictions in a persistent cache, and reuse the "
+                                   "predictions of sequences seen in earlier runs with the "
+                                   "same model and settings. Repeated annotation of largely "
+                                   "unchanged inputs then only costs the new sequences. "
+                                   "Implies --deduplicate.")
+    parser_infer.add_argument("--cache-dir",
+                              metavar='DIR',
+                              default=_INFER_DEFAULTS['cache_dir'],
+                              help="Directory of the persistent prediction cache "
+                                   "(implies --cache). "
+                                   "Default: 'prediction_cache' in the deepnog data home.")
+    parser_infer.add_argument("--cache-size",
+                              metavar='N_SEQUENCES',
+                              type=int,
+                              default=_INFER_DEFAULTS['cache_size'],
+                              help="Maximum number of sequences in the persistent cache. "
+                                   "Least recently used sequences are evicted first. "
+                                   "Default: 10 million")
     parser_infer.add_argument("-c", "--confidence-threshold",
                               metavar='CONFIDENCE',
                               type=float,
@@ -197,22 +372,30 @@ def _get_parser():
     # Arguments for TRAINING only
     parser_train.add_argument("training_sequences",
                               metavar='TRAIN_SEQUENCE_FILE',
-                              help="File containing protein sequences training set.")
+                              help="File containing protein sequences training set, "
+                                   "or a directory created by 'deepnog pack'.")
     parser_train.add_argument("validation_sequences",
                               metavar='VAL_SEQUENCE_FILE',
-                              help="File containing protein sequences validation set.")
+                              help="File containing protein sequences validation set, "
+                                   "or a directory created by 'deepnog pack'.")
     parser_train.add_argument("training_labels",
                               metavar='TRAIN_LABELS_FILE',
-                              help="Orthologous group labels for training set protein sequences.")
+                              nargs='?',
+                              default=None,
+                              help="Orthologous group labels for training set protein sequences. "
+                                   "Not required for packed datasets.")
     parser_train.add_argument("validation_labels",
                               metavar='VAL_LABELS_FILE',
+                              nargs='?',
+                              default=None,
                               help="Orthologous group labels for training and validation set "
                                    "protein sequences. Both training and validation labels "
                                    "Must be in CSV files that are parseable "
                                    "by pandas.read_csv(..., index_col=1). The first column "
                                    "must be a numerical index. The other columns should "
                                    "be named 'protein_id' and 'eggnog_id', or be in order "
-                                   "sequence_identifier first, label_identifier second.")
+                                   "sequence_identifier first, label_identifier second. "
+                                   "Not required for packed datasets.")
     parser_train.add_argument("-e", "--n-epochs",
                               metavar='N_EPOCHS',
                               type=int,
@@ -253,17 +436,197 @@ def _get_parser():
                               help='Seed the random number generators of numpy and PyTorch '
                                    'during training for reproducibility. Also affects cuDNN '
                                    'determinism. Default: None (disables reproducibility)')
+    parser_train.add_argument("--calibrate",
+                              action='store_true',
+                              help="Fit a temperature for calibrated confidences on the "
+                                   "validation set, and store it in the model file.")
+    parser_train.add_argument("--shared-memory",
+                              action='store_true',
+                              help="Keep training and validation sequences in flat, "
+                                   "memory-mapped arrays shared by all data loader workers, "
+                                   "instead of one copy of all sequences per worker. "
+                                   "Packed datasets (see 'deepnog pack') are always shared.")
     parser_train.add_argument("--save-each-epoch",
                               action='store_true',
                               default=False,
                               help='Save the model after each epoch.')
+
+    # Arguments for the inference server
+    parser_serve.add_argument("--host",
+                              default='127.0.0.1',
+                              help="Host name or IP address to listen on.")
+    parser_serve.add_argument("--port",
+                              type=int,
+                              default=8000,
+                              help="TCP port to listen on.")
+    parser_serve.add_argument("--socket",
+                              metavar='SOCKET_FILE',
+                              default=None,
+                              help="Listen on this Unix socket instead of a TCP port.")
+    parser_serve.add_argument("--cache-size",
+                              type=int,
+                              metavar='N_MODELS',
+                              default=4,
+                              help="Maximum number of models kept in memory. "
+                                   "Least recently used models are removed first.")
+    parser_serve.add_argument("-bs", "--batch-size",
+                              type=int,
+                              metavar='BATCH_SIZE',
+                              default=64,
+                              help="Maximum number of sequences per forward pass. "
+                                   "Sequences of concurrent requests are batched together.")
+    parser_serve.add_argument("--max-wait-ms",
+                              type=float,
+                              metavar='MILLISECONDS',
+                              default=5.,
+                              help="Maximum time a sequence waits for further sequences "
+                                   "to fill its batch. Longer waits yield larger batches "
+                                   "and higher throughput, shorter waits lower latency.")
+    parser_serve.add_argument("-d", "--device",
+                              type=str,
+                              default='auto',
+                              choices=['auto', 'cpu', 'gpu', ],
+                              help="Device for inference. Auto chooses GPU if available, "
+                                   "otherwise CPU.")
+    parser_serve.add_argument("-V", "--verbose",
+                              type=int,
+                              metavar='VERBOSE',
+                              default=2,
+                              help="Verbosity of log messages written to stderr. "
+                                   "4 additionally logs every request.")
+
+    # Arguments for model export
+    parser_export.add_argument("-db", "--database",
+                               type=str,
+                               default='eggNOG5',
+                               help="Orthologous group/family database of the model.")
+    parser_export.add_argument("-t", "--tax",
+                               type=str,
+                               default='2',
+                               metavar='TAXONOMIC_LEVEL',
+                               help="Taxonomic level of the model in the database. "
+                                    "Several comma-separated levels export one model each.")
+    parser_export.add_argument("-a", "--architecture",
+                               default="deepnog",
+                               choices=available_architectures,
+                               help="Network architecture of the model.")
+    parser_export.add_argument("-w", "--weights",
+                               metavar='WEIGHTS_FILE',
+                               help="Custom weights file path (optional)")
+    parser_export.add_argument("-o", "--out",
+                               metavar='FILE',
+                               default=None,
+                               help="Output file. Default: next to the weights file, "
+                                    "with suffix '.pt' (or '.onnx'), where 'deepnog infer' "
+                                    "and 'deepnog serve' pick it up automatically.")
+    parser_export.add_argument("-f", "--format",
+                               choices=['torchscript', 'onnx'],
+                               default=_EXPORT_DEFAULTS['format'],
+                               help="Format of the exported model. TorchScript models are "
+                                    "used by 'deepnog infer' automatically, ONNX models with "
+                                    "'deepnog infer --backend onnx'. ONNX export requires the "
+                                    "optional onnx package.")
+    parser_export.add_argument("-V", "--verbose",
+                               type=int,
+                               metavar='VERBOSE',
+                               default=2,
+                               help="Verbosity of log messages written to stderr.")
+
+    # Arguments for packing training data
+    parser_pack.add_argument("file",
+                             metavar='SEQUENCE_FILE',
+                             help="File of protein sequences (training or validation set).")
+    parser_pack.add_argument("labels",
+                             metavar='LABELS_FILE',
+                             help="Orthologous group labels of the sequences "
+                                  "(CSV, as for 'deepnog train').")
+    parser_pack.add_argument("-o", "--out",
+                             metavar='DIR',
+                             required=True,
+                             help="Output directory of the packed dataset. Pass it to "
+                                  "'deepnog train' instead of the sequence and label files.")
+    parser_pack.add_argument("-ff", "--fformat",
+                             type=str,
+                             metavar='FILEFORMAT',
+                             default='fasta',
+                             help="File format of protein sequences. Must be "
+                                  "supported by Biopythons Bio.SeqIO class.")
+    parser_pack.add_argument("-V", "--verbose",
+                             type=int,
+                             metavar='VERBOSE',
+                             default=2,
+                             help="Verbosity of log messages written to stderr.")
+
+    # Arguments for protein embeddings
+    parser_embed.add_argument("file",
+                              metavar='SEQUENCE_FILE',
+                              help="FASTA file of protein sequences to embed.")
+    parser_embed.add_argument("-o", "--out",
+                              metavar='NPY_FILE',
+                              required=True,
+                              help="Output .npy file with one row per input record. "
+                                   "Sequence ids of the rows are written to "
+                                   "NPY_FILE with suffix '.ids.csv'. Load embeddings "
+                                   "without reading them into memory with "
+                                   "numpy.load(NPY_FILE, mmap_mode='r').")
+    parser_embed.add_argument("-db", "--database",
+                              type=str,
+                              default='eggNOG5',
+                              help="Orthologous group/family database of the model.")
+    parser_embed.add_argument("-t", "--tax",
+                              type=str,
+                              default='2',
+                              metavar='TAXONOMIC_LEVEL',
+                              help="Taxonomic level of the model in the database.")
+    parser_embed.add_argument("-a", "--architecture",
+                              default="deepnog",
+                              choices=available_architectures,
+                              help="Network architecture of the model.")
+    parser_embed.add_argument("-w", "--weights",
+                              metavar='WEIGHTS_FILE',
+                              help="Custom weights file path (optional)")
+    parser_embed.add_argument("--dtype",
+                              choices=['float16', 'float32'],
+                              default='float32',
+                              help="Data type of the stored embeddings. "
+                                   "float16 halves the file size.")
+    parser_embed.add_argument("-bs", "--batch-size",
+                              type=int,
+                              metavar='BATCH_SIZE',
+                              default=64,
+                              help="Number of sequences processed by the network at once.")
+    parser_embed.add_argument("-nw", "--num-workers",
+                              type=int,
+                              metavar='NUM_WORKERS',
+                              default=0,
+                              help="Number of subprocesses (workers) to use for data loading.")
+    parser_embed.add_argument("-d", "--device",
+                              type=str,
+                              default='auto',
+                              choices=['auto', 'cpu', 'gpu', ],
+                              help="Device for the network. Auto chooses GPU if available, "
+                                   "otherwise CPU.")
+    parser_embed.add_argument("-V", "--verbose",
+                              type=int,
+                              metavar='VERBOSE',
+                              default=3,
+                              help="Verbosity of log messages written to stderr. "
+                                   "3 includes a progress bar.")
     return parser
 
 
+def _fill_defaults(args, defaults: dict):
+    """ Add default values of options missing from args. """
+    for name, value in defaults.items():
+        if not hasattr(args, name):
+            setattr(args, name, value)
+
+
 def _start_prediction_or_training(args):
     # Importing here makes CLI more snappy
     from deepnog.utils import get_logger, set_device
 
+    _fill_defaults(args, _INFER_DEFAULTS if args.phase == 'infer' else _TRAIN_DEFAULTS)
     logger = get_logger(__name__, verbose=args.verbose)
     logger.info('Starting deepnog')
 
@@ -272,10 +635,14 @@ def _start_prediction_or_training(args):
         logger.error(f'Batch size must be at least one. '
                      f'Got batch size = {args.batch_size} instead.')
         sys.exit(1)
+    if args.max_tokens is not None and args.max_tokens <= 0:
+        logger.error(f'Maximum number of residues per batch must be positive. '
+                     f'Got max tokens = {args.max_tokens} instead.')
+        sys.exit(1)
 
     # Better safe than sorry -- don't overwrite existing files
     if args.out is not None:
-        if Path(args.out).is_file():
+        if Path(args.out).is_file() and not (args.phase == 'infer' and args.resume):
             logger.error(f'Output file {args.out} already exists.')
             sys.exit(1)
         elif args.phase == 'infer' and (Path(args.out).is_dir() or args.out.endswith('/')):
@@ -301,8 +668,11 @@ def _start_inference(args, arch_module, arch_cls):
     from pandas import read_csv, DataFrame
     import torch
     from deepnog.data import ProteinIterableDataset
-    from deepnog.learning import predict
-    from deepnog.utils import create_df, get_logger, get_weights_path, load_nn
+    from deepnog.learning import PersistentPredictionCache, PredictionCache, predict
+    from deepnog.learning.cache import DEFAULT_PERSISTENT_CACHE_SIZE, cache_namespace
+    from deepnog.utils import PredictionWriter, create_df, get_exported_path, get_logger
+    from deepnog.utils import file_digest, get_data_home, get_weights_path, load_nn
+    from deepnog.utils import is_compressed, is_current_export, prediction_columns
     from deepnog.utils.metrics import estimate_performance
 
     logger = get_logger(__name__, verbose=args.verbose)
@@ -310,18 +680,54 @@ def _start_inference(args, arch_module, arch_cls):
     # Users may override with environmental variable: export OMP_NUM_THREADS=8
     torch.set_num_threads(1)
 
-    # Construct path to saved parameters of NN
-    if args.weights is not None:
-        weights_path = args.weights
-    else:
-        weights_path = get_weights_path(database=args.database,
-                                        level=str(args.tax),
-                                        architecture=args.architecture,
-                                        verbose=args.verbose,
-                                        )
-    # Load neural network parameters
-    logger.info(f'Loading NN-parameters from {weights_path} ...')
-    model_dict = torch.load(weights_path, map_location=args.device)
+    levels = [level.strip() for level in str(args.tax).split(',')]
+    if len(levels) > 1 and args.weights is not None:
+        logger.error('Custom weights (--weights) apply to a single taxonomic level only.')
+        sys.exit(1)
+    if len(levels) > 1 and args.test_labels is not None:
+        logger.error('Measuring test set performance requires a single taxonomic level.')
+        sys.exit(1)
+    if args.confidence_threshold is not None and not 0.0 < args.confidence_threshold <= 1.0:
+        logger.error(f'Invalid confidence threshold specified: '
+                     f'{args.confidence_threshold} not in range (0, 1].')
+        sys.exit(1)
+    top_k = args.top_k
+    top_k_format = args.top_k_format
+    if top_k < 1:
+        logger.error(f'Number of reported groups must be at least one. '
+                     f'Got --top-k {top_k} instead.')
+        sys.exit(1)
+    if top_k > 1 and args.test_labels is not None:
+        logger.error('Measuring test set performance requires --top-k 1.')
+        sys.exit(1)
+    if args.temperature is not None and args.temperature <= 0:
+        logger.error(f'Temperature must be positive. Got {args.temperature} instead.')
+        sys.exit(1)
+
+    cache_size = args.cache_size
+    if cache_size is not None and cache_size <= 0:
+        logger.error(f'Cache size must be at least one. '
+                     f'Got cache size = {cache_size} instead.')
+        sys.exit(1)
+
+    if args.stream and args.test_labels is not None and args.out is None:
+        logger.error('Measuring test set performance with --stream '
+                     'requires an output file (--out).')
+        sys.exit(1)
+    chunked = args.chunk_size is not None or args.resume
+    if chunked and (args.out is None or args.fformat != 'fasta'):
+        logger.error('Chunked inference (--chunk-size, --resume) requires '
+                     'FASTA input and an output file (--out).')
+        sys.exit(1)
+    if chunked and is_compressed(args.file):
+        # Seeking to each chunk would decompress everything before it
+        logger.error('Chunked inference (--chunk-size, --resume) requires '
+                     'uncompressed input. Please decompress the input file first.')
+        sys.exit(1)
+    if args.chunk_size is not None and args.chunk_size <= 0:
+        logger.error(f'Chunk size must be at least one. '
+                     f'Got chunk size = {args.chunk_size} instead.')
+        sys.exit(1)
 
     # Load dataset
     logger.info(f'Accessing dataset from {args.file} ...')
@@ -329,42 +735,136 @@ def _start_inference(args, arch_module, arch_cls):
                                      labels_file=args.test_labels,
                                      f_format=args.fformat)
 
-    # Load class names
-    try:
-        class_labels = model_dict['classes']
-    except KeyError:
-        class_labels = dataset.label_encoder.classes_
-
-    # Load neural network model
-    model = load_nn(architecture=(arch_module, arch_cls),
-                    model_dict=model_dict,
-                    phase=args.phase,
-                    device=args.device)
-
-    # If given, set confidence threshold for prediction
-    if args.confidence_threshold is not None:
-        if 0.0 < args.confidence_threshold <= 1.0:
-            threshold = float(args.confidence_threshold)
+    precision = args.precision
+    if precision != 'fp32' and args.quantize != 'none':
+        logger.error(f'Quantized models cannot run in {precision} precision.')
+        sys.exit(1)
+    # Exported models cannot be fused, quantized, or run in mixed precision
+    use_exported = (args.quantize == 'none' and precision == 'fp32'
+                    and not (len(levels) > 1 and args.fuse_levels))
+    backend = args.backend
+    if backend == 'onnx' and not use_exported:
+        logger.error('The onnx backend cannot be combined with --quantize, --precision, '
+                     'or --fuse-levels.')
+        sys.exit(1)
+    models = []
+    class_labels = []
+    thresholds = []
+    temperatures = []
+    weights_paths = []
+    for level in levels:
+        # Construct path to saved parameters of NN
+        if args.weights is not None:
+            weights_path = args.weights
         else:
-            logger.error(f'Invalid confidence threshold specified: '
-                         f'{args.confidence_threshold} not in range (0, 1].')
-            sys.exit(1)
-    elif hasattr(model, 'threshold'):
-        threshold = float(model.threshold)
-        logger.info(f'Applying confidence threshold from model: {threshold}')
+            weights_path = get_weights_path(database=args.database,
+                                            level=level,
+                                            architecture=args.architecture,
+                                            verbose=args.verbose,
+                                            )
+        weights_paths.append(weights_path)
+        exported_path = get_exported_path(weights_path)
+        if backend == 'onnx':
+            exported_path = get_exported_path(weights_path, 'onnx')
+            if not is_current_export(exported_path, weights_path):
+                logger.error(f'No current ONNX model at {exported_path}. Create it with '
+                             f'"deepnog export --format onnx" first.')
+                sys.exit(1)
+            # Run the exported graph with onnxruntime on CPU
+            logger.info(f'Loading ONNX model from {exported_path} ...')
+            model = load_nn(architecture=(arch_module, arch_cls),
+                            model_dict=exported_path,
+                            phase=args.phase,
+                            device=args.device)
+            class_labels.append(model.classes)
+        elif use_exported and is_current_export(exported_path, weights_path):
+            # Frozen TorchScript model created by 'deepnog export'
+            logger.info(f'Loading exported model from {exported_path} ...')
+            model = load_nn(architecture=(arch_module, arch_cls),
+                            model_dict=exported_path,
+                            phase=args.phase,
+                            device=args.device)
+            class_labels.append(model.classes)
+        else:
+            # Load neural network parameters
+            logger.info(f'Loading NN-parameters from {weights_path} ...')
+            model_dict = torch.load(weights_path, map_location=args.device)
+
+            # Load class names
+            try:
+                class_labels.append(model_dict['classes'])
+            except KeyError:
+                class_labels.append(dataset.label_encoder.classes_)
+
+            # Load neural network model
+            model = load_nn(architecture=(arch_module, arch_cls),
+                            model_dict=model_dict,
+                            phase=args.phase,
+                            device=args.device)
+        models.append(model)
+
+        # If given, set confidence threshold for prediction
+        if args.confidence_threshold is not None:
+            thresholds.append(float(args.confidence_threshold))
+        elif hasattr(model, 'threshold'):
+            thresholds.append(float(model.threshold))
+            logger.info(f'Applying confidence threshold from model: {thresholds[-1]}')
+        else:
+            thresholds.append(None)
+
+        # Calibrate confidences with a given temperature, or the model's
+        if args.temperature is not None:
+            temperatures.append(args.temperature)
+        elif getattr(model, 'temperature', None) is not None:
+            temperatures.append(float(model.temperature))
+            logger.info(f'Applying temperature from model: {temperatures[-1]}')
+        else:
+            temperatures.append(None)
+
+    if len(levels) == 1:
+        model, class_labels, threshold = models[0], class_labels[0], thresholds[0]
+        temperature = temperatures[0]
+        levels = None
     else:
-        threshold = None
+        # Predict all levels in one pass, and report them in long format
+        model, threshold, temperature = models, thresholds, temperatures
+        if args.fuse_levels:
+            from deepnog.models.deepnog import MultiDeepNOG
+            try:
+                model = MultiDeepNOG(models)
+                logger.info(f'Evaluating {len(models)} levels with a shared convolutional pass')
+            except ValueError as e:
+                logger.warning(f'Cannot fuse models of different levels: {e} '
+                               f'Evaluating each level separately.')
 
-    # Predict labels of given data
-    logger.info('Starting protein sequence group/family inference ...')
-    logger.debug(f'Processing {args.batch_size} sequences per iteration (minibatch)')
-    preds, confs, ids, indices = predict(model, dataset, args.device,
-                                         batch_size=args.batch_size,
-                                         num_workers=args.num_workers,
-                                         verbose=args.verbose)
+    columns = prediction_columns(levels, top_k, top_k_format)
+    # One cache for all chunks of the input file
+    cache_dir = args.cache_dir
+    use_cache = args.cache or cache_dir is not None
+    quantize = args.quantize
+    if use_cache or chunked:
+        # Hash full files: retrained weights may differ in any byte
+        weights_digests = [file_digest(path) for path in weights_paths]
+        calibration_digest = None
+        if quantize == 'static':
+            calibration_digest = file_digest(args.calibration_file
+                                             or args.file)
+    if use_cache:
+        if cache_dir is None:
+            cache_dir = get_data_home(verbose=args.verbose)/'prediction_cache'
+        # Predictions depend on the weights and on settings applied before thresholding
+        namespace = cache_namespace(args.architecture, weights_digests, backend, top_k,
+                                    temperatures, quantize, calibration_digest, precision)
+        cache = PersistentPredictionCache(Path(cache_dir)/'predictions.sqlite', namespace,
+                                          max_size=cache_size or DEFAULT_PERSISTENT_CACHE_SIZE)
+        logger.info(f'Using prediction cache {cache.path} ({len(cache)} sequences)')
+    elif args.deduplicate:
+        cache = PredictionCache()
+    else:
+        cache = None
 
-    # Construct results dataframe
-    df = create_df(class_labels, preds, confs, ids, indices, threshold=threshold)
+    if quantize != 'none':
+        model = _quantize(args, model, logger)
 
     if args.out is None:
         save_file = sys.stdout
@@ -374,9 +874,71 @@ def _start_inference(args, arch_module, arch_cls):
         Path(args.out).parent.mkdir(parents=True, exist_ok=True)
         logger.info(f'Writing prediction to {save_file}')
 
-    columns = ['sequence_id', 'prediction', 'confidence']
     separator = {'csv': ',', 'tsv': '\t', 'legacy': ';'}.get(args.outformat)
-    df.to_csv(save_file, sep=separator, index=False, columns=columns)
+
+    # Predict labels of given data
+    logger.info('Starting protein sequence group/family inference ...')
+    logger.debug(f'Processing {args.batch_size} sequences per iteration (minibatch)')
+    if chunked:
+        # Settings that determine the output rows must not change upon --resume
+        settings = {'database': args.database,
+                    'tax': str(args.tax),
+                    'architecture': args.architecture,
+                    'weights': weights_digests,
+                    'backend': backend,
+                    'outformat': args.outformat,
+                    'confidence_threshold': thresholds,
+                    'top_k': top_k,
+                    'top_k_format': top_k_format,
+                    'keep_duplicate_ids': args.keep_duplicate_ids,
+                    'temperature': temperatures,
+                    'quantize': quantize,
+                    'calibration': calibration_digest,
+                    'precision': precision,
+                    }
+        _predict_in_chunks(args, model, dataset, class_labels, threshold=threshold,
+                           separator=separator, columns=columns, levels=levels,
+                           temperature=temperature, cache=cache, settings=settings)
+        if args.test_labels is not None:
+            df = read_csv(save_file, sep=separator, dtype=object)
+    elif args.stream:
+        with PredictionWriter(save_file, class_labels, threshold=threshold,
+                              sep=separator, columns=columns, levels=levels,
+                              top_k=top_k, top_k_format=top_k_format,
+                              deduplicate=not args.keep_duplicate_ids) as writer:
+            predict(model, dataset, args.device,
+                    batch_size=args.batch_size,
+                    num_workers=args.num_workers,
+                    verbose=args.verbose,
+                    sort_window=args.sort_window,
+                    max_tokens=args.max_tokens,
+                    writer=writer,
+                    top_k=top_k,
+                    temperature=temperature,
+                    cache=cache,
+                    precision=precision)
+        if args.test_labels is not None:
+            df = read_csv(save_file, sep=separator, dtype=object)
+    else:
+        preds, confs, ids, indices = predict(model, dataset, args.device,
+                                             batch_size=args.batch_size,
+                                             num_workers=args.num_workers,
+                                             verbose=args.verbose,
+                                             sort_window=args.sort_window,
+                                             max_tokens=args.max_tokens,
+                                             top_k=top_k,
+                                             temperature=temperature,
+                                             cache=cache,
+                                             precision=precision)
+
+        # Construct results dataframe
+        df = create_df(class_labels, preds, confs, ids, indices,
+                       threshold=threshold, levels=levels,
+                       top_k=top_k, top_k_format=top_k_format,
+                       deduplicate=not args.keep_duplicate_ids)
+        df.to_csv(save_file, sep=separator, index=False, columns=columns)
+    if isinstance(cache, PersistentPredictionCache):
+        cache.close()
 
     # Measure test set performance, if labels were provided
     if args.test_labels is not None:
@@ -397,13 +959,143 @@ def _start_inference(args, arch_module, arch_cls):
     return
 
 
+def _quantize(args, model, logger):
+    """ Quantize one or several models, and optionally log agreement with the float models. """
+    from copy import deepcopy
+    import torch
+    from deepnog.learning import quantization_agreement, quantize_model
+
+    if torch.device(args.device).type != 'cpu':
+        logger.error('Quantized models are only supported on CPU (use --device cpu).')
+        sys.exit(1)
+    calibration_file = args.calibration_file
+    check = args.check_quantization
+    if check and calibration_file is None:
+        logger.error('--check-quantization requires a --calibration-file.')
+        sys.exit(1)
+    if args.quantize == 'static' and calibration_file is None:
+        if args.fformat != 'fasta':
+            logger.error('Static quantization requires a FASTA --calibration-file '
+                         'for non-FASTA input.')
+            sys.exit(1)
+        calibration_file = args.file
+    models = model if isinstance(model, list) else [model]
+    quantized = []
+    for float_model in models:
+        q_model = quantize_model(deepcopy(float_model) if check else float_model,
+                                 mode=args.quantize,
+                                 calibration_data=calibration_file,
+                                 batch_size=args.batch_size, verbose=args.verbose)
+        if check:
+            perf = quantization_agreement(float_model, q_model, calibration_file,
+                                          batch_size=args.batch_size)
+            logger.info(f'Quantized model ({args.quantize}) agrees with float model on '
+                        f'{100 * perf["accuracy"]:.2f}% of sample sequences.')
+        quantized.append(q_model)
+    return quantized if isinstance(model, list) else quantized[0]
+
+
+def _predict_in_chunks(args, model, dataset, class_labels, threshold, separator, columns,
+                       levels=None, temperature=None, cache=None, settings: dict = None):
+    """ Predict chunks of records, and commit each chunk to the output file.
+
+    Each chunk is read from a copy of the ``dataset``, so that labels and
+    record offsets are only loaded once.
+
+    Progress is recorded in a manifest next to the output file, so that
+    an interrupted run can be continued with ``--resume``. The ``settings``
+    that determine the output (model, thresholds, format, etc.) are recorded
+    as well, and resuming with different settings is refused.
+    """
+    from copy import copy
+    import json
+    import os
+    from deepnog.learning import predict
+    from deepnog.utils import (PredictionWriter, file_fingerprint, get_logger,
+                               read_manifest, write_manifest)
+
+    logger = get_logger(__name__, verbose=args.verbose)
+    out_file = Path(args.out)
+    manifest_file = out_file.with_name(out_file.name + '.manifest.json')
+    fingerprint = file_fingerprint(args.file)
+    # As read back from the manifest, e.g. tuples as lists
+    settings = json.loads(json.dumps(settings or {}))
+    n_records = dataset.load_index(verbose=args.verbose).size - 1
+
+    manifest = read_manifest(manifest_file) if args.resume else None
+    if manifest is not None:
+        if manifest['fingerprint'] != fingerprint:
+            logger.error(f'Cannot resume: {args.file} differs from the input '
+                         f'recorded in {manifest_file}.')
+            sys.exit(1)
+        changed = sorted(key for key in settings
+                         if manifest.get('settings', {}).get(key) != settings[key])
+        if changed:
+            logger.error(f'Cannot resume: settings ({", ".join(changed)}) differ from '
+                         f'those recorded in {manifest_file}.')
+            sys.exit(1)
+        if not out_file.is_file() or out_file.stat().st_size < manifest['output_size']:
+            logger.error(f'Cannot resume: {out_file} is shorter than the committed '
+                         f'predictions recorded in {manifest_file}.')
+            sys.exit(1)
+        # Discard predictions written after the last committed chunk
+        os.truncate(out_file, manifest['output_size'])
+        start = manifest['next_record']
+        chunk_size = args.chunk_size or manifest['chunk_size']
+        logger.info(f'Resuming after {start}/{n_records} committed records.')
+    elif args.resume and out_file.is_file():
+        logger.error(f'Cannot resume: no progress manifest {manifest_file} found.')
+        sys.exit(1)
+    else:
+        start = 0
+        chunk_size = args.chunk_size or DEFAULT_CHUNK_SIZE
+        # A manifest of an earlier run does not describe the new output
+        if manifest_file.is_file():
+            manifest_file.unlink()
+        out_file.write_bytes(b'')
+
+    top_k = args.top_k
+    with PredictionWriter(out_file, class_labels, threshold=threshold,
+                          sep=separator, columns=columns, append=True,
+                          levels=levels, top_k=top_k,
+                          top_k_format=args.top_k_format,
+                          deduplicate=not args.keep_duplicate_ids) as writer:
+        for chunk_start in range(start, n_records, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, n_records)
+            logger.info(f'Processing records {chunk_start + 1}-{chunk_stop} of {n_records}')
+            chunk = copy(dataset)
+            chunk.record_range = (chunk_start, chunk_stop)
+            predict(model, chunk, args.device,
+                    batch_size=args.batch_size,
+                    num_workers=args.num_workers,
+                    verbose=args.verbose,
+                    sort_window=args.sort_window,
+                    max_tokens=args.max_tokens,
+                    writer=writer,
+                    top_k=top_k,
+                    temperature=temperature,
+                    cache=cache,
+                    precision=args.precision)
+            writer.flush()
+            write_manifest(manifest_file, {'input': str(args.file),
+                                           'fingerprint': fingerprint,
+                                           'n_records': n_records,
+                                           'chunk_size': chunk_size,
+                                           'settings': settings,
+                                           'next_record': chunk_stop,
+                                           'output_size': out_file.stat().st_size,
+                                           })
+    logger.info(f'All {n_records} records processed.')
+
+
 def _start_training(args, arch_module, arch_cls):
     import random
     import string
     import numpy as np
     from pandas import DataFrame
     import torch
-    from deepnog.learning import fit
+    from deepnog.data import is_packed_dataset
+    from deepnog.learning import fit, fit_temperature
     from deepnog.utils import get_logger
 
     logger = get_logger(__name__, verbose=args.verbose)
@@ -412,6 +1104,12 @@ def _start_training(args, arch_module, arch_cls):
         logger.error(f'Number of epochs must be greater than or equal '
                      f'one. Got n_epochs = {args.n_epochs} instead.')
         sys.exit(1)
+    for sequences, labels in ((args.training_sequences, args.training_labels),
+                              (args.validation_sequences, args.validation_labels)):
+        if labels is None and not is_packed_dataset(sequences):
+            logger.error(f'Labels of {sequences} are required, unless it is a packed '
+                         f'dataset (see "deepnog pack").')
+            sys.exit(1)
     out_dir = Path(args.out)
     logger.info(f'Output directory: {out_dir} (creating, if necessary)')
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -434,6 +1132,7 @@ def _start_training(args, arch_module, arch_cls):
                   validation_labels=args.validation_labels,
                   data_loader_params={'batch_size': args.batch_size,
                                       'num_workers': args.num_workers},
+                  max_tokens=args.max_tokens,
                   learning_rate=args.learning_rate,
                   learning_rate_params={'step_size': 1,
                                         'gamma': args.gamma,
@@ -448,14 +1147,24 @@ def _start_training(args, arch_module, arch_cls):
                   out_dir=out_dir,
                   experiment_name=experiment_name,
                   save_each_epoch=args.save_each_epoch,
+                  shared_memory=args.shared_memory,
+                  precision=args.precision,
                   # TODO add the rest of the parameters to the client
                   )
 
+    model_dict = {'classes': results.training_dataset.label_encoder.classes_,
+                  'model_state_dict': results.model.state_dict()}
+    if args.calibrate:
+        logger.info('Fitting temperature for calibrated confidences on the validation set')
+        results.model.eval()
+        model_dict['temperature'] = fit_temperature(results.model,
+                                                    results.validation_dataset,
+                                                    device=args.device,
+                                                    batch_size=args.batch_size,
+                                                    verbose=args.verbose)
     # Save model to output dir
     logger.info(f'Saving model to {model_file}...')
-    torch.save({'classes': results.training_dataset.label_encoder.classes_,
-                'model_state_dict': results.model.state_dict()},
-               model_file)
+    torch.save(model_dict, model_file)
     # Save a dataframe of several training/validation statistics
     logger.info(f'Saving evaluation statistics to {eval_file}... '
                 f'Load with pandas.read_csv().')
@@ -474,11 +1183,146 @@ def _start_training(args, arch_module, arch_cls):
     return
 
 
+def _start_server(args):
+    from deepnog.server import ModelCache, make_server
+    from deepnog.utils import get_logger
+
+    logger = get_logger(__name__, verbose=args.verbose)
+    if args.batch_size <= 0 or args.cache_size <= 0:
+        logger.error(f'Batch size and cache size must be at least one. Got '
+                     f'batch size = {args.batch_size}, cache size = {args.cache_size}.')
+        sys.exit(1)
+    if args.max_wait_ms < 0:
+        logger.error(f'Maximum wait time must not be negative. '
+                     f'Got {args.max_wait_ms} ms instead.')
+        sys.exit(1)
+    cache = ModelCache(capacity=args.cache_size, device=args.device,
+                       batch_size=args.batch_size, max_wait_ms=args.max_wait_ms,
+                       verbose=args.verbose)
+    server = make_server(cache, host=args.host, port=args.port,
+                         socket_path=args.socket, verbose=args.verbose)
+    address = args.socket if args.socket else f'http://{args.host}:{server.server_port}'
+    logger.info(f'Serving predictions at {address} (device: {cache.device})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Shutting down')
+    finally:
+        server.server_close()
+        cache.close()
+
+
+def _start_export(args):
+    import torch
+    from deepnog.utils import export_model, get_exported_path, get_logger
+    from deepnog.utils import get_weights_path, load_nn
+
+    _fill_defaults(args, _EXPORT_DEFAULTS)
+    logger = get_logger(__name__, verbose=args.verbose)
+    config = get_config()
+    arch = config['architecture'][args.architecture]
+    levels = [level.strip() for level in str(args.tax).split(',')]
+    if len(levels) > 1 and (args.weights is not None or args.out is not None):
+        logger.error('Custom weights (--weights) and output files (--out) '
+                     'apply to a single taxonomic level only.')
+        sys.exit(1)
+    for level in levels:
+        if args.weights is not None:
+            weights_path = args.weights
+        else:
+            weights_path = get_weights_path(database=args.database,
+                                            level=level,
+                                            architecture=args.architecture,
+                                            verbose=args.verbose,
+                                            )
+        model_dict = torch.load(weights_path, map_location='cpu')
+        model = load_nn(architecture=(arch['module'], arch['class']),
+                        model_dict=model_dict,
+                        phase='infer',
+                        device='cpu')
+        export_format = args.format
+        if args.out is not None:
+            out = args.out
+        else:
+            out = get_exported_path(weights_path, export_format)
+        export_model(model, out, class_labels=model_dict['classes'],
+                     threshold=getattr(model, 'threshold', None),
+                     export_format=export_format)
+        logger.info(f'Exported {weights_path} to {out}')
+
+
+def _start_embedding(args):
+    import torch
+    from deepnog.data import ProteinIterableDataset
+    from deepnog.learning import embed
+    from deepnog.utils import get_fasta_index, get_logger, get_weights_path, load_nn
+    from deepnog.utils import set_device
+
+    logger = get_logger(__name__, verbose=args.verbose)
+    if args.batch_size <= 0:
+        logger.error(f'Batch size must be at least one. '
+                     f'Got batch size = {args.batch_size} instead.')
+        sys.exit(1)
+    if Path(args.out).exists():
+        logger.error(f'Output file {args.out} already exists.')
+        sys.exit(1)
+    device = set_device(args.device)
+    config = get_config()
+    arch = config['architecture'][args.architecture]
+    if args.weights is not None:
+        weights_path = args.weights
+    else:
+        weights_path = get_weights_path(database=args.database,
+                                        level=args.tax,
+                                        architecture=args.architecture,
+                                        verbose=args.verbose,
+                                        )
+    logger.info(f'Loading NN-parameters from {weights_path} ...')
+    model = load_nn(architecture=(arch['module'], arch['class']),
+                    model_dict=torch.load(weights_path, map_location=device),
+                    phase='infer',
+                    device=device)
+    if not hasattr(model, 'embed'):
+        logger.error(f'The {args.architecture} architecture does not provide embeddings.')
+        sys.exit(1)
+
+    # Preallocate one row per record of the input file
+    n_records = get_fasta_index(args.file, verbose=args.verbose).size - 1
+    dataset = ProteinIterableDataset(args.file, f_format='fasta')
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    embed(model, dataset, args.out, n_sequences=n_records, device=device,
+          batch_size=args.batch_size, num_workers=args.num_workers,
+          dtype=args.dtype, verbose=args.verbose)
+    logger.info('All done.')
+
+
+def _start_packing(args):
+    from deepnog.data import is_packed_dataset, pack_dataset
+    from deepnog.utils import get_logger
+
+    logger = get_logger(__name__, verbose=args.verbose)
+    if is_packed_dataset(args.out):
+        logger.error(f'Packed dataset {args.out} already exists.')
+        sys.exit(1)
+    pack_dataset(args.file, args.labels, args.out, f_format=args.fformat,
+                 verbose=args.verbose)
+    logger.info('All done.')
+
+
 def main():
     """ DeepNOG command line tool. """
     parser = _get_parser()
     args = parser.parse_args()
-    _start_prediction_or_training(args)
+    if args.phase == 'serve':
+        _start_server(args)
+    elif args.phase == 'export':
+        _start_export(args)
+    elif args.phase == 'embed':
+        _start_embedding(args)
+    elif args.phase == 'pack':
+        _start_packing(args)
+    else:
+        _start_prediction_or_training(args)
 
 
 if __name__ == '__main__':
@@ -6,10 +6,14 @@ Description:
 """
 import argparse
 from copy import deepcopy
+from functools import partial
+import gzip
 from io import BytesIO
+import json
 from pathlib import Path
 import pytest
 import shutil
+import sqlite3
 import subprocess
 import tempfile
 from unittest import mock
@@ -20,7 +24,12 @@ import pandas as pd
 import torch
 
 from deepnog.client import main
+from deepnog.client.client import _start_embedding, _start_export  # noqa
 from deepnog.client.client import _start_prediction_or_training  # noqa
+from deepnog.client.client import _EXPORT_DEFAULTS, _INFER_DEFAULTS, _TRAIN_DEFAULTS  # noqa
+from deepnog.client.client import _fill_defaults, _get_parser  # noqa
+from deepnog.data import dataset
+from deepnog.utils import network, read_fasta
 from deepnog.utils.io_utils import get_data_home
 from deepnog import __version__
 
@@ -37,6 +46,7 @@ Y_TRUE = np.array([[0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2,
                    [0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2, 0, 2,
                     1, 1, 1, 1, 1, 1, 1, 1]])
 EGGNOG5_BACT_WEIGHTS = get_data_home()/'eggNOG5/2/deepnog.pth'
+TEST_WEIGHTS = DEEPNOG_TEST/'parameters/test_deepnog.pthsmall'
 
 
 def try_to_unlink(f: Path):
@@ -46,6 +56,16 @@ def try_to_unlink(f: Path):
         pass
 
 
+def _infer_args(out, file=TEST_FILE, **kwargs):
+    """ Arguments of 'deepnog infer' on CPU with the small test weights,
+    with attributes overridden by keyword arguments. """
+    args = _get_parser().parse_args(['infer', str(file), '--out', str(out),
+                                     '--weights', str(TEST_WEIGHTS), '--device', 'cpu',
+                                     '--batch-size', '8', '--verbose', '0'])
+    vars(args).update(kwargs)
+    return args
+
+
 def test_entrypoint():
     process = subprocess.run(['deepnog', '--version'], capture_output=True)
     assert process.returncode == 0, (f'Could not invoke deepnog on the '
@@ -85,6 +105,359 @@ def test_run_inference(config):
             _start_prediction_or_training(args)
 
 
+def test_chunked_inference_resume():
+    """ Test committing chunks of predictions, and resuming after interruption. """
+    _args = _infer_args
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        # ignore warnings due to duplicate sequence ids in the test file
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        _start_prediction_or_training(_args(outdir/'full.csv'))
+        _start_prediction_or_training(_args(outdir/'chunked.csv', chunk_size=24))
+        full = pd.read_csv(outdir/'full.csv')
+        chunked = pd.read_csv(outdir/'chunked.csv')
+        pd.testing.assert_series_equal(full.sequence_id, chunked.sequence_id)
+        manifest = outdir/'chunked.csv.manifest.json'
+        assert manifest.is_file()
+
+        # Simulate an interruption after two chunks
+        expected = (outdir/'chunked.csv').read_text()
+        _start_prediction_or_training(_args(outdir/'interrupted.csv', chunk_size=24))
+        progress = json.loads(manifest.read_text())
+        n_committed_records = 48
+        ids = [sequence_id for sequence_id, _ in read_fasta(TEST_FILE)]
+        n_committed_rows = len(set(ids[:n_committed_records]))
+        committed = ''.join(expected.splitlines(keepends=True)[:1 + n_committed_rows])
+        (outdir/'interrupted.csv').write_text(committed + 'partial,chunk,0.5\n')
+        progress['next_record'] = n_committed_records
+        progress['output_size'] = len(committed.encode())
+        (outdir/'interrupted.csv.manifest.json').write_text(json.dumps(progress))
+
+        # Refuse to resume with settings that change the output
+        for changed in [{'confidence_threshold': 0.5}, {'outformat': 'tsv'},
+                        {'top_k': 2}, {'temperature': 2.}, {'tax': '1'}]:
+            with pytest.raises(SystemExit):
+                _start_prediction_or_training(_args(outdir/'interrupted.csv', resume=True,
+                                                    **changed))
+        assert (outdir/'interrupted.csv').read_text().endswith('partial,chunk,0.5\n')
+
+        _start_prediction_or_training(_args(outdir/'interrupted.csv', resume=True))
+        assert (outdir/'interrupted.csv').read_text() == expected
+
+        # A new run does not leave the manifest of an earlier run behind,
+        # even if it is interrupted before its first commit
+        (outdir/'interrupted.csv').unlink()
+        with mock.patch('deepnog.learning.predict', side_effect=KeyboardInterrupt):
+            with pytest.raises(KeyboardInterrupt):
+                _start_prediction_or_training(_args(outdir/'interrupted.csv', chunk_size=24))
+        assert not (outdir/'interrupted.csv.manifest.json').exists()
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'interrupted.csv', resume=True))
+        # Refuse to resume, if the output is shorter than the committed predictions
+        (outdir/'interrupted.csv.manifest.json').write_text(json.dumps(progress))
+        (outdir/'interrupted.csv').write_text(committed[:-10])
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'interrupted.csv', resume=True))
+        assert (outdir/'interrupted.csv').read_text() == committed[:-10]
+        (outdir/'interrupted.csv').write_text(expected)
+
+        # Labels are read once for all chunks
+        with mock.patch('deepnog.data.dataset._read_labels',
+                        wraps=dataset._read_labels) as read_labels:
+            _start_prediction_or_training(_args(outdir/'labels.csv', file=TEST_FILE_SHORT,
+                                                test_labels=TEST_LABELS_SHORT, chunk_size=1))
+            assert read_labels.call_count == 1
+        assert len(pd.read_csv(outdir/'labels.csv')) == 2
+        # Seeking to the chunks of compressed input would decompress it again and again
+        compressed = outdir/'input.faa.gz'
+        with gzip.open(compressed, 'wb') as f:
+            f.write(TEST_FILE.read_bytes())
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'compressed.csv', file=compressed,
+                                                chunk_size=24))
+
+        # Refuse to overwrite without --resume, and to resume without manifest
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'interrupted.csv', chunk_size=24))
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'full.csv', resume=True))
+
+
+@pytest.mark.parametrize('mode', ['default', 'stream', 'chunked'])
+@pytest.mark.parametrize('top_k_format', ['long', 'wide'])
+def test_top_k_inference(mode, top_k_format):
+    """ Test reporting the two best groups per sequence. """
+    _args = partial(_infer_args, stream=mode == 'stream',
+                    chunk_size=24 if mode == 'chunked' else None)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        _start_prediction_or_training(_args(outdir/'top1.csv'))
+        _start_prediction_or_training(_args(outdir/'top2.csv', top_k=2,
+                                            top_k_format=top_k_format, temperature=2.))
+        expected = pd.read_csv(outdir/'top1.csv')
+        df = pd.read_csv(outdir/'top2.csv')
+        if top_k_format == 'long':
+            assert list(df.columns) == ['sequence_id', 'rank', 'prediction', 'confidence']
+            assert df['rank'].tolist() == [1, 2] * len(expected)
+            best = df[df['rank'] == 1].reset_index(drop=True)
+            second = df[df['rank'] == 2].reset_index(drop=True)
+        else:
+            assert list(df.columns) == ['sequence_id', 'prediction_1', 'confidence_1',
+                                        'prediction_2', 'confidence_2']
+            best = df.rename(columns={'prediction_1': 'prediction',
+                                      'confidence_1': 'confidence'})
+            second = df.rename(columns={'prediction_2': 'prediction',
+                                        'confidence_2': 'confidence'})
+        pd.testing.assert_series_equal(best.sequence_id, expected.sequence_id)
+        pd.testing.assert_series_equal(best.prediction, expected.prediction)
+        assert (best.prediction != second.prediction).all()
+        # The temperature softens confidences without changing the ranking
+        assert (best.confidence <= expected.confidence + 1e-6).all()
+        assert (best.confidence >= second.confidence).all()
+
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'top0.csv', top_k=0))
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'cold.csv', temperature=0.))
+
+
+@pytest.mark.parametrize('mode', ['default', 'stream', 'chunked'])
+def test_deduplicated_inference(mode):
+    """ Test predicting duplicate sequences once. """
+    _args = partial(_infer_args, batch_size=1, stream=mode == 'stream',
+                    chunk_size=70 if mode == 'chunked' else None)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        # Each sequence twice, under different ids
+        redundant = outdir/'redundant.faa'
+        with open(redundant, 'w') as f:
+            for copy in range(2):
+                for i, (_, residues) in enumerate(read_fasta(TEST_FILE)):
+                    f.write(f'>seq{i}_{copy}\n{residues.decode()}\n')
+        _start_prediction_or_training(_args(outdir/'all.csv', file=redundant))
+        _start_prediction_or_training(_args(outdir/'unique.csv', file=redundant,
+                                            deduplicate=True))
+        expected = pd.read_csv(outdir/'all.csv')
+        df = pd.read_csv(outdir/'unique.csv')
+        assert len(df) == 200
+        pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize('mode', ['default', 'stream', 'chunked'])
+def test_keep_duplicate_ids(mode):
+    """ Test reporting all sequences, also those with ids seen before. """
+    _args = partial(_infer_args, stream=mode == 'stream',
+                    chunk_size=24 if mode == 'chunked' else None)
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        _start_prediction_or_training(_args(outdir/'first.csv'))
+        _start_prediction_or_training(_args(outdir/'all.csv', keep_duplicate_ids=True))
+        ids = [sequence_id for sequence_id, _ in read_fasta(TEST_FILE)]
+        first = pd.read_csv(outdir/'first.csv')
+        df = pd.read_csv(outdir/'all.csv')
+        assert len(set(ids)) == len(first) < len(df) == len(ids)
+        assert df.sequence_id.astype(str).tolist() == ids
+        pd.testing.assert_frame_equal(df.drop_duplicates('sequence_id', keep='first')
+                                      .reset_index(drop=True), first)
+
+
+def test_cached_inference():
+    """ Test reusing predictions of earlier runs from a persistent cache. """
+    _args = partial(_infer_args, batch_size=1)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        cache_file = outdir/'cache/predictions.sqlite'
+        _start_prediction_or_training(_args(outdir/'expected.csv'))
+        _start_prediction_or_training(_args(outdir/'first.csv', cache_dir=str(outdir/'cache')))
+        assert cache_file.is_file()
+        with mock.patch('deepnog.models.deepnog.DeepNOG.forward',
+                        side_effect=AssertionError('Cached sequence recomputed')):
+            _start_prediction_or_training(_args(outdir/'second.csv',
+                                                cache_dir=str(outdir/'cache')))
+        expected = pd.read_csv(outdir/'expected.csv')
+        for out in ('first.csv', 'second.csv'):
+            pd.testing.assert_frame_equal(pd.read_csv(outdir/out), expected)
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'empty.csv', cache=True, cache_size=0))
+
+
+@pytest.mark.parametrize('stream, fuse_levels', [(False, False), (True, False), (False, True)])
+def test_multi_level_inference(monkeypatch, stream, fuse_levels):
+    """ Test predicting several taxonomic levels in one pass. """
+    _args = partial(_infer_args, weights=None, stream=stream, fuse_levels=fuse_levels)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        tmpdir = Path(tmpdir)
+        for tax in ['1', '2']:
+            (tmpdir/'eggNOG5'/tax).mkdir(parents=True)
+            shutil.copy(TEST_WEIGHTS, tmpdir/'eggNOG5'/tax/'deepnog.pth')
+        monkeypatch.setenv('DEEPNOG_DATA', str(tmpdir))
+
+        _start_prediction_or_training(_args(tmpdir/'single.csv', weights=str(TEST_WEIGHTS)))
+        _start_prediction_or_training(_args(tmpdir/'multi.csv', tax='1,2'))
+        single = pd.read_csv(tmpdir/'single.csv')
+        multi = pd.read_csv(tmpdir/'multi.csv', dtype={'tax': str})
+        assert list(multi.columns) == ['sequence_id', 'tax', 'prediction', 'confidence']
+        assert len(multi) == 2 * len(single)
+        for i, tax in enumerate(['1', '2']):
+            level = multi.iloc[i::2].reset_index(drop=True)
+            assert (level.tax == tax).all()
+            pd.testing.assert_frame_equal(level.drop(columns='tax'), single)
+
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(tmpdir/'multi.csv', tax='1,2',
+                                                weights=str(TEST_WEIGHTS)))
+
+
+@pytest.mark.parametrize('quantize', ['dynamic', 'static'])
+def test_quantized_inference(quantize):
+    """ Test int8 quantization with local weights. """
+    _args = _infer_args
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        _start_prediction_or_training(_args(outdir/'float.csv'))
+        _start_prediction_or_training(_args(outdir/'int8.csv', quantize=quantize,
+                                            calibration_file=TEST_FILE_SHORT,
+                                            check_quantization=True))
+        df_float = pd.read_csv(outdir/'float.csv')
+        df_int8 = pd.read_csv(outdir/'int8.csv')
+        pd.testing.assert_series_equal(df_float.sequence_id, df_int8.sequence_id)
+        assert (df_float.prediction == df_int8.prediction).mean() > 0.8
+        # Agreement is only checked on explicit calibration sequences
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'check.csv', quantize=quantize,
+                                                check_quantization=True))
+        assert not (outdir/'check.csv').exists()
+        # Quantized models run in int8 only
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'bf16.csv', quantize=quantize,
+                                                precision='bf16'))
+
+
+def test_mixed_precision_inference():
+    """ Test bfloat16 inference with local weights. """
+    _args = _infer_args
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        outdir = Path(outdir)
+        _start_prediction_or_training(_args(outdir/'fp32.csv'))
+        _start_prediction_or_training(_args(outdir/'bf16.csv', precision='bf16'))
+        df_fp32 = pd.read_csv(outdir/'fp32.csv')
+        df_bf16 = pd.read_csv(outdir/'bf16.csv')
+        pd.testing.assert_series_equal(df_fp32.sequence_id, df_bf16.sequence_id)
+        assert (df_fp32.prediction == df_bf16.prediction).mean() > 0.95
+        np.testing.assert_allclose(df_bf16.confidence, df_fp32.confidence, atol=1e-2)
+        with pytest.raises(SystemExit):
+            _start_prediction_or_training(_args(outdir/'onnx.csv', precision='bf16',
+                                                backend='onnx'))
+
+
+def test_export_and_infer(monkeypatch):
+    """ Test exporting TorchScript models, which inference then picks up. """
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        tmpdir = Path(tmpdir)
+        weights_path = tmpdir/'eggNOG5'/'2'/'deepnog.pth'
+        weights_path.parent.mkdir(parents=True)
+        shutil.copy(TEST_WEIGHTS, weights_path)
+        monkeypatch.setenv('DEEPNOG_DATA', str(tmpdir))
+
+        def _infer(out):
+            _start_prediction_or_training(_infer_args(out, weights=None))
+            return pd.read_csv(out)
+
+        expected = _infer(tmpdir/'float.csv')
+        _start_export(argparse.Namespace(database='eggNOG5', tax='2', architecture='deepnog',
+                                         weights=None, out=None, verbose=0))
+        assert weights_path.with_suffix('.pt').is_file()
+        with mock.patch('deepnog.utils.network.load_exported',
+                        wraps=network.load_exported) as load_exported:
+            exported = _infer(tmpdir/'exported.csv')
+            assert load_exported.call_count == 1
+        pd.testing.assert_frame_equal(exported, expected)
+
+
+def test_onnx_backend(monkeypatch):
+    """ Test inference of ONNX models with onnxruntime against the torch backend. """
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=UserWarning)
+        tmpdir = Path(tmpdir)
+        weights_path = tmpdir/'eggNOG5'/'2'/'deepnog.pth'
+        weights_path.parent.mkdir(parents=True)
+        shutil.copy(TEST_WEIGHTS, weights_path)
+        monkeypatch.setenv('DEEPNOG_DATA', str(tmpdir))
+
+        def _infer(out, backend, **kwargs):
+            _start_prediction_or_training(_infer_args(out, weights=None, backend=backend,
+                                                      **kwargs))
+            return pd.read_csv(out)
+
+        cache_dir = str(tmpdir/'cache')
+        expected = _infer(tmpdir/'torch.csv', 'torch', cache_dir=cache_dir)
+        # The ONNX model must be exported first
+        with pytest.raises(SystemExit):
+            _infer(tmpdir/'onnx.csv', 'onnx')
+        _start_export(argparse.Namespace(database='eggNOG5', tax='2', architecture='deepnog',
+                                         weights=None, out=None, verbose=0, format='onnx'))
+        assert weights_path.with_suffix('.onnx').is_file()
+        assert not weights_path.with_suffix('.pt').is_file()
+        result = _infer(tmpdir/'onnx.csv', 'onnx', cache_dir=cache_dir)
+        # Predictions of different backends are cached separately
+        connection = sqlite3.connect(str(tmpdir/'cache/predictions.sqlite'))
+        try:
+            assert connection.execute('SELECT COUNT(DISTINCT namespace) '
+                                      'FROM predictions').fetchone()[0] == 2
+        finally:
+            connection.close()
+        pd.testing.assert_frame_equal(result.drop(columns='confidence'),
+                                      expected.drop(columns='confidence'))
+        np.testing.assert_allclose(result.confidence, expected.confidence, atol=1e-5)
+
+
+def test_embed():
+    """ Test writing embeddings of all sequences to a .npy file. """
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        out = Path(tmpdir)/'embeddings'/'test.npy'
+        args = argparse.Namespace(file=str(TEST_FILE), out=str(out), database='eggNOG5',
+                                  tax='2', architecture='deepnog',
+                                  weights=str(TEST_WEIGHTS),
+                                  dtype='float16', batch_size=16, num_workers=0,
+                                  device='cpu', verbose=0)
+        _start_embedding(args)
+        embeddings = np.load(str(out), mmap_mode='r')
+        assert embeddings.shape == (100, 1200) and embeddings.dtype == np.float16
+        ids = pd.read_csv(out.with_suffix('.ids.csv'), dtype={'sequence_id': str})
+        assert ids.sequence_id.tolist() == [sequence_id for sequence_id, _ in read_fasta(TEST_FILE)]
+        del embeddings
+        # Do not overwrite existing files
+        with pytest.raises(SystemExit):
+            _start_embedding(args)
+
+
 @pytest.mark.parametrize('tax', [1, 2, ])
 def test_inference_cmd_line_invocation(tax):
     df_true = pd.DataFrame({'sequence_id': [0, 1],
@@ -183,6 +556,20 @@ def test_main_and_argparsing(mock_args):  # noqa
     try_to_unlink(Path('out.mock.2'))
 
 
+def test_option_defaults():
+    """ Defaults for programmatic Namespace objects match the parser's. """
+    parser = _get_parser()
+    for arguments, defaults in [(['infer', str(TEST_FILE)], _INFER_DEFAULTS),
+                                (['train', 'a', 'b', 'c', 'd', '-db', 'x', '-o', 'out',
+                                  '-t', '1'], _TRAIN_DEFAULTS),
+                                (['export'], _EXPORT_DEFAULTS)]:
+        args = vars(parser.parse_args(arguments))
+        assert {name: args[name] for name in defaults} == defaults
+    args = argparse.Namespace(tax='2')
+    _fill_defaults(args, _INFER_DEFAULTS)
+    assert args.tax == '2' and args.top_k == 1 and args.backend == 'torch'
+
+
 def test_args_sanity_check():
     def _assert_exits(func, arguments):
         with pytest.raises(SystemExit) as e:
@@ -203,6 +590,10 @@ def test_args_sanity_check():
     args_bs.batch_size = 0
     _assert_exits(_start_prediction_or_training, args_bs)
 
+    args_tokens = deepcopy(args)
+    args_tokens.max_tokens = 0
+    _assert_exits(_start_prediction_or_training, args_tokens)
+
     args_out = deepcopy(args)
     args_out.out = existing_file
     _assert_exits(_start_prediction_or_training, args_out)
@@ -229,6 +620,62 @@ def test_args_sanity_check():
     _assert_exits(_start_prediction_or_training, args_out_dir)
 
 
+def test_training_with_calibration():
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir:
+        proc = subprocess.run(['deepnog', 'train',
+                               f'{TRAINING_FASTA}', f'{TRAINING_FASTA}',
+                               f'{TRAINING_CSV}', f'{TRAINING_CSV}',
+                               '--tax', '2', '--out', outdir, '--database', 'dummy_db',
+                               '--n-epochs', '1', '--verbose', '0', '--random-seed', '42',
+                               '--calibrate',
+                               ],
+                              capture_output=True,
+                              )
+        assert proc.returncode == 0, proc.stderr
+        model_file, = Path(outdir).glob('*.pth')
+        model_dict = torch.load(model_file)
+        assert model_dict['temperature'] > 0
+        model = network.load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer')
+        assert model.temperature == model_dict['temperature']
+
+
+def test_training_from_packed_dataset():
+    """ Test 'deepnog pack', and training on packed datasets. """
+    def _train(out, *data):
+        proc = subprocess.run(['deepnog', 'train', *data,
+                               '--tax', '2', '--out', out, '--database', 'dummy_db',
+                               '--n-epochs', '2', '--verbose', '0', '--random-seed', '42',
+                               '--num-workers', '0'],
+                              capture_output=True,
+                              )
+        assert proc.returncode == 0, proc.stderr
+        eval_file, = Path(out).glob('*_eval.csv')
+        return pd.read_csv(eval_file)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as outdir:
+        outdir = Path(outdir)
+        packed = outdir/'packed'
+        proc = subprocess.run(['deepnog', 'pack', f'{TRAINING_FASTA}', f'{TRAINING_CSV}',
+                               '--out', f'{packed}', '--verbose', '0'],
+                              capture_output=True)
+        assert proc.returncode == 0, proc.stderr
+        proc = subprocess.run(['deepnog', 'pack', f'{TRAINING_FASTA}', f'{TRAINING_CSV}',
+                               '--out', f'{packed}', '--verbose', '0'],
+                              capture_output=True)
+        assert proc.returncode == 1, 'Packed dataset overwritten'
+
+        expected = _train(outdir/'files', f'{TRAINING_FASTA}', f'{TRAINING_FASTA}',
+                          f'{TRAINING_CSV}', f'{TRAINING_CSV}')
+        df = _train(outdir/'packed_model', f'{packed}', f'{packed}')
+        pd.testing.assert_frame_equal(df, expected)
+
+        proc = subprocess.run(['deepnog', 'train', f'{TRAINING_FASTA}', f'{packed}',
+                               '--tax', '2', '--database', 'dummy_db',
+                               '--out', f'{outdir/"missing_labels"}'],
+                              capture_output=True)
+        assert proc.returncode == 1
+
+
 def test_training_cmd_line_invocation():
     outdir = tempfile.mkdtemp(prefix='deepnog_test_')
     tax = 2
@@ -1,13 +1,21 @@
-from .dataset import collate_sequences, gen_amino_acid_vocab
+from .batching import BucketBatchSampler, BucketedIterableDataset
+from .dataset import collate_sequences, gen_amino_acid_lut, gen_amino_acid_vocab
 from .dataset import ProteinIterator, ProteinIterableDataset, ShuffledProteinIterableDataset
 from .dataset import ProteinDataset
+from .packed import PackedProteinDataset, is_packed_dataset, pack_dataset
 from .split import group_train_val_test_split, train_val_test_split
 from ..utils.imports import try_import_pytorch
 
-__all__ = ['collate_sequences',
+__all__ = ['BucketBatchSampler',
+           'BucketedIterableDataset',
+           'collate_sequences',
+           'gen_amino_acid_lut',
            'gen_amino_acid_vocab',
            'group_train_val_test_split',
+           'is_packed_dataset',
+           'pack_dataset',
            'train_val_test_split',
+           'PackedProteinDataset',
            'ProteinDataset',
            'ProteinIterator',
            'ProteinIterableDataset',
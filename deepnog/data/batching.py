@@ -0,0 +1,205 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Batch protein sequences of similar length to reduce zero-padding.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from itertools import islice
+from typing import List, Sequence
+
+import numpy as np
+
+from ..utils import try_import_pytorch
+
+torch = try_import_pytorch()
+from torch.utils.data import IterableDataset, Sampler  # noqa
+
+__all__ = ['BucketBatchSampler',
+           'BucketedIterableDataset',
+           ]
+
+
+def _default_window(batch_size: int = None) -> int:
+    """ Number of sequences to sort at once, unless set explicitly. """
+    return 100 * batch_size if batch_size else 2 ** 14
+
+
+def _sorted_batches(lengths: np.ndarray, batch_size: int = None,
+                    max_tokens: int = None, min_length: int = 36,
+                    ) -> List[np.ndarray]:
+    """ Sort by length, and split into batches of consecutive lengths.
+
+    Parameters
+    ----------
+    lengths : np.ndarray
+        Sequence lengths
+    batch_size : int, optional
+        Maximum number of sequences per batch
+    max_tokens : int, optional
+        Maximum number of residues per zero-padded batch, that is,
+        number of sequences times length of the longest sequence.
+        Sequences longer than ``max_tokens`` form a batch of their own.
+    min_length : int, optional
+        Minimum length sequences are padded to (see ``collate_sequences``)
+
+    Returns
+    -------
+    batches : list of np.ndarray
+        Positions (in ``lengths``) of the members of each batch
+    """
+    order = np.argsort(lengths, kind='stable')
+    if max_tokens is None:
+        return [order[i:i + batch_size] for i in range(0, order.size, batch_size)]
+
+    # Sorted ascending, so the current sequence is always the longest one
+    padded = np.maximum(lengths[order], min_length).tolist()
+    batches = []
+    start = 0
+    for stop, length in enumerate(padded):
+        n_seqs = stop - start + 1
+        if stop > start and (n_seqs * length > max_tokens
+                             or (batch_size and n_seqs > batch_size)):
+            batches.append(order[start:stop])
+            start = stop
+    if start < order.size:
+        batches.append(order[start:])
+    return batches
+
+
+def _check_batch_params(batch_size, max_tokens):
+    if not batch_size and not max_tokens:
+        raise ValueError('Either batch_size or max_tokens must be given.')
+    if max_tokens is not None and max_tokens <= 0:
+        raise ValueError(f'max_tokens must be positive, got {max_tokens}.')
+
+
+class BucketBatchSampler(Sampler):
+    """ Batch sampler yielding batches of sequences with similar length.
+
+    Sequences are processed in windows of ``window`` consecutive indices.
+    Within each window, sequences are sorted by length and split into
+    batches. This reduces zero-padding considerably compared to batching
+    in file order, while keeping the sampler's memory requirements bounded.
+
+    Parameters
+    ----------
+    lengths : sequence of int
+        Length of each sequence in the dataset
+    batch_size : int, optional
+        Maximum number of sequences per batch
+    window : int, optional
+        Number of sequences to sort at once.
+        By default, use 100 times the batch size
+        (or 16384 sequences, if only ``max_tokens`` is given).
+    shuffle : bool, optional
+        Shuffle the dataset before bucketing, and the order of batches
+        within each window.
+    max_tokens : int, optional
+        Maximum number of residues per zero-padded batch
+        (number of sequences times length of the longest sequence).
+        Batches then hold many short, or few long sequences,
+        which keeps memory requirements predictable.
+        At least one of ``batch_size`` and ``max_tokens`` is required.
+    """
+    def __init__(self, lengths: Sequence[int], batch_size: int = None,
+                 window: int = None, shuffle: bool = False,
+                 max_tokens: int = None):
+        _check_batch_params(batch_size, max_tokens)
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.window = window if window else _default_window(batch_size)
+        self.shuffle = shuffle
+        self.max_tokens = max_tokens
+
+    def _batches(self, indices):
+        for start in range(0, indices.size, self.window):
+            window = indices[start:start + self.window]
+            batches = _sorted_batches(self.lengths[window], self.batch_size,
+                                      self.max_tokens)
+            if self.shuffle:
+                np.random.shuffle(batches)
+            for batch in batches:
+                yield window[batch].tolist()
+
+    def __iter__(self):
+        if self.shuffle:
+            indices = np.random.permutation(self.lengths.size)
+        else:
+            indices = np.arange(self.lengths.size)
+        return self._batches(indices)
+
+    def __len__(self):
+        """ Number of batches.
+
+        With ``max_tokens``, this is exact without shuffling,
+        and an estimate otherwise.
+        """
+        if self.max_tokens is not None:
+            return sum(1 for _ in self._batches(np.arange(self.lengths.size)))
+        n_full, rest = divmod(self.lengths.size, self.window)
+        return n_full * -(-self.window // self.batch_size) + -(-rest // self.batch_size)
+
+
+class BucketedIterableDataset(IterableDataset):
+    """ Iterable dataset yielding batches of sequences with similar length.
+
+    Sequences from the wrapped dataset are collected in a look-ahead buffer
+    of ``window`` sequences, sorted by length, and emitted as batches.
+    Use with ``DataLoader(..., batch_size=None)``.
+    Sequence positions (``index``) are kept, so that predictions can be
+    mapped back to file order (see :func:`deepnog.utils.create_df`).
+
+    Parameters
+    ----------
+    dataset : ProteinIterableDataset
+        The dataset to draw sequences from.
+        Attributes not defined here are looked up in this dataset.
+    batch_size : int, optional
+        Maximum number of sequences per batch
+    window : int, optional
+        Size of the look-ahead buffer.
+        By default, use 100 times the batch size
+        (or 16384 sequences, if only ``max_tokens`` is given).
+    max_tokens : int, optional
+        Maximum number of residues per zero-padded batch
+        (number of sequences times length of the longest sequence).
+        At least one of ``batch_size`` and ``max_tokens`` is required.
+    shuffle : bool, optional
+        Shuffle the order of batches within each window, so that batches
+        are not emitted by ascending length (e.g. during training).
+        Sequences are drawn from the wrapped dataset in its own order.
+    """
+    def __init__(self, dataset, batch_size: int = None, window: int = None,
+                 max_tokens: int = None, shuffle: bool = False):
+        _check_batch_params(batch_size, max_tokens)
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.window = window if window else _default_window(batch_size)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+
+    def __getattr__(self, name):
+        if name == 'dataset':  # not yet set, e.g. during unpickling
+            raise AttributeError(name)
+        return getattr(self.dataset, name)
+
+    def __iter__(self):
+        sequences = iter(self.dataset)
+        while True:
+            buffer = list(islice(sequences, self.window))
+            if not buffer:
+                return
+            lengths = np.fromiter((len(seq.encoded) for seq in buffer),
+                                  dtype=np.int64, count=len(buffer))
+            batches = _sorted_batches(lengths, self.batch_size, self.max_tokens)
+            if self.shuffle:
+                # Seeded per data loader worker and epoch by PyTorch
+                batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+            for batch in batches:
+                yield [buffer[i] for i in batch]
+
+    def __len__(self):
+        """ Number of sequences (not batches) in the wrapped dataset. """
+        return len(self.dataset)
@@ -8,11 +8,14 @@ Description:
     Dataset classes and helper functions for usage with deep network models
     written in PyTorch.
 """
-import gzip
-from itertools import islice
+from itertools import count, islice
+import os
 from pathlib import Path
-from typing import List, Union, NamedTuple, Sequence
+import shutil
+import tempfile
+from typing import List, Union, NamedTuple, Sequence, Tuple
 import warnings
+import weakref
 
 import numpy as np
 import pandas as pd
@@ -20,7 +23,9 @@ from sklearn.preprocessing import LabelEncoder
 from Bio.SeqRecord import SeqRecord
 
 from ..utils import get_logger, SynchronizedCounter
-from ..utils import EXTENDED_IUPAC_PROTEIN_ALPHABET, parse, SeqIO
+from ..utils import EXTENDED_IUPAC_PROTEIN_ALPHABET, parse
+from ..utils import get_fasta_index, is_compressed, open_binary, read_fasta, read_labels
+from ..utils import split_fasta_record
 from ..utils import try_import_pytorch
 
 torch = try_import_pytorch()
@@ -28,6 +33,7 @@ from torch.utils.data import Dataset, IterableDataset  # noqa
 from torch.utils.data.dataloader import default_collate  # noqa
 
 __all__ = ['collate_sequences',
+           'gen_amino_acid_lut',
            'gen_amino_acid_vocab',
            'ProteinDataset',
            'ProteinIterableDataset',
@@ -40,7 +46,7 @@ sequence_tuple = NamedTuple('sequence',
                             [('index', int),
                              ('id', str),
                              ('string', str),
-                             ('encoded', list),
+                             ('encoded', np.ndarray),
                              ('label', torch.Tensor)])
 
 # Class of data-minibatches
@@ -101,7 +107,7 @@ def collate_sequences(batch: Union[List[sequence_tuple], sequence_tuple],
     # Collate the sequences
     sequences = np.zeros((n_data, max_len,), dtype=np.int)
     for i, seq in enumerate(batch):
-        sequence = np.array(seq.encoded)
+        sequence = seq.encoded
         # If selected, choose randomly, where to insert zeros
         if random_padding and len(sequence) < max_len:
             n_zeros = max_len - len(sequence)
@@ -111,7 +117,7 @@ def collate_sequences(batch: Union[List[sequence_tuple], sequence_tuple],
             start = 0
             end = len(sequence)
         # Zero pad
-        sequences[i, start:end] = sequence[:].T
+        sequences[i, start:end] = sequence
     # Convert NumPy array to PyTorch Tensor
     sequences = default_collate(sequences)
 
@@ -169,23 +175,50 @@ def gen_amino_acid_vocab(alphabet=None):
     return vocab
 
 
-def _consume(iterator, n: int):
-    """ Advance the iterator n-steps ahead. If n is None, consume entirely.
+def gen_amino_acid_lut(alphabet=None) -> np.ndarray:
+    """ Create a lookup table for encoding protein sequences.
+
+    The table performs the same mapping as the vocabulary created by
+    :func:`gen_amino_acid_vocab`, but acts on bytes. This allows to
+    encode a complete sequence at once, e.g.
+    ``lut[np.frombuffer(b'MATTAC', dtype=np.uint8)]``.
+
+    Parameters
+    ----------
+    alphabet : str
+        Alphabet to use for vocabulary.
+        If None, use 'ACDEFGHIKLMNPQRSTVWYBXZJUO' (equivalent to deprecated
+        Biopython's ExtendedIUPACProtein).
 
-    Function from Itertools Recipes in official Python 3.7.4. docs.
+    Returns
+    -------
+    lut : np.ndarray, shape (256,), dtype uint8
+        Numerical code of each byte value. Bytes that are not
+        in the alphabet are mapped to zero.
     """
-    # Use functions that consume iterators at C speed.
-    # advance to the empty slice starting at position n
-    next(islice(iterator, n, n), None)
+    return _lut_from_vocab(gen_amino_acid_vocab(alphabet))
+
+
+def _lut_from_vocab(vocab: dict) -> np.ndarray:
+    lut = np.zeros(256, dtype=np.uint8)
+    for aa, ix in vocab.items():
+        lut[ord(aa)] = ix
+    return lut
+
+
+def _encode(residues: bytes, lut: np.ndarray) -> np.ndarray:
+    """ Encode a protein sequence with a lookup table from gen_amino_acid_lut. """
+    return lut.take(np.frombuffer(residues, dtype=np.uint8))
 
 
 class ProteinIterator:
     """ Iterator allowing for multiprocess data loading of a sequence file.
 
-    ProteinIterator is a wrapper for the iterator returned by
-    Biopython's Bio.SeqIO class when parsing a sequence file. It
-    specifies custom __next__() method to support single- and multi-process
-    data loading.
+    ProteinIterator is a wrapper for an iterator over the records of a
+    sequence file. FASTA files are read with the lean
+    :func:`deepnog.utils.read_fasta`, any other formats with Biopython's
+    Bio.SeqIO class. It specifies custom __next__() method to support
+    single- and multi-process data loading.
 
     In the single-process loading case, nothing special happens,
     the ProteinIterator sequentially iterates over the data file. In the end,
@@ -197,6 +230,14 @@ class ProteinIterator:
     This works by each worker skipping num_worker - 1 data samples
     for each call to __next__(). Furthermore, each worker skips
     worker_id data samples in the initialization.
+    If record offsets of a FASTA file are provided (see
+    :func:`deepnog.utils.get_fasta_index`), each worker instead reads a
+    contiguous 1/num_workers-th of the (uncompressed) file. The byte range
+    is extended to the start of the next record, so that each record is
+    read by exactly one worker. Sequence positions are taken from the
+    offsets, and remain globally correct. Alternatively, workers read
+    interleaved blocks of ``block_size`` records, which keeps the
+    sequences emitted by a multi-process DataLoader close to file order.
 
     The ProteinIterator class also makes sure that a unique ID is set for each
     SeqRecord obtained from the data-iterator. This allows unambiguous handling
@@ -208,15 +249,17 @@ class ProteinIterator:
     Parameters
     ----------
     file_ : str
-        Path to sequence file, from which an iterator over the sequences
-        will be created with Biopython's Bio.SeqIO.parse() function.
+        Path to a possibly compressed sequence file, from which an iterator
+        over the sequences will be created.
     labels : pd.DataFrame
         Dataframe storing labels associated to the sequences.
         This is required for training, and ignored during inference.
         Must contain 'protein_id' and 'label_num' columns providing
         identifiers and numerical labels.
     aa_vocab : dict
-        Amino-acid vocabulary mapping letters to integers
+        Amino-acid vocabulary mapping letters to integers.
+        Sequences are encoded with the equivalent lookup table
+        (see :func:`gen_amino_acid_lut`).
     f_format : str
         File format in which to expect the protein sequences.
         Must be supported by Biopython's Bio.SeqIO class.
@@ -225,20 +268,47 @@ class ProteinIterator:
         If bigger or equal to two, the multi-process loading case happens.
     worker_id : int
         ID of worker this iterator belongs to
+    offsets : np.ndarray, optional
+        Byte offsets of the records in a FASTA file,
+        as returned by :func:`deepnog.utils.get_fasta_index`.
+    block_size : int, optional
+        If given, read every num_workers-th block of ``block_size`` records
+        instead of a contiguous share (with ``offsets``) or every
+        num_workers-th record (without).
+    record_range : (int, int), optional
+        If given together with ``offsets``, only read records
+        start, start + 1, ..., stop - 1 (counting from zero).
+    label_from_id : dict, optional
+        Numerical label of each sequence id. If given, ``labels``
+        is ignored, and the mapping is not built again.
     """
 
     def __init__(self, file_, labels: pd.DataFrame, aa_vocab, f_format,
                  n_skipped: Union[int, SynchronizedCounter] = 0,
-                 num_workers=1, worker_id=0):
+                 num_workers=1, worker_id=0, offsets: np.ndarray = None,
+                 block_size: int = None, record_range: Tuple[int, int] = None,
+                 label_from_id: dict = None):
         # Generate file-iterator
-        if Path(file_).suffix == '.gz':
-            f = gzip.open(file_, 'rt')
-            iterator = SeqIO.parse(f, format=f_format, )
+        if offsets is not None:
+            if block_size:
+                ranges = _block_records(offsets, num_workers, worker_id, block_size,
+                                        record_range)
+            else:
+                ranges = [_shard_records(offsets, num_workers, worker_id, record_range)]
+            records = _read_fasta_records(file_, offsets, ranges)
         else:
-            iterator = SeqIO.parse(file_, format=f_format, )
-        self.iterator = iterator
+            if f_format == 'fasta':
+                records = read_fasta(file_)
+            else:
+                records = ((f'{record.id}', str(record.seq).encode('ascii', 'replace'))
+                           for record in parse(file_, fformat=f_format))
+            records = _stride_records(records, num_workers, worker_id, block_size)
+        self.iterator = records
 
-        if labels is None:
+        if label_from_id is not None:
+            self.label_from_id = label_from_id
+            self.has_labels = True
+        elif labels is None:
             self.has_labels = False
             self.label_from_id = {}
         else:
@@ -250,15 +320,12 @@ class ProteinIterator:
             self.has_labels = True
 
         self.vocab = aa_vocab
+        self.lut = _lut_from_vocab(aa_vocab)
         self.n_skipped = n_skipped
 
-        # Start position
-        self.start: int = worker_id
+        # Position of the current sequence in the file (starting at one)
         self.pos: int = UNINITIALIZED_POS
 
-        # Number of sequences to skip for each next() call.
-        self.step: int = num_workers - 1
-
     def __iter__(self):
         return self
 
@@ -271,43 +338,92 @@ class ProteinIterator:
         Returns
         -------
         sequence : namedtuple
-            Element at current + step + 1 position or start position.
+            Next element dedicated to this worker.
             Furthermore prefixes element with unique sequential ID.
             Contains sequence data and metadata, i.e. all relevant
             information deepnog needs to perform and store predictions
             for one protein sequence.
         """
-        # Check if iterator has been positioned correctly.
-        if self.pos == UNINITIALIZED_POS:
-            _consume(self.iterator, n=self.start)
-            self.pos = self.start + 1
-        else:
-            _consume(self.iterator, n=self.step)
-            self.pos += self.step + 1
-
-        next_seq = next(self.iterator)
+        self.pos, sequence_id, residues = next(self.iterator)
         # If sequence has no identifier, skip it.
         # Also skip sequences that should have labels, but don't.
-        sequence_id: str = f'{next_seq.id}'
         label = self.label_from_id.get(sequence_id)
         while sequence_id == '' or (self.has_labels and label is None):
             self.n_skipped += 1
-            _consume(self.iterator, n=self.step)
-            self.pos += self.step + 1
-            next_seq = next(self.iterator)
-            sequence_id: str = f'{next_seq.id}'
+            self.pos, sequence_id, residues = next(self.iterator)
             label = self.label_from_id.get(sequence_id)
-        # Generate sequence object from SeqRecord
-        encoded = [self.vocab.get(c, 0) for c in next_seq.seq]
+        # Generate sequence object
         sequence = sequence_tuple(index=self.pos,
                                   id=sequence_id,
-                                  string=str(next_seq.seq),
-                                  encoded=encoded,
+                                  string=residues.decode(),
+                                  encoded=_encode(residues, self.lut),
                                   label=label)
 
         return sequence
 
 
+def _stride_records(records, num_workers: int = 1, worker_id: int = 0,
+                    block_size: int = None):
+    """ Yield position, id, and residues of every num_workers-th record.
+
+    If ``block_size`` is given, every num_workers-th block of ``block_size``
+    records instead. Records dedicated to other workers are parsed and discarded.
+    """
+    if not block_size:
+        positions = count(start=worker_id + 1, step=num_workers)
+        for pos, (sequence_id, residues) in zip(positions,
+                                                islice(records, worker_id, None, num_workers)):
+            yield pos, sequence_id, residues
+        return
+    for pos, (sequence_id, residues) in enumerate(records, start=1):
+        if (pos - 1) // block_size % num_workers == worker_id:
+            yield pos, sequence_id, residues
+
+
+def _shard_records(offsets: np.ndarray, num_workers: int = 1, worker_id: int = 0,
+                   record_range: Tuple[int, int] = None):
+    """ Get the range of records starting in the worker's share of bytes.
+
+    If ``record_range`` is given, only the bytes of these records are shared.
+
+    Returns
+    -------
+    start, stop : int
+        The worker reads records start, start + 1, ..., stop - 1.
+    """
+    first, last = record_range if record_range is not None else (0, offsets.size - 1)
+    n_bytes = offsets[last] - offsets[first]
+    start_byte = offsets[first] + n_bytes * worker_id // num_workers
+    stop_byte = offsets[first] + n_bytes * (worker_id + 1) // num_workers
+    # Resynchronize at the next record title
+    start, stop = np.searchsorted(offsets[first:last], [start_byte, stop_byte], side='left')
+    return first + int(start), first + int(stop)
+
+
+def _block_records(offsets: np.ndarray, num_workers: int = 1, worker_id: int = 0,
+                   block_size: int = 1, record_range: Tuple[int, int] = None):
+    """ Get the ranges of records in every num_workers-th block of records.
+
+    Returns
+    -------
+    ranges : list of (int, int)
+        The worker reads records start, start + 1, ..., stop - 1 of each range.
+    """
+    first, last = record_range if record_range is not None else (0, offsets.size - 1)
+    return [(start, min(start + block_size, last))
+            for start in range(first + worker_id * block_size, last, num_workers * block_size)]
+
+
+def _read_fasta_records(file_, offsets: np.ndarray, ranges):
+    """ Yield position, id, and residues of the FASTA records in the given ranges. """
+    with open_binary(file_) as f:
+        for start, stop in ranges:
+            f.seek(offsets[start])
+            for i in range(start, stop):
+                sequence_id, residues = split_fasta_record(f.read(offsets[i + 1] - offsets[i]))
+                yield i + 1, sequence_id, residues
+
+
 class ProteinIterableDataset(IterableDataset):
     """ Protein dataset holding the proteins to classify.
 
@@ -334,38 +450,55 @@ class ProteinIterableDataset(IterableDataset):
     label_encoder : LabelEncoder, optional
         The label encoder maps str class names to numerical labels.
         Provide a label encoder during validation.
+    use_index : bool, optional
+        During multi-process loading of FASTA files, let workers seek
+        directly to their sequences using a persistent index of record
+        offsets (see :func:`deepnog.utils.get_fasta_index`).
+        The index is loaded (or built) by :meth:`load_index` in the main
+        process, before workers are started, e.g. by
+        :func:`deepnog.learning.predict`. Workers never build the index
+        themselves, but parse the file if it was not loaded.
+        Not used for gzip or xz compressed files, in which seeking
+        decompresses everything before the target: workers then parse
+        the whole file, and keep every num_workers-th record.
+    block_size : int, optional
+        If given, workers read interleaved blocks of ``block_size`` records
+        instead of contiguous shares of the file (or every n-th record).
+        Sequences are then emitted approximately in file order,
+        e.g. for streaming predictions to an output file.
+    record_range : (int, int), optional
+        Only read the FASTA records start, start + 1, ..., stop - 1
+        (counting from zero), e.g. to process a large file in chunks.
+        Records are located with the index of record offsets.
+        Sequence positions (``index``) still refer to the whole file.
     """
 
     def __init__(self, file, labels_file: str = None, f_format='fasta',
-                 label_encoder: LabelEncoder = None):
+                 label_encoder: LabelEncoder = None, use_index: bool = True,
+                 block_size: int = None, record_range: Tuple[int, int] = None):
         """ Initialize sequence dataset from file."""
+        if record_range is not None and f_format != 'fasta':
+            raise ValueError(f'Reading a range of records requires FASTA input, '
+                             f'got f_format = {f_format}.')
         self.file = file
         self.f_format = f_format
+        self.use_index = use_index
+        self.block_size = block_size
+        self.record_range = record_range
+        self.offsets = None
+        if record_range is not None:
+            self.load_index()
 
         # Read labels, if available
         self.labels_file = labels_file
         if self.labels_file is None:
             self.labels = None
+            self.label_from_id = None
         else:
-            self.labels = pd.read_csv(labels_file,
-                                      index_col=0,
-                                      compression='infer',
-                                      dtype=str,
-                                      )
-
-            # Sequence IDs and labels are assumed in named columns,
-            # but if not, let's try a specific order and hope for the best
-            self.labels = _rename_labels_columns(self.labels)
-
-            # Transform class names to numerical labels
-            if label_encoder is None:
-                self.label_encoder = LabelEncoder()
-                self.labels['label_num'] = self.label_encoder.fit_transform(
-                    self.labels.eggnog_id)
-            else:
-                self.label_encoder = label_encoder
-                self.labels['label_num'] = self.label_encoder.transform(
-                    self.labels.eggnog_id)
+            # Sequence ids are mapped to numerical labels once,
+            # instead of in each worker
+            self.labels, self.label_encoder, self.label_from_id = _read_labels(
+                labels_file, label_encoder, get_logger(__name__, verbose=0))
 
         # Generate amino-acid vocabulary
         self.alphabet = EXTENDED_IUPAC_PROTEIN_ALPHABET
@@ -373,17 +506,55 @@ class ProteinIterableDataset(IterableDataset):
 
         self.n_skipped = SynchronizedCounter(init=0)
 
-    def __iter__(self):
-        """ Return iterator over sequences in file. """
+    def load_index(self, verbose: int = 0) -> Union[np.ndarray, None]:
+        """ Load the index of record offsets of FASTA files, building it if necessary.
+
+        Call this before starting data loader workers, so that they inherit
+        the offsets instead of each scanning the file. Does nothing for
+        other file formats, or if the index is not used. Compressed files
+        are only indexed to read a ``record_range``.
+
+        Parameters
+        ----------
+        verbose : int, optional
+            Verbosity
+
+        Returns
+        -------
+        offsets : np.ndarray or None
+            Record offsets (see :func:`deepnog.utils.get_fasta_index`)
+        """
+        if (self.offsets is None and self.f_format == 'fasta'
+                and (self.use_index or self.record_range is not None)):
+            if self.record_range is None and is_compressed(self.file):
+                logger = get_logger(__name__, verbose=verbose)
+                logger.info(f'Not indexing compressed file {self.file}: each worker '
+                            f'parses the file, and keeps every n-th record.')
+                return None
+            self.offsets = get_fasta_index(self.file)
+        return self.offsets
+
+    def _protein_iterator(self) -> ProteinIterator:
+        """ Create an iterator over the sequences dedicated to the current worker. """
         worker_info = torch.utils.data.get_worker_info()
         if worker_info is None:
             return ProteinIterator(self.file, self.labels, self.vocab,
-                                   self.f_format, n_skipped=0)
-        else:
-            return ProteinIterator(self.file, self.labels, self.vocab,
-                                   self.f_format, n_skipped=self.n_skipped,
-                                   num_workers=worker_info.num_workers,
-                                   worker_id=worker_info.id)
+                                   self.f_format, n_skipped=0,
+                                   label_from_id=self.label_from_id,
+                                   offsets=self.offsets,
+                                   record_range=self.record_range)
+        return ProteinIterator(self.file, self.labels, self.vocab,
+                               self.f_format, n_skipped=self.n_skipped,
+                               label_from_id=self.label_from_id,
+                               num_workers=worker_info.num_workers,
+                               worker_id=worker_info.id,
+                               offsets=self.offsets,
+                               block_size=self.block_size,
+                               record_range=self.record_range)
+
+    def __iter__(self):
+        """ Return iterator over sequences in file. """
+        return self._protein_iterator()
 
     def __len__(self):
         try:
@@ -416,6 +587,8 @@ class ShuffledProteinIterableDataset(ProteinIterableDataset):
         Provide a label encoder during validation.
     buffer_size : int
         How many objects will be buffered, i.e. are available to choose from.
+    use_index : bool, optional
+        Let workers seek directly to their sequences in FASTA files.
 
     References
     ----------
@@ -423,23 +596,16 @@ class ShuffledProteinIterableDataset(ProteinIterableDataset):
     https://discuss.pytorch.org/t/how-to-shuffle-an-iterable-dataset/64130/5
     """
     def __init__(self, file, labels_file: str = None, f_format='fasta',
-                 label_encoder: LabelEncoder = None, buffer_size: int = 1000):
+                 label_encoder: LabelEncoder = None, buffer_size: int = 1000,
+                 use_index: bool = True):
         super().__init__(file=file, labels_file=labels_file, f_format=f_format,
-                         label_encoder=label_encoder)
+                         label_encoder=label_encoder, use_index=use_index)
         self.dataset = self
         self.buffer_size = buffer_size
 
     def __iter__(self):
         shufbuf = []
-        worker_info = torch.utils.data.get_worker_info()
-        if worker_info is None:
-            dataset_iter = ProteinIterator(self.file, self.labels, self.vocab,
-                                           self.f_format, n_skipped=0)
-        else:
-            dataset_iter = ProteinIterator(self.file, self.labels, self.vocab,
-                                           self.f_format, n_skipped=self.n_skipped,
-                                           num_workers=worker_info.num_workers,
-                                           worker_id=worker_info.id)
+        dataset_iter = self._protein_iterator()
         try:
             for i in range(self.buffer_size):
                 shufbuf.append(next(dataset_iter))
@@ -476,6 +642,67 @@ def _rename_labels_columns(df):
     return df
 
 
+def _remove_shared_dir(path: Path, owner_pid: int):
+    if os.getpid() == owner_pid:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _read_labels(labels, label_encoder, logger):
+    """ Read training labels, and encode class names as numerical labels.
+
+    Returns
+    -------
+    labels : DataFrame
+        Labels with columns 'protein_id', 'eggnog_id', and 'label_num'.
+        Sequences of classes unknown to a given ``label_encoder`` are removed.
+    label_encoder : LabelEncoder
+        The given label encoder, or a new one fitted on the labels
+    label_from_id : dict
+        Numerical label of each sequence id
+    """
+    logger.info('Loading labels')
+    try:
+        labels = read_labels(labels)
+    except (ValueError, TypeError):
+        pass
+    if not isinstance(labels, pd.DataFrame):
+        raise ValueError('Invalid labels, must be .csv file or DataFrame')
+
+    # Try to rename columns, if not already correctly named
+    labels = _rename_labels_columns(labels)
+
+    # Transform class names to numerical labels via their (sorted) categories,
+    # which avoids comparing the names of all sequences
+    classes = labels.eggnog_id.astype('category').cat.remove_unused_categories()
+    if not classes.cat.categories.is_monotonic_increasing:
+        classes = classes.cat.reorder_categories(classes.cat.categories.sort_values())
+    categories = classes.cat.categories
+    codes = classes.cat.codes.to_numpy()
+    if label_encoder is None:
+        logger.info('Setting up new LabelEncoder')
+        label_encoder = LabelEncoder()
+        label_encoder.classes_ = np.asarray(categories, dtype=object)
+        label_num = codes.astype(np.int64)
+    else:
+        logger.info('Using provided LabelEncoder')
+        known = np.asarray(categories.isin(label_encoder.classes_))
+        category_labels = np.full(len(categories), -1, dtype=np.int64)
+        category_labels[known] = label_encoder.transform(categories[known])
+        label_num = np.where(codes >= 0, category_labels[codes], -1)
+    labels['eggnog_id'] = classes
+    labels['label_num'] = label_num
+    keep = label_num >= 0
+    if not keep.all():
+        labels = labels[keep]
+        logger.warning(f'Removed {keep.size - labels.shape[0]} '
+                       f'sequences of unknown classes.')
+    # NOTE: this only supports single-label experiments!
+    # In case of multi-labels, the last label will overwrite
+    # any previously seen labels.
+    label_from_id = dict(zip(labels.protein_id.tolist(), labels.label_num.tolist()))
+    return labels, label_encoder, label_from_id
+
+
 class ProteinDataset(Dataset):
     """ Protein dataset with sequences and labels for training.
 
@@ -503,6 +730,13 @@ class ProteinDataset(Dataset):
     label_encoder : LabelEncoder, optional
         The label encoder maps str class names to numerical labels.
         Provide a label encoder during validation.
+    shared_memory : bool, optional
+        Store residues, ids, and labels in flat NumPy arrays in a temporary
+        memory-mapped directory instead of Biopython SeqRecords and a dict.
+        Data loader workers then read from the shared page cache without
+        touching (and thereby copying) Python objects, so that memory
+        requirements do not grow with the number of workers.
+        The ``sequences`` attribute is None in this case.
     verbose: int, optional
         Control verbosity of logging.
     """
@@ -510,6 +744,7 @@ class ProteinDataset(Dataset):
                  labels: Union[pd.DataFrame, str, Path, None] = None,
                  f_format: str = 'fasta',
                  label_encoder: Union[LabelEncoder, None] = None,
+                 shared_memory: bool = False,
                  verbose: int = 0,
                  ):
         self.sequences = sequences
@@ -524,42 +759,8 @@ class ProteinDataset(Dataset):
             self.logger.info('Not using labels')
             self.label_from_id = {}
         else:
-            self.logger.info('Loading labels')
-            try:
-                self.labels = pd.read_csv(self.labels,
-                                          index_col=0,
-                                          compression='infer',
-                                          dtype=str,
-                                          )
-            except (ValueError, TypeError):
-                pass
-            if not isinstance(self.labels, pd.DataFrame):
-                raise ValueError('Invalid labels, must be .csv file or DataFrame')
-
-            # Try to rename columns, if not already correctly named
-            self.labels = _rename_labels_columns(self.labels)
-
-            # Transform class names to numerical labels
-            if self.label_encoder is None:
-                self.logger.info('Setting up new LabelEncoder')
-                self.label_encoder = LabelEncoder()
-                self.labels['label_num'] = self.label_encoder.fit_transform(
-                    self.labels.eggnog_id)
-            else:
-                self.logger.info('Using provided LabelEncoder')
-                try:
-                    self.labels['label_num'] = self.label_encoder.transform(
-                        self.labels.eggnog_id)
-                except ValueError:
-                    n_before = self.labels.shape[0]
-                    df_available = pd.DataFrame(self.label_encoder.classes_, columns=['eggnog_id'])
-                    self.labels = self.labels.merge(df_available)
-                    self.logger.warning(f'Removed {n_before - self.labels.shape[0]} '
-                                        f'sequences of unknown classes.')
-                    self.labels['label_num'] = self.label_encoder.transform(
-                        self.labels.eggnog_id)
-            self.label_from_id = {row.protein_id: row.label_num
-                                  for row in self.labels.itertuples()}
+            self.labels, self.label_encoder, self.label_from_id = _read_labels(
+                self.labels, self.label_encoder, self.logger)
 
         self.logger.info('Loading sequences')
         try:
@@ -583,25 +784,76 @@ class ProteinDataset(Dataset):
         if not isinstance(self.sequences[0], SeqRecord):
             raise ValueError(f'Invalid sequences, must be FASTA file or '
                              f'a list/tuple of {SeqRecord}')
+        self.lengths = np.array([len(record) for record in self.sequences])
 
         # Generate amino-acid vocabulary
         self.alphabet = EXTENDED_IUPAC_PROTEIN_ALPHABET
         self.vocab = gen_amino_acid_vocab(self.alphabet)
+        self.lut = gen_amino_acid_lut(self.alphabet)
 
         self.n_skipped = SynchronizedCounter(init=0)
+        self._shared_dir = None
+        self._arrays = None
+        if shared_memory:
+            self._share_sequences()
         self.logger.debug('Dataset init complete')
 
+    def _share_sequences(self):
+        """ Move sequences, ids, and labels to memory-mapped arrays. """
+        self._shared_dir = Path(tempfile.mkdtemp(prefix='deepnog_dataset_'))
+        # Only the creating process removes the arrays (not forked workers)
+        weakref.finalize(self, _remove_shared_dir, self._shared_dir, os.getpid())
+        offsets = np.zeros(len(self.lengths) + 1, dtype=np.int64)
+        np.cumsum(self.lengths, out=offsets[1:])
+        residues = b''.join(str(record.seq).encode('ascii', 'replace')
+                            for record in self.sequences)
+        arrays = {'residues': np.frombuffer(residues, dtype=np.uint8),
+                  'offsets': offsets,
+                  'ids': np.array([record.id.encode() for record in self.sequences],
+                                  dtype=np.bytes_),
+                  'labels': np.array([self.label_from_id.get(record.id, -1)
+                                      for record in self.sequences], dtype=np.int64),
+                  }
+        for name, array in arrays.items():
+            np.save(self._shared_dir/f'{name}.npy', array)
+        self.sequences = None
+        self.label_from_id = {}
+        self.logger.info(f'Sharing {len(offsets) - 1} sequences from {self._shared_dir}')
+
+    def _map(self) -> dict:
+        if self._arrays is None:
+            # Plain array views of the maps avoid np.memmap overhead on each access
+            self._arrays = {name: np.load(self._shared_dir/f'{name}.npy',
+                                          mmap_mode='r').view(np.ndarray)
+                            for name in ('residues', 'offsets', 'ids', 'labels')}
+        return self._arrays
+
+    def __getstate__(self):
+        # Workers map the shared arrays themselves instead of receiving copies
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
     def __len__(self):
-        return len(self.sequences)
+        return len(self.lengths)
 
     def __getitem__(self, item):
+        if self._shared_dir is not None:
+            arrays = self._map()
+            residues = arrays['residues'][arrays['offsets'][item]:arrays['offsets'][item + 1]]
+            label = int(arrays['labels'][item])
+            return sequence_tuple(index=item,
+                                  id=arrays['ids'][item].decode(),
+                                  string=residues.tobytes().decode('ascii'),
+                                  encoded=_encode(residues, self.lut),
+                                  label=None if label < 0 else label)
         seq = self.sequences[item]
         sequence_id: str = f'{seq.id}'
         label = self.label_from_id.get(sequence_id, None)
-        encoded = [self.vocab.get(c, 0) for c in seq]
+        string = str(seq.seq)
         sequence = sequence_tuple(index=item,
                                   id=sequence_id,
-                                  string=str(seq.seq),
-                                  encoded=encoded,
+                                  string=string,
+                                  encoded=_encode(string.encode('ascii', 'replace'), self.lut),
                                   label=label)
         return sequence
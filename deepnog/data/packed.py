@@ -0,0 +1,230 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Pre-encoded, memory-mapped protein datasets for fast training start-up.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+import json
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+from sklearn.preprocessing import LabelEncoder
+
+from .dataset import _encode, _read_labels, gen_amino_acid_lut, sequence_tuple
+from ..utils import EXTENDED_IUPAC_PROTEIN_ALPHABET, SynchronizedCounter
+from ..utils import get_logger, parse, read_fasta, try_import_pytorch
+
+torch = try_import_pytorch()
+from torch.utils.data import Dataset  # noqa
+
+__all__ = ['PackedProteinDataset',
+           'is_packed_dataset',
+           'pack_dataset',
+           ]
+
+PACKED_FORMAT_VERSION = 1
+_METADATA = 'packed.json'
+_RESIDUES = 'residues.bin'
+_OFFSETS = 'offsets.npy'
+_LABELS = 'labels.npy'
+_IDS = 'ids.npy'
+_CLASSES = 'classes.npy'
+
+
+def is_packed_dataset(path: Union[str, Path]) -> bool:
+    """ Whether a path is a directory created by :func:`pack_dataset`. """
+    return (Path(path)/_METADATA).is_file()
+
+
+def pack_dataset(sequences: Union[str, Path], labels: Union[str, Path],
+                 out_dir: Union[str, Path], f_format: str = 'fasta',
+                 verbose: int = 0) -> Path:
+    """ Encode labeled protein sequences once, and store them for memory mapping.
+
+    The output directory contains all encoded residues concatenated in one
+    uint8 buffer, the int64 offsets of each sequence in the buffer,
+    int32 labels, fixed-width sequence ids, and the class names.
+    Load it with :class:`PackedProteinDataset`.
+    Sequences without label are skipped, as in :class:`ProteinDataset`.
+
+    Parameters
+    ----------
+    sequences : str, Path
+        File of protein sequences
+    labels : str, Path
+        CSV file of orthologous group labels (see :class:`ProteinDataset`)
+    out_dir : str, Path
+        Output directory, created if necessary
+    f_format : str, optional
+        File format of the sequences. FASTA files are read with the lean
+        :func:`deepnog.utils.read_fasta`, other formats with Biopython.
+    verbose : int, optional
+        Control verbosity of logging.
+
+    Returns
+    -------
+    out_dir : Path
+        The packed dataset
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _, label_encoder, label_from_id = _read_labels(labels, None, logger)
+    lut = gen_amino_acid_lut(EXTENDED_IUPAC_PROTEIN_ALPHABET)
+    if f_format == 'fasta':
+        records = read_fasta(sequences)
+    else:
+        records = ((record.id, str(record.seq).encode('ascii', 'replace'))
+                   for record in parse(sequences, fformat=f_format))
+
+    logger.info(f'Packing sequences from {sequences} to {out_dir}')
+    offsets = [0]
+    labels_num = []
+    ids = []
+    n_skipped = 0
+    with open(out_dir/_RESIDUES, 'wb') as f:
+        for sequence_id, residues in records:
+            label = label_from_id.get(sequence_id)
+            if label is None:
+                n_skipped += 1
+                continue
+            f.write(_encode(residues, lut).tobytes())
+            offsets.append(offsets[-1] + len(residues))
+            labels_num.append(label)
+            ids.append(sequence_id)
+    if not ids:
+        raise ValueError(f'No labeled sequences in {sequences}.')
+    if n_skipped:
+        logger.warning(f'{n_skipped}/{len(ids) + n_skipped} sequences without '
+                       f'labels were skipped ({len(label_from_id)} total labels).')
+
+    np.save(out_dir/_OFFSETS, np.array(offsets, dtype=np.int64))
+    np.save(out_dir/_LABELS, np.array(labels_num, dtype=np.int32))
+    np.save(out_dir/_IDS, np.array(ids, dtype=np.bytes_))
+    np.save(out_dir/_CLASSES, label_encoder.classes_.astype(str))
+    # Written last, so that incomplete directories are not mistaken for packed datasets
+    with open(out_dir/_METADATA, 'w') as f:
+        json.dump({'version': PACKED_FORMAT_VERSION,
+                   'sequences': str(sequences),
+                   'n_sequences': len(ids),
+                   'n_residues': offsets[-1],
+                   'n_classes': len(label_encoder.classes_),
+                   }, f)
+    logger.info(f'Packed {len(ids)} sequences ({offsets[-1]} residues) '
+                f'of {len(label_encoder.classes_)} classes.')
+    return out_dir
+
+
+class PackedProteinDataset(Dataset):
+    """ Protein dataset of pre-encoded sequences and labels (see :func:`pack_dataset`).
+
+    Residues, offsets, labels, and ids are memory-mapped instead of read
+    into memory, so that construction is nearly instantaneous, and data
+    loader workers share the operating system's page cache instead of
+    holding copies. The arrays are not pickled to workers, but mapped
+    again by each worker on first access.
+
+    Sequences are only available encoded: the ``string`` field of
+    items is None.
+
+    Parameters
+    ----------
+    path : str, Path
+        Directory created by :func:`pack_dataset`
+    label_encoder : LabelEncoder, optional
+        The label encoder maps str class names to numerical labels.
+        Provide the label encoder of the training set during validation.
+        Sequences of classes unknown to the encoder are removed.
+    verbose : int, optional
+        Control verbosity of logging.
+    """
+    def __init__(self, path: Union[str, Path],
+                 label_encoder: Union[LabelEncoder, None] = None,
+                 verbose: int = 0):
+        self.path = Path(path)
+        self.verbose = verbose
+        self.logger = get_logger(__name__, verbose=self.verbose)
+        if not is_packed_dataset(self.path):
+            raise ValueError(f'{self.path} is not a packed dataset. '
+                             f'Create it with "deepnog pack".')
+        with open(self.path/_METADATA) as f:
+            self.metadata = json.load(f)
+        if self.metadata['version'] != PACKED_FORMAT_VERSION:
+            raise ValueError(f'Unsupported packed dataset version '
+                             f'{self.metadata["version"]} in {self.path}.')
+        self._arrays = None
+
+        classes = np.load(self.path/_CLASSES)
+        if label_encoder is None:
+            self.label_encoder = LabelEncoder()
+            self.label_encoder.classes_ = classes
+            self._label_map = None
+            self._items = None
+        else:
+            # Translate class indices to the given encoder's, unknown classes to -1
+            self.label_encoder = label_encoder
+            known = np.isin(classes, label_encoder.classes_)
+            self._label_map = np.full(len(classes), -1, dtype=np.int64)
+            self._label_map[known] = label_encoder.transform(classes[known])
+            labels = self._label_map[self.labels]
+            if known.all():
+                self._items = None
+            else:
+                self._items = np.flatnonzero(labels >= 0)
+                self.logger.warning(f'Removed {len(labels) - len(self._items)} '
+                                    f'sequences of unknown classes.')
+        self.n_skipped = SynchronizedCounter(init=0)
+        self.logger.debug('Dataset init complete')
+
+    def _map(self) -> dict:
+        if self._arrays is None:
+            # Plain array views of the maps avoid np.memmap overhead on each access
+            self._arrays = {
+                'residues': np.memmap(self.path/_RESIDUES, dtype=np.uint8,
+                                      mode='r').view(np.ndarray),
+                'offsets': np.load(self.path/_OFFSETS, mmap_mode='r').view(np.ndarray),
+                'labels': np.load(self.path/_LABELS, mmap_mode='r').view(np.ndarray),
+                'ids': np.load(self.path/_IDS, mmap_mode='r').view(np.ndarray),
+            }
+        return self._arrays
+
+    def __getstate__(self):
+        # Workers map the files themselves instead of receiving copies
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    @property
+    def labels(self) -> np.ndarray:
+        """ Numerical labels of all packed sequences (memory-mapped). """
+        return self._map()['labels']
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """ Number of residues of each sequence. """
+        lengths = np.diff(self._map()['offsets'])
+        if self._items is not None:
+            lengths = lengths[self._items]
+        return lengths
+
+    def __len__(self):
+        if self._items is not None:
+            return len(self._items)
+        return self.metadata['n_sequences']
+
+    def __getitem__(self, item):
+        arrays = self._map()
+        i = item if self._items is None else self._items[item]
+        start = arrays['offsets'][i]
+        stop = arrays['offsets'][i + 1]
+        label = int(arrays['labels'][i])
+        if self._label_map is not None:
+            label = int(self._label_map[label])
+        return sequence_tuple(index=item,
+                              id=arrays['ids'][i].decode(),
+                              string=None,
+                              encoded=arrays['residues'][start:stop].copy(),
+                              label=label)
@@ -0,0 +1,123 @@
+"""
+Date: 2026-10-18
+Description:
+    Test length-bucketed batching.
+"""
+import pytest
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from deepnog.data import BucketBatchSampler, BucketedIterableDataset, ProteinIterableDataset
+from deepnog.data.dataset import collate_sequences
+from deepnog.tests.utils import get_deepnog_root
+
+TESTS = get_deepnog_root()/"tests"
+test_file = TESTS/"data/GCF_000007025.1.faa"
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 16])
+@pytest.mark.parametrize("window", [None, 5, 100])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_bucket_batch_sampler(batch_size, window, shuffle):
+    rng = np.random.RandomState(123)
+    lengths = rng.randint(1, 1000, size=97)
+    sampler = BucketBatchSampler(lengths, batch_size=batch_size, window=window, shuffle=shuffle)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    assert all(0 < len(batch) <= batch_size for batch in batches)
+    # Every sequence is sampled exactly once
+    np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(lengths.size))
+    if not shuffle:
+        # Batches are sorted by length within each window
+        window = sampler.window
+        for start in range(0, lengths.size, window):
+            in_window = [b for b in batches if b[0] >= start and b[0] < start + window]
+            flat = lengths[np.concatenate(in_window)]
+            assert np.all(np.diff(flat) >= 0)
+
+
+def test_bucketing_reduces_padding():
+    dataset = ProteinIterableDataset(test_file, f_format='fasta')
+    batch_size = 8
+
+    def _n_padded(loader):
+        return sum(batch.sequences.numel() for batch in loader)
+
+    plain = DataLoader(dataset, batch_size=batch_size, collate_fn=collate_sequences)
+    bucketed = DataLoader(BucketedIterableDataset(dataset, batch_size=batch_size),
+                          batch_size=None, collate_fn=collate_sequences)
+    assert _n_padded(bucketed) < _n_padded(plain)
+
+    # Same sequences, each exactly once, with original positions
+    plain_ids = {(i, idx) for b in plain for i, idx in zip(b.ids, b.indices)}
+    bucketed_ids = [(i, idx) for b in bucketed for i, idx in zip(b.ids, b.indices)]
+    assert len(bucketed_ids) == len(plain_ids)
+    assert set(bucketed_ids) == plain_ids
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_bucketed_iterable_dataset_workers(num_workers):
+    dataset = ProteinIterableDataset(test_file, f_format='fasta')
+    bucketed = BucketedIterableDataset(dataset, batch_size=4, window=10)
+    assert bucketed.file == dataset.file
+    loader = DataLoader(bucketed, batch_size=None, num_workers=num_workers,
+                        collate_fn=collate_sequences)
+    indices = sorted(idx for batch in loader for idx in batch.indices)
+    n_sequences = sum(1 for _ in dataset)
+    assert indices == list(range(1, n_sequences + 1))
+
+
+@pytest.mark.parametrize("max_tokens", [1, 100, 1000, 5000])
+@pytest.mark.parametrize("batch_size", [None, 4])
+def test_bucket_batch_sampler_max_tokens(max_tokens, batch_size):
+    rng = np.random.RandomState(123)
+    lengths = rng.randint(1, 1000, size=97)
+    sampler = BucketBatchSampler(lengths, batch_size=batch_size, max_tokens=max_tokens)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    np.testing.assert_array_equal(np.sort(np.concatenate(batches)), np.arange(lengths.size))
+    for batch in batches:
+        padded_length = max(36, lengths[batch].max())
+        # Batches may only exceed the budget for single sequences
+        assert len(batch) == 1 or len(batch) * padded_length <= max_tokens
+        if batch_size is not None:
+            assert len(batch) <= batch_size
+
+
+def test_bucketed_iterable_dataset_max_tokens():
+    dataset = ProteinIterableDataset(test_file, f_format='fasta')
+    max_tokens = 2000
+    bucketed = BucketedIterableDataset(dataset, max_tokens=max_tokens, window=50)
+    loader = DataLoader(bucketed, batch_size=None, collate_fn=collate_sequences)
+    n_sequences = 0
+    for batch in loader:
+        n_sequences += len(batch.ids)
+        assert len(batch.ids) == 1 or batch.sequences.numel() <= max_tokens
+    assert n_sequences == sum(1 for _ in dataset)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_bucketed_iterable_dataset_shuffle(num_workers, shuffle):
+    dataset = ProteinIterableDataset(test_file, f_format='fasta')
+    bucketed = BucketedIterableDataset(dataset, max_tokens=2000, window=200, shuffle=shuffle)
+    loader = DataLoader(bucketed, batch_size=None, num_workers=num_workers,
+                        collate_fn=collate_sequences)
+    epochs = [[tuple(batch.indices) for batch in loader] for _ in range(2)]
+    # The same batches in each epoch
+    assert sorted(epochs[0]) == sorted(epochs[1])
+    if shuffle:
+        # ...but not in the same order, and not by ascending length
+        assert epochs[0] != epochs[1]
+        lengths = [len(batch) for batch in epochs[0]]
+        assert lengths != sorted(lengths, reverse=True)
+    else:
+        assert epochs[0] == epochs[1]
+
+
+def test_batch_params_required():
+    with pytest.raises(ValueError):
+        BucketBatchSampler([1, 2, 3])
+    with pytest.raises(ValueError):
+        BucketedIterableDataset(None, max_tokens=0)
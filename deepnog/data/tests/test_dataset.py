@@ -5,6 +5,7 @@ Date: 2019-10-03
 Description:
     Test dataset module.
 """
+import gc
 from itertools import repeat
 from functools import partial
 import pytest
@@ -17,6 +18,7 @@ from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
 from deepnog.data import dataset as ds
+from deepnog.utils import build_fasta_index, is_compressed, parse
 from deepnog.tests.utils import get_deepnog_root
 
 TESTS = get_deepnog_root()/"tests"
@@ -56,6 +58,85 @@ def test_multiprocess_data_loading(f, num_workers, f_format='fasta'):
     assert len(s) == 1289
 
 
+@pytest.mark.parametrize("f", [test_file_gzip, TESTS/"data/test_skip_empty_sequences.faa"])
+@pytest.mark.parametrize("num_workers", [2, 3])
+def test_indexed_multiprocess_data_loading(f, num_workers, monkeypatch):
+    """ Test that seeking workers load the same sequences as parsing workers. """
+    loaded = {}
+    for use_index in [False, True]:
+        dataset = ds.ProteinIterableDataset(f, use_index=use_index)
+        # Workers parse compressed files, instead of seeking in them
+        if use_index and not is_compressed(f):
+            assert dataset.load_index() is not None
+        else:
+            assert dataset.load_index() is None
+        # The index is loaded once before, never by the workers
+        monkeypatch.setattr(ds, 'get_fasta_index', None)
+        data_loader = DataLoader(dataset,
+                                 num_workers=num_workers,
+                                 batch_size=4,
+                                 collate_fn=ds.collate_sequences, )
+        loaded[use_index] = sorted(
+            (index, identifier, tuple(np.trim_zeros(sequence.numpy(), 'b')))
+            for batch in data_loader
+            for index, identifier, sequence in zip(batch.indices, batch.ids, batch.sequences))
+        monkeypatch.undo()
+        n_skipped = int(dataset.n_skipped)
+    assert loaded[True] == loaded[False]
+    assert len(loaded[True]) + n_skipped == len(list(parse(f)))
+    # Ranges of records are still located with the index
+    assert ds.ProteinIterableDataset(f, record_range=(0, 3)).offsets is not None
+
+
+@pytest.mark.parametrize("num_workers", [1, 2, 5, 2000])
+def test_contiguous_worker_shards(num_workers):
+    """ Test that workers read contiguous, disjoint ranges covering the file. """
+    offsets = build_fasta_index(test_file)
+    vocab = ds.gen_amino_acid_vocab()
+    positions = []
+    for worker_id in range(num_workers):
+        iterator = ds.ProteinIterator(test_file, None, vocab, 'fasta',
+                                      num_workers=num_workers,
+                                      worker_id=worker_id,
+                                      offsets=offsets)
+        shard = [sequence.index for sequence in iterator]
+        if shard:
+            np.testing.assert_array_equal(np.diff(shard), 1)
+        positions.extend(shard)
+    np.testing.assert_array_equal(positions, np.arange(1, offsets.size))
+
+
+@pytest.mark.parametrize("num_workers", [2, 3])
+@pytest.mark.parametrize("block_size", [1, 16])
+@pytest.mark.parametrize("load_index", [False, True])
+def test_interleaved_worker_blocks(num_workers, block_size, load_index):
+    """ Test that loading with interleaved blocks yields sequences in file order. """
+    dataset = ds.ProteinIterableDataset(test_file, f_format='fasta', block_size=block_size)
+    if load_index:
+        dataset.load_index()
+    loader = DataLoader(dataset, batch_size=block_size, num_workers=num_workers,
+                        collate_fn=ds.collate_sequences)
+    positions = [index for batch in loader for index in batch.indices]
+    np.testing.assert_array_equal(positions, np.arange(1, len(positions) + 1))
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+@pytest.mark.parametrize("block_size", [None, 8])
+@pytest.mark.parametrize("record_range", [(0, 10), (100, 357), (1280, 1289), (5, 5)])
+def test_record_range(num_workers, block_size, record_range):
+    """ Test reading a range of records with global sequence positions. """
+    dataset = ds.ProteinIterableDataset(test_file, f_format='fasta', block_size=block_size,
+                                        record_range=record_range)
+    loader = DataLoader(dataset, batch_size=4, num_workers=num_workers,
+                        collate_fn=ds.collate_sequences)
+    positions = sorted(index for batch in loader for index in batch.indices)
+    start, stop = record_range
+    np.testing.assert_array_equal(positions, np.arange(start + 1, stop + 1))
+
+    with pytest.raises(ValueError):
+        ds.ProteinIterableDataset(test_file, f_format='fasta-2line', record_range=record_range)
+
+
 @pytest.mark.parametrize("batch_size", [None, 1, 16, 32])
 def test_correct_collating_sequences(batch_size, f_format='fasta'):
     """ Test if a batch of correct size is produced. """
@@ -110,6 +191,13 @@ def test_correct_encoding():
     for i, batch in enumerate(test_encoded):
         assert((i+1) == batch)
 
+    # The lookup table encodes whole sequences at once
+    lut = ds.gen_amino_acid_lut()
+    assert lut.dtype == np.uint8 and lut.shape == (256, )
+    test_bytes = (test_string + test_string.lower() + '*-').encode()
+    encoded = lut[np.frombuffer(test_bytes, dtype=np.uint8)]
+    np.testing.assert_array_equal(encoded, [vocab.get(c, 0) for c in test_bytes.decode()])
+
 
 @pytest.mark.parametrize('batch_size', [1, 2, 10])
 @pytest.mark.parametrize('num_workers', [0, 2])
@@ -177,9 +265,57 @@ def test_protein_dataset():
         assert dataset[i].string == 'MATTAC'
         assert dataset[i].label is None
         assert len(dataset[i].encoded) == 6
+        assert dataset[i].encoded.dtype == np.uint8
 
     # list(repeat(...)) w/o times: traust di nie
     sequences = list(repeat(Seq('MATTAC'), times=10))
     with pytest.raises(ValueError, match="must be FASTA file or a list/tuple "
                                          "of <class 'Bio.SeqRecord.SeqRecord'>"):
         _ = ds.ProteinDataset(sequences, labels=TRAINING_LABELS)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_iterable_dataset_label_encoder(num_workers):
+    df = read_csv(TRAINING_LABELS, index_col=0, dtype=str)
+    label_encoder = LabelEncoder().fit(df.eggnog_id.values[:22])  # omit last class
+    dataset = ds.ProteinIterableDataset(TRAINING_FASTA, labels_file=TRAINING_LABELS,
+                                        label_encoder=label_encoder)
+    assert len(dataset) == len(dataset.label_from_id) == 22
+    assert dataset.labels.eggnog_id.dtype == 'category'
+    expected = {row.protein_id: label_encoder.transform([row.eggnog_id])[0]
+                for row in df.itertuples() if row.eggnog_id in label_encoder.classes_}
+    loader = DataLoader(dataset, batch_size=1, num_workers=num_workers,
+                        collate_fn=ds.collate_sequences)
+    labels = {batch.ids[0]: batch.labels[0].item() for batch in loader
+              if batch.labels is not None}
+    assert labels == expected
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_protein_dataset_shared_memory(num_workers):
+    expected = ds.ProteinDataset(TRAINING_FASTA, labels=TRAINING_LABELS)
+    dataset = ds.ProteinDataset(TRAINING_FASTA, labels=TRAINING_LABELS, shared_memory=True)
+    assert dataset.sequences is None and not dataset.label_from_id
+    assert len(dataset) == len(expected) == 30
+    np.testing.assert_array_equal(dataset.lengths, expected.lengths)
+    for i in range(len(dataset)):
+        item, expected_item = dataset[i], expected[i]
+        assert item.index == expected_item.index
+        assert item.id == expected_item.id
+        assert item.string == expected_item.string
+        assert item.label == expected_item.label
+        np.testing.assert_array_equal(item.encoded, expected_item.encoded)
+
+    # Workers map the arrays instead of receiving copies
+    assert dataset.__getstate__()['_arrays'] is None
+    loader = DataLoader(dataset, batch_size=4, shuffle=True, num_workers=num_workers,
+                        collate_fn=ds.collate_sequences)
+    ids = [sequence_id for batch in loader for sequence_id in batch.ids]
+    assert sorted(ids) == sorted(EXPECTED_IDS_WITH_LABEL)
+
+    # The arrays are removed with the dataset
+    shared_dir = dataset._shared_dir
+    assert shared_dir.is_dir()
+    del dataset, loader
+    gc.collect()
+    assert not shared_dir.exists()
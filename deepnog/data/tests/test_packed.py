@@ -0,0 +1,79 @@
+"""
+Date: 2026-10-18
+Description:
+    Test packed (pre-encoded, memory-mapped) datasets.
+"""
+from pathlib import Path
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import LabelEncoder
+from torch.utils.data import DataLoader
+
+from deepnog.data import PackedProteinDataset, ProteinDataset
+from deepnog.data import collate_sequences, is_packed_dataset, pack_dataset
+from deepnog.tests.utils import get_deepnog_root
+
+TESTS = get_deepnog_root()/"tests"
+TRAINING_FASTA = TESTS/"data/test_training_dummy.faa"
+TRAINING_CSV = TESTS/"data/test_training_dummy.faa.csv"
+
+
+@pytest.fixture(scope='module')
+def packed_dir():
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        yield pack_dataset(TRAINING_FASTA, TRAINING_CSV, Path(tmpdir)/'packed')
+
+
+def test_packed_dataset_equals_protein_dataset(packed_dir):
+    assert is_packed_dataset(packed_dir)
+    packed = PackedProteinDataset(packed_dir)
+    expected = ProteinDataset(TRAINING_FASTA, TRAINING_CSV)
+    assert len(packed) == len(expected) == 30
+    np.testing.assert_array_equal(packed.lengths, expected.lengths)
+    np.testing.assert_array_equal(packed.label_encoder.classes_,
+                                  expected.label_encoder.classes_)
+    for i in range(len(packed)):
+        item = packed[i]
+        assert item.index == i
+        assert item.id == expected[i].id
+        assert item.label == expected[i].label
+        assert item.encoded.dtype == np.uint8
+        np.testing.assert_array_equal(item.encoded, expected[i].encoded)
+
+
+def test_packed_dataset_label_encoder(packed_dir):
+    # Validation sets are encoded like the training set, unknown classes removed
+    label_encoder = LabelEncoder().fit(['00A00', '28H52', 'ZYX12'])
+    packed = PackedProteinDataset(packed_dir, label_encoder=label_encoder)
+    labels = pd.read_csv(TRAINING_CSV, index_col=0, dtype=str).set_index('protein_id')
+    known = labels.eggnog_id.isin(label_encoder.classes_)
+    assert len(packed) == known.sum()
+    for i in range(len(packed)):
+        item = packed[i]
+        assert label_encoder.classes_[item.label] == labels.eggnog_id[item.id]
+    assert len(packed.lengths) == len(packed)
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_packed_dataset_workers(packed_dir, num_workers):
+    packed = PackedProteinDataset(packed_dir)
+    # Memory maps are not passed to workers
+    assert packed.__getstate__()['_arrays'] is None
+    loader = DataLoader(packed, batch_size=4, shuffle=True, num_workers=num_workers,
+                        collate_fn=collate_sequences)
+    indices = [i for batch in loader for i in batch.indices]
+    assert sorted(indices) == list(range(len(packed)))
+
+
+def test_packed_dataset_errors():
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        assert not is_packed_dataset(tmpdir)
+        with pytest.raises(ValueError, match='not a packed dataset'):
+            PackedProteinDataset(tmpdir)
+        empty_labels = Path(tmpdir)/'labels.csv'
+        empty_labels.write_text(',protein_id,eggnog_id\n0,unknown,COG0001\n')
+        with pytest.raises(ValueError, match='No labeled sequences'):
+            pack_dataset(TRAINING_FASTA, empty_labels, Path(tmpdir)/'packed')
@@ -1,9 +1,21 @@
+from .batching import BatchingPredictor
+from .cache import PersistentPredictionCache, PredictionCache
+from .calibration import fit_temperature
+from .embedding import embed
 from .inference import predict
+from .quantization import quantization_agreement, quantize_model
 from .training import fit
 from ..utils.imports import try_import_pytorch
 
-__all__ = ['fit',
+__all__ = ['BatchingPredictor',
+           'PersistentPredictionCache',
+           'PredictionCache',
+           'embed',
+           'fit',
+           'fit_temperature',
            'predict',
+           'quantization_agreement',
+           'quantize_model',
            ]
 
 try_import_pytorch()
@@ -0,0 +1,165 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Dynamic micro-batching of sequences submitted concurrently
+    from many threads or asyncio tasks.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+import asyncio
+from collections import deque
+from concurrent.futures import Future
+import threading
+import time
+from typing import Iterable, List, Tuple, Union
+
+from ..data.dataset import _encode, collate_sequences, gen_amino_acid_lut, sequence_tuple
+from ..utils import try_import_pytorch
+
+torch = try_import_pytorch()
+
+__all__ = ['BatchingPredictor',
+           ]
+
+
+class BatchingPredictor:
+    """ Collect single sequences into batches for efficient prediction.
+
+    Sequences may be submitted from many threads or asyncio tasks.
+    A background thread runs one forward pass of the model for each batch,
+    as soon as ``max_batch_size`` sequences are pending, or the oldest
+    pending sequence has waited for ``max_wait_ms`` milliseconds.
+    Each caller receives a future resolving to ``(label, confidence)``.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model in evaluation mode (see :func:`deepnog.utils.load_nn`)
+    class_labels : sequence, optional
+        Class names corresponding to the output nodes of the network.
+        If None, labels are the zero-based indices of the output nodes.
+    device : str or torch.device, optional
+        Device the model lives on. By default, use the device of the
+        model parameters.
+    max_batch_size : int, optional
+        Maximum number of sequences per forward pass
+    max_wait_ms : float, optional
+        Maximum time (in milliseconds) a sequence waits for further sequences
+        to fill its batch. Longer waits yield larger batches,
+        shorter waits yield lower latency.
+
+    Examples
+    --------
+    >>> with BatchingPredictor(model, class_labels) as predictor:  # doctest: +SKIP
+    ...     label, confidence = predictor.submit('MATTACKK').result()
+    ...     label, confidence = await predictor.predict_async('MATTACKK')
+    """
+    def __init__(self, model, class_labels=None, device=None,
+                 max_batch_size: int = 64, max_wait_ms: float = 5.):
+        if max_batch_size < 1:
+            raise ValueError(f'max_batch_size must be at least one, got {max_batch_size}.')
+        if max_wait_ms < 0:
+            raise ValueError(f'max_wait_ms must not be negative, got {max_wait_ms}.')
+        if device is None:
+            device = next(model.parameters()).device
+        self.model = model
+        self.class_labels = class_labels
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.lut = gen_amino_acid_lut()
+        self.n_batches = 0
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='deepnog-batching-predictor')
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, sequence: Union[str, bytes]) -> Future:
+        """ Submit a protein sequence for prediction.
+
+        Parameters
+        ----------
+        sequence : str or bytes
+            Amino acid residues
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Resolves to ``(label, confidence)`` of the sequence
+        """
+        if isinstance(sequence, str):
+            sequence = sequence.encode('ascii', 'replace')
+        future = Future()
+        future.set_running_or_notify_cancel()
+        encoded = _encode(sequence, self.lut)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('Cannot submit sequences to a closed BatchingPredictor.')
+            self._pending.append((time.monotonic(), encoded, future))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_batch_size:
+                self._cond.notify()
+        return future
+
+    def predict(self, sequences: Iterable[Union[str, bytes]]) -> List[Tuple[object, float]]:
+        """ Submit several sequences, and wait for their predictions. """
+        futures = [self.submit(sequence) for sequence in sequences]
+        return [future.result() for future in futures]
+
+    async def predict_async(self, sequence: Union[str, bytes]) -> Tuple[object, float]:
+        """ Predict a single sequence from an asyncio task without blocking the loop. """
+        return await asyncio.wrap_future(self.submit(sequence))
+
+    def close(self):
+        """ Predict all pending sequences, and stop the background thread. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _next_batch(self):
+        """ Wait for a full batch or the age limit, and take the batch from the queue. """
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            deadline = self._pending[0][0] + self.max_wait_ms / 1000.
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self._cond.wait(timeout)
+            n = min(self.max_batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                collated = collate_sequences([sequence_tuple(index=i, id='', string='',
+                                                             encoded=encoded, label=None)
+                                              for i, (_, encoded, _) in enumerate(batch)])
+                with torch.no_grad():
+                    output = self.model(collated.sequences.to(self.device))
+                    conf, pred = torch.max(self.model.softmax(output), 1)
+                self.n_batches += 1
+                for (_, _, future), p, c in zip(batch, pred.tolist(), conf.tolist()):
+                    label = p if self.class_labels is None else self.class_labels[p]
+                    future.set_result((label, c))
+            except Exception as e:  # report to all affected callers
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -0,0 +1,272 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Cache predictions of identical protein sequences by content hash,
+    in memory or on disk (SQLite) across runs.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from collections import OrderedDict
+from hashlib import blake2b
+import json
+from pathlib import Path
+import sqlite3
+import time
+from typing import Union
+
+import numpy as np
+
+from ..utils import try_import_pytorch
+
+torch = try_import_pytorch()
+
+__all__ = ['DEFAULT_PERSISTENT_CACHE_SIZE',
+           'PersistentPredictionCache',
+           'PredictionCache',
+           'cache_namespace',
+           'sequence_digest',
+           ]
+
+DEFAULT_PERSISTENT_CACHE_SIZE = 10 ** 7
+
+
+def sequence_digest(encoded) -> bytes:
+    """ Content hash of an encoded (possibly zero-padded) protein sequence.
+
+    Trailing zeros are ignored, so that identical sequences have the same
+    digest regardless of the length of their batch.
+    """
+    encoded = np.trim_zeros(np.asarray(encoded, dtype=np.uint8), 'b')
+    return blake2b(encoded.tobytes(), digest_size=16).digest()
+
+
+def cache_namespace(*parts) -> str:
+    """ Identify a model and prediction settings in a persistent cache.
+
+    Parameters
+    ----------
+    parts
+        JSON-serializable values, which determine the predictions of a
+        sequence, e.g. digests of weights files
+        (:func:`deepnog.utils.file_digest`), top_k, and temperature.
+
+    Returns
+    -------
+    namespace : str
+        Hex digest of all parts
+    """
+    return blake2b(json.dumps(parts).encode(), digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """ Predictions of recently seen sequences, keyed by content hash.
+
+    Used by :func:`deepnog.learning.predict`, so that each unique sequence
+    passes through the network only once, and its prediction is reported
+    for every sequence id. Cached predictions are only valid for the model
+    and settings (e.g. ``top_k``) they were computed with.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        Maximum number of cached sequences.
+        Least recently used sequences are evicted first.
+
+    Attributes
+    ----------
+    hits : int
+        Number of sequences answered from the cache
+    misses : int
+        Number of sequences passed through the network
+    """
+    def __init__(self, max_size: int = 2 ** 20):
+        if max_size < 1:
+            raise ValueError(f'Cache size must be at least one, got {max_size}.')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: bytes):
+        return key in self._entries
+
+    def get(self, key: bytes):
+        """ Cached ``(pred, conf)`` of a sequence digest, or None. """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: bytes, pred, conf):
+        """ Cache the prediction of a sequence digest. """
+        self._entries[key] = (pred, conf)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _get_many(self, keys) -> dict:
+        results = {}
+        for key in keys:
+            entry = self.get(key)
+            if entry is not None:
+                results[key] = entry
+        return results
+
+    def _put_many(self, entries: dict):
+        for key, (pred, conf) in entries.items():
+            self.put(key, pred, conf)
+
+    def predict(self, sequences, forward):
+        """ Predict a batch, passing only sequences not seen before to ``forward``.
+
+        Parameters
+        ----------
+        sequences : torch.Tensor, shape (batch_size, sequence_len)
+            Batch of encoded sequences
+        forward : callable
+            Returns ``(pred, conf)`` of a batch of encoded sequences
+
+        Returns
+        -------
+        pred, conf : torch.Tensor
+            Predictions of all sequences in the batch (on CPU)
+        """
+        keys = [sequence_digest(row) for row in sequences.cpu().numpy()]
+        results = self._get_many(set(keys))
+        # First occurrence of each new sequence in the batch
+        new_rows = {}
+        for row, key in enumerate(keys):
+            if key not in results and key not in new_rows:
+                new_rows[key] = row
+        if new_rows:
+            pred, conf = forward(sequences[list(new_rows.values())])
+            new = {key: (p, c) for key, p, c in zip(new_rows, pred.cpu(), conf.cpu())}
+            self._put_many(new)
+            results.update(new)
+        self.misses += len(new_rows)
+        self.hits += len(keys) - len(new_rows)
+        pred = torch.stack([results[key][0] for key in keys])
+        conf = torch.stack([results[key][1] for key in keys])
+        return pred, conf
+
+
+class PersistentPredictionCache(PredictionCache):
+    """ Predictions of sequences stored in an SQLite file across runs.
+
+    Entries are keyed by a namespace, which identifies the model and
+    prediction settings (see :func:`cache_namespace`), and the content
+    hash of each sequence. Repeated annotation of largely unchanged inputs
+    (e.g. updated proteomes) then only passes new sequences through the
+    network. Several namespaces may share one file.
+
+    Parameters
+    ----------
+    path : str or Path
+        SQLite database file, created if necessary
+    namespace : str
+        Identifies the model and settings of all predictions of this cache
+    max_size : int, optional
+        Maximum number of sequences in the file (of all namespaces).
+        Least recently used sequences are evicted first.
+
+    Attributes
+    ----------
+    hits : int
+        Number of sequences answered from the cache
+    misses : int
+        Number of sequences passed through the network
+    """
+    # Number of sequences per query, below SQLite's limit of query parameters
+    _QUERY_SIZE = 500
+
+    def __init__(self, path: Union[str, Path], namespace: str,
+                 max_size: int = DEFAULT_PERSISTENT_CACHE_SIZE):
+        super().__init__(max_size=max_size)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self._connection = sqlite3.connect(str(self.path), timeout=60.)
+        with self._connection as c:
+            c.execute('PRAGMA journal_mode=WAL')
+            c.execute('CREATE TABLE IF NOT EXISTS predictions ('
+                      'namespace TEXT NOT NULL, sequence BLOB NOT NULL, '
+                      'shape TEXT NOT NULL, pred BLOB NOT NULL, conf BLOB NOT NULL, '
+                      'last_used REAL NOT NULL, PRIMARY KEY (namespace, sequence))')
+            c.execute('CREATE INDEX IF NOT EXISTS predictions_last_used '
+                      'ON predictions (last_used)')
+        self._size = len(self)
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    def __contains__(self, key: bytes):
+        return bool(self._get_many([key], touch=False))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """ Close the database file. """
+        self._connection.close()
+
+    def get(self, key: bytes):
+        """ Cached ``(pred, conf)`` of a sequence digest, or None. """
+        return self._get_many([key]).get(key)
+
+    def put(self, key: bytes, pred, conf):
+        """ Cache the prediction of a sequence digest. """
+        self._put_many({key: (pred, conf)})
+
+    def _get_many(self, keys, touch: bool = True) -> dict:
+        keys = list(keys)
+        results = {}
+        for start in range(0, len(keys), self._QUERY_SIZE):
+            query = keys[start:start + self._QUERY_SIZE]
+            rows = self._connection.execute(
+                f'SELECT sequence, shape, pred, conf FROM predictions '
+                f'WHERE namespace = ? AND sequence IN ({",".join("?" * len(query))})',
+                [self.namespace] + query).fetchall()
+            for key, shape, pred, conf in rows:
+                shape = tuple(int(n) for n in shape.split(',') if n)
+                pred = np.frombuffer(pred, dtype=np.int64).reshape(shape)
+                conf = np.frombuffer(conf, dtype=np.float32).reshape(shape)
+                results[bytes(key)] = (torch.from_numpy(pred.copy()),
+                                       torch.from_numpy(conf.copy()))
+        if touch and results:
+            # Recently used sequences are evicted last
+            now = time.time()
+            with self._connection as c:
+                c.executemany('UPDATE predictions SET last_used = ? '
+                              'WHERE namespace = ? AND sequence = ?',
+                              [(now, self.namespace, key) for key in results])
+        return results
+
+    def _put_many(self, entries: dict):
+        now = time.time()
+        rows = []
+        for key, (pred, conf) in entries.items():
+            pred = np.asarray(pred, dtype=np.int64)
+            conf = np.asarray(conf, dtype=np.float32)
+            rows.append((self.namespace, key, ','.join(str(n) for n in pred.shape),
+                         pred.tobytes(), conf.tobytes(), now))
+        with self._connection as c:
+            c.executemany('INSERT OR REPLACE INTO predictions '
+                          '(namespace, sequence, shape, pred, conf, last_used) '
+                          'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            # Upper bound, unless other processes write to the same file
+            self._size += len(rows)
+            if self._size > self.max_size:
+                # Replaced rows are not new, so count the actual rows before evicting
+                self._size = c.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+                if self._size > self.max_size:
+                    c.execute('DELETE FROM predictions WHERE rowid IN (SELECT rowid '
+                              'FROM predictions ORDER BY last_used LIMIT ?)',
+                              (self._size - self.max_size,))
+                    self._size = self.max_size
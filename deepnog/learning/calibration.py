@@ -0,0 +1,90 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Calibration of prediction confidences by temperature scaling.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from ..data.dataset import ProteinIterableDataset, collate_sequences
+from ..utils import get_logger, try_import_pytorch
+
+torch = try_import_pytorch()
+from torch.utils.data import DataLoader  # noqa
+
+__all__ = ['fit_temperature',
+           ]
+
+
+def fit_temperature(model, dataset, device='cpu', batch_size: int = 64,
+                    num_workers: int = 0, max_iter: int = 100, verbose: int = 0) -> float:
+    """ Fit a temperature that calibrates the confidences of a model.
+
+    The network outputs are divided by a single temperature before the
+    softmax. The temperature minimizing the negative log-likelihood of the
+    true labels is fitted on a labeled validation set. Predicted classes
+    do not change, only their confidences
+    (see Guo et al., On Calibration of Modern Neural Networks, ICML 2017).
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model in evaluation mode
+    dataset : ProteinIterableDataset or ProteinDataset
+        Validation sequences with labels. Labels must be encoded like the
+        output nodes of the network, e.g. by passing
+        ``label_encoder=training_dataset.label_encoder``.
+    device : str or torch.device, optional
+        Device of model
+    batch_size : int, optional
+        Number of sequences per forward pass
+    num_workers : int, optional
+        Number of workers for data loading
+    max_iter : int, optional
+        Maximum number of L-BFGS iterations
+    verbose : int, optional
+        Verbosity
+
+    Returns
+    -------
+    temperature : float
+        Pass to :func:`deepnog.learning.predict`, or store in the model
+        parameter file (key 'temperature') for ``deepnog infer``.
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    if num_workers >= 2 and isinstance(dataset, ProteinIterableDataset):
+        # Workers inherit the index, instead of each scanning the file
+        dataset.load_index(verbose=verbose)
+    data_loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers,
+                             collate_fn=collate_sequences)
+    outputs = []
+    labels = []
+    with torch.no_grad():
+        for batch in data_loader:
+            if batch.labels is None:
+                raise ValueError('Fitting a temperature requires labeled sequences.')
+            outputs.append(model(batch.sequences.to(device)).float().cpu())
+            labels.append(batch.labels)
+    if not outputs:
+        raise ValueError('Fitting a temperature requires at least one sequence.')
+    outputs = torch.cat(outputs)
+    labels = torch.cat(labels).long()
+
+    # Optimize the logarithm, so that the temperature stays positive
+    log_temperature = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=max_iter)
+    criterion = torch.nn.CrossEntropyLoss()
+
+    def _closure():
+        optimizer.zero_grad()
+        loss = criterion(outputs / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
+
+    nll_before = criterion(outputs, labels).item()
+    optimizer.step(_closure)
+    temperature = log_temperature.exp().item()
+    nll_after = criterion(outputs / temperature, labels).item()
+    logger.info(f'Fitted temperature {temperature:.4f} on {len(labels)} sequences '
+                f'(negative log-likelihood {nll_before:.4f} -> {nll_after:.4f})')
+    return temperature
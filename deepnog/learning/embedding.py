@@ -0,0 +1,130 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Write protein embeddings (pooled network features) to memory-mapped arrays.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from pathlib import Path
+from typing import Union
+import warnings
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from ..data.dataset import ProteinIterableDataset, collate_sequences
+from ..utils import get_logger, try_import_pytorch
+
+torch = try_import_pytorch()
+from torch.utils.data import DataLoader  # noqa
+
+__all__ = ['EMBEDDING_DTYPES',
+           'embed',
+           'get_embedding_index_path',
+           ]
+
+EMBEDDING_DTYPES = ('float16', 'float32')
+
+
+def get_embedding_index_path(file: Union[str, Path]) -> Path:
+    """ Path of the sequence id index next to an embeddings file (see :func:`embed`). """
+    return Path(file).with_suffix('.ids.csv')
+
+
+def embed(model, dataset, file: Union[str, Path], n_sequences: int, device='cpu',
+          batch_size: int = 16, num_workers: int = 4, dtype: str = 'float32',
+          verbose: int = 3) -> Path:
+    """ Write the embeddings of all sequences of a dataset to a .npy file.
+
+    Embeddings are the pooled features of the network before the
+    classification layer (e.g. :meth:`deepnog.models.deepnog.DeepNOG.embed`).
+    The .npy file is preallocated with one row per record of the input file,
+    and filled batch by batch, so that memory requirements do not grow with
+    the number of sequences. Load it without reading it into memory with
+    ``numpy.load(file, mmap_mode='r')``.
+
+    Row ``i`` holds the embedding of the ``i``-th record (counting from zero).
+    The sequence ids of all rows are written to a CSV file next to
+    ``file`` (see :func:`get_embedding_index_path`) with columns 'row' and
+    'sequence_id'. Rows of records without sequence id remain zero, and are
+    not listed in the index.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model in evaluation mode, which provides an ``embed`` method
+    dataset : ProteinIterableDataset
+        Sequences to embed
+    file : str or Path
+        Output .npy file
+    n_sequences : int
+        Number of records in the input file, e.g. from
+        :func:`deepnog.utils.get_fasta_index`
+    device : [str, torch.device]
+        Device of model
+    batch_size : int
+        Forward batch_size proteins through neural network at once.
+    num_workers : int
+        Number of workers for data loading.
+    dtype : {'float16', 'float32'}
+        Data type of the stored embeddings.
+        Half precision halves the file size.
+    verbose : int
+        Define verbosity.
+
+    Returns
+    -------
+    file : Path
+        The .npy file of embeddings, shape (n_sequences, embedding_dim)
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f'Unknown embedding data type "{dtype}". '
+                         f'Must be one of {EMBEDDING_DTYPES}.')
+    if not hasattr(model, 'embed'):
+        raise ValueError(f'{type(model).__name__} models do not provide embeddings.')
+    file = Path(file)
+    index_file = get_embedding_index_path(file)
+    if num_workers < 2:
+        num_workers = 0
+    elif isinstance(dataset, ProteinIterableDataset):
+        # Workers inherit the index, instead of each scanning the file
+        dataset.load_index(verbose=verbose)
+
+    with torch.no_grad():
+        # Embedding dimension from a dummy sequence
+        dim = model.embed(torch.zeros((1, 36), dtype=torch.long, device=device)).shape[1]
+    logger.info(f'Writing {dim}-dimensional embeddings of up to {n_sequences} '
+                f'sequences to {file}')
+    embeddings = np.lib.format.open_memmap(str(file), mode='w+', dtype=dtype,
+                                           shape=(n_sequences, dim))
+    data_loader = DataLoader(dataset,
+                             batch_size=batch_size,
+                             num_workers=num_workers,
+                             collate_fn=collate_sequences,
+                             )
+    n_embedded = 0
+    with open(index_file, 'w') as index, torch.no_grad(), \
+            tqdm(desc='deepnog embedding', total=n_sequences, mininterval=1.,
+                 disable=verbose < 3, unit='seq', unit_scale=True) as pbar:
+        index.write('row,sequence_id\n')
+        for batch in data_loader:
+            batch_embeddings = model.embed(batch.sequences.to(device)).cpu().numpy()
+            # Dataset indices count records from one
+            rows = np.array(batch.indices) - 1
+            embeddings[rows] = batch_embeddings
+            pd.DataFrame({'row': rows, 'sequence_id': batch.ids}).to_csv(
+                index, header=False, index=False)
+            n_embedded += len(rows)
+            pbar.update(n=len(rows))
+    embeddings.flush()
+    del embeddings
+
+    n_skipped = dataset.n_skipped
+    if n_skipped > 0:
+        warnings.warn(f'Skipped {n_skipped} sequences as no sequence id '
+                      f'could be detected.')
+    logger.info(f'Embedded {n_embedded} sequences. Sequence ids are listed in {index_file}')
+    return file
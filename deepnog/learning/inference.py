@@ -8,23 +8,30 @@ Description:
     Predict orthologous groups of protein sequences.
 """
 # SPDX-License-Identifier: BSD-3-Clause
+from copy import copy
+from itertools import repeat
 from os import environ
 from typing import List
 import warnings
 
 from tqdm import tqdm
 
-from ..data.dataset import collate_sequences
-from ..utils import get_logger, try_import_pytorch
+from ..data.batching import BucketBatchSampler, BucketedIterableDataset, _default_window
+from ..data.dataset import ProteinIterableDataset, collate_sequences
+from .cache import PredictionCache
+from ..utils import PredictionWriter, get_logger, mixed_precision, try_import_pytorch
 
 torch = try_import_pytorch()
-from torch.utils.data import DataLoader  # noqa
+from torch.utils.data import DataLoader, IterableDataset  # noqa
 
 __all__ = ['predict', ]
 
 
 def predict(model, dataset, device='cpu', batch_size=16, num_workers=4,
-            verbose=3) -> (torch.Tensor, torch.Tensor, List[str], List[str]):
+            verbose=3, sort_window: int = None, max_tokens: int = None,
+            writer: PredictionWriter = None, top_k: int = 1, temperature=None,
+            cache: PredictionCache = None, precision: str = 'fp32',
+            ) -> (torch.Tensor, torch.Tensor, List[str], List[str]):
     """ Use model to predict zero-indexed labels of dataset.
 
     Also handles communication with ProteinIterators used to load data to
@@ -32,8 +39,12 @@ def predict(model, dataset, device='cpu', batch_size=16, num_workers=4,
 
     Parameters
     ----------
-    model : nn.Module
-        Trained neural network model.
+    model : nn.Module, or list of nn.Module
+        Trained neural network model. If a list of models is given
+        (e.g. for several taxonomic levels), each batch is passed through
+        all models, so that the input file is read only once.
+        Models with several outputs (e.g. ``MultiDeepNOG``) are treated
+        like a list of models.
     dataset : ProteinIterableDataset
         Data to predict protein families for.
     device : [str, torch.device]
@@ -44,42 +55,161 @@ def predict(model, dataset, device='cpu', batch_size=16, num_workers=4,
         Number of workers for data loading.
     verbose : int
         Define verbosity.
+    sort_window : int, optional
+        If given, sort each window of ``sort_window`` consecutive sequences
+        by length, and batch sequences of similar length together.
+        This reduces zero-padding, i.e. wasted computation, considerably.
+        Predictions are no longer returned in file order, but can be
+        mapped back to file order through ``indices`` (see ``create_df``).
+    max_tokens : int, optional
+        If given, batches are filled with sequences of similar length,
+        until the number of residues in the zero-padded batch
+        (number of sequences times length of the longest sequence)
+        would exceed ``max_tokens``. This keeps memory requirements
+        predictable regardless of sequence lengths.
+        ``batch_size`` is ignored in this case,
+        and ``sort_window`` defaults to 16384 sequences.
+    writer : PredictionWriter, optional
+        If given, pass predictions to the writer batch by batch, instead of
+        collecting them for the whole dataset. Memory requirements then do
+        not grow with the number of sequences, except for the writer's
+        filter of duplicate ids (see :class:`deepnog.utils.PredictionWriter`).
+        Multi-process loading of
+        FASTA files reads interleaved blocks of sequences in this case
+        (see ``ProteinIterableDataset(block_size=...)``), so that predictions
+        arrive close to file order.
+    top_k : int, optional
+        Number of best classes returned per sequence (and model)
+    temperature : float, or list of float, optional
+        If given, divide the network outputs by ``temperature`` before the
+        softmax, e.g. to obtain calibrated confidences
+        (see :func:`deepnog.learning.fit_temperature`).
+        One temperature per model may be given.
+    cache : PredictionCache, optional
+        If given, identical sequences (by content hash of their residues)
+        pass through the network only once, and their prediction is reported
+        for each of their sequence ids. Pass the same cache to several calls
+        with the same model and settings (e.g. for chunks of one file) to
+        share predictions between them. Cached predictions may differ
+        slightly from recomputed ones due to different zero-padding.
+    precision : str, optional
+        Numerical precision of the forward pass, 'fp32' or 'bf16'.
+        With 'bf16', convolutions and linear layers of PyTorch models run in
+        bfloat16 (see :func:`deepnog.utils.mixed_precision`), which is faster
+        on CPUs with AVX512-BF16/AMX support. Confidences are computed in float32.
 
     Returns
     -------
-    preds : torch.Tensor, shape (n_samples,)
-        Stores the index of the output-node with the highest activation
-    confs : torch.Tensor, shape (n_samples,)
-        Stores the confidence in the prediction
+    preds : torch.Tensor, shape (n_samples,) or (n_samples, n_models)
+        Stores the index of the output-node with the highest activation.
+        With ``top_k > 1``, an additional last dimension of size ``top_k``
+        holds the indices of the best output-nodes in decreasing order.
+    confs : torch.Tensor, shape (n_samples,) or (n_samples, n_models)
+        Stores the confidence in the prediction. The second dimension
+        is present, if a list of models is given. Same shape as ``preds``.
     ids : list[str]
         Stores the (possible empty) protein labels extracted from data
         file.
     indices : list[int]
         Stores the unique indices of sequences mapping to their position
         in the file
+
+    All return values are None, if a ``writer`` is given.
     """
     logger = get_logger(__name__, verbose=verbose)
 
     logger.info(f'Inference device: {device}')
+    if top_k < 1:
+        raise ValueError(f'top_k must be at least one, got {top_k}.')
+    # Raises ValueError for invalid precisions
+    mixed_precision(device, precision)
+    if isinstance(temperature, (list, tuple)):
+        temperatures = temperature
+    else:
+        temperatures = repeat(temperature)
 
+    several_models = (isinstance(model, (list, tuple))
+                      or getattr(model, 'multi_output', False))
+    models = model if isinstance(model, (list, tuple)) else [model]
     debug_force_mode = environ.get("DEEPNOG_FORCE_MODE", default=None)
     if debug_force_mode is not None and debug_force_mode.lower() == 'train':
         logger.warning('forcing model.train(), with possible effects on dropout and batchnorm')
-        model.train()
+        for m in models:
+            m.train()
+
+    def _forward(sequences):
+        # Push sequences on correct device
+        sequences = sequences.to(device)
+        # Predict protein families
+        with mixed_precision(device, precision):
+            if isinstance(model, (list, tuple)):
+                outputs = [m(sequences) for m in models]
+            elif several_models:
+                outputs = model(sequences)
+            else:
+                outputs = [model(sequences)]
+        outputs = [output.float() for output in outputs]
+        confs_and_preds = [_best_classes(models[0].softmax, output, top_k, t)
+                           for output, t in zip(outputs, temperatures)]
+        if not several_models:
+            conf, pred = confs_and_preds[0]
+        else:
+            conf = torch.stack([c for c, _ in confs_and_preds], dim=1)
+            pred = torch.stack([p for _, p in confs_and_preds], dim=1)
+        return pred, conf
 
     pred_l = []
     conf_l = []
     ids = []
     indices = []
+    n_predicted = 0
 
     if num_workers < 2:
         num_workers = 0
+    elif isinstance(dataset, ProteinIterableDataset):
+        # Workers inherit the index, instead of each scanning the file
+        dataset.load_index(verbose=verbose)
     # Create data-loader for protein dataset
-    data_loader = DataLoader(dataset,
-                             batch_size=batch_size,
-                             num_workers=num_workers,
-                             collate_fn=collate_sequences,
-                             )
+    if max_tokens:
+        batch_size = None
+    if (writer is not None and num_workers >= 2
+            and getattr(dataset, 'block_size', 0) is None):
+        # Each worker provides one batch or sorting window at a time.
+        # Set on a shallow copy, which leaves the caller's dataset unchanged.
+        dataset = copy(dataset)
+        if sort_window or max_tokens:
+            dataset.block_size = sort_window or _default_window(batch_size)
+        else:
+            dataset.block_size = batch_size
+        logger.debug(f'Workers read interleaved blocks of {dataset.block_size} sequences')
+    if not (sort_window or max_tokens):
+        data_loader = DataLoader(dataset,
+                                 batch_size=batch_size,
+                                 num_workers=num_workers,
+                                 collate_fn=collate_sequences,
+                                 )
+    elif isinstance(dataset, IterableDataset):
+        logger.debug(f'Batching sequences of similar length '
+                     f'(window = {sort_window}, max_tokens = {max_tokens})')
+        data_loader = DataLoader(BucketedIterableDataset(dataset,
+                                                         batch_size=batch_size,
+                                                         window=sort_window,
+                                                         max_tokens=max_tokens),
+                                 batch_size=None,
+                                 num_workers=num_workers,
+                                 collate_fn=collate_sequences,
+                                 )
+    else:
+        logger.debug(f'Batching sequences of similar length '
+                     f'(window = {sort_window}, max_tokens = {max_tokens})')
+        data_loader = DataLoader(dataset,
+                                 batch_sampler=BucketBatchSampler(dataset.lengths,
+                                                                  batch_size=batch_size,
+                                                                  window=sort_window,
+                                                                  max_tokens=max_tokens),
+                                 num_workers=num_workers,
+                                 collate_fn=collate_sequences,
+                                 )
     try:
         n_sequences = len(dataset)
     except TypeError:
@@ -95,22 +225,28 @@ def predict(model, dataset, device='cpu', batch_size=16, num_workers=4,
                   unit='seq',
                   unit_scale=True) as pbar:
             for i, batch in enumerate(data_loader,):
-                # Push sequences on correct device
-                sequences = batch.sequences.to(device)
-                # Predict protein families
-                output = model(sequences)
-                output = model.softmax(output)
-
-                conf, pred = torch.max(output, 1)
+                sequences = batch.sequences
+                if cache is None:
+                    pred, conf = _forward(sequences)
+                else:
+                    # Only sequences not seen before pass through the network
+                    pred, conf = cache.predict(sequences, _forward)
                 # Store predictions
-                pred_l.append(pred)
-                conf_l.append(conf)
-                ids.extend(batch.ids)
-                indices.extend(batch.indices)
+                if writer is None:
+                    pred_l.append(pred)
+                    conf_l.append(conf)
+                    ids.extend(batch.ids)
+                    indices.extend(batch.indices)
+                else:
+                    writer.write(pred, conf, batch.ids, batch.indices)
+                    n_predicted += len(sequences)
                 # Update progress bar by batch size
                 pbar.update(n=len(sequences))
 
     logger.info('Inference complete.')
+    if cache is not None:
+        logger.info(f'Passed {cache.misses} unique sequences through the network, '
+                    f'answered {cache.hits} duplicates from the cache.')
     # Collect skipped-sequences messages from workers in the case of
     # multi-process data-loading
     n_skipped = dataset.n_skipped
@@ -118,13 +254,27 @@ def predict(model, dataset, device='cpu', batch_size=16, num_workers=4,
     if n_skipped > 0:
         warnings.warn(f'Skipped {n_skipped} sequences as no sequence id '
                       f'could be detected.')
-    if len(pred_l) == 0:
+    if len(pred_l) == 0 and n_predicted == 0:
         logger.error('Skipped all sequences. No output will be provided. '
                      'Sequences might have had no sequence IDs in the '
                      'input file.')
         return None, None, None, None
+    elif writer is not None:
+        return None, None, None, None
     else:
         # Merge individual output tensors
         preds = torch.cat(pred_l)
         confs = torch.cat(conf_l)
         return preds, confs, ids, indices
+
+
+def _best_classes(softmax, output, top_k: int = 1, temperature: float = None):
+    """ Confidences and indices of the best classes of a batch of network outputs. """
+    if temperature is not None:
+        output = output / temperature
+    confs = softmax(output)
+    if top_k == 1:
+        return torch.max(confs, 1)
+    if top_k > confs.shape[1]:
+        raise ValueError(f'Cannot report the top {top_k} of {confs.shape[1]} classes.')
+    return torch.topk(confs, top_k, dim=1)
@@ -0,0 +1,154 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Quantization of trained networks to int8 for CPU inference.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from itertools import islice
+from pathlib import Path
+from typing import Dict
+import warnings
+
+import pandas as pd
+
+from ..data.dataset import ProteinIterableDataset, collate_sequences
+from ..utils import get_logger, try_import_pytorch
+from ..utils.metrics import estimate_performance
+
+torch = try_import_pytorch()
+from torch.utils.data import DataLoader  # noqa
+
+__all__ = ['QUANTIZATION_MODES',
+           'quantization_agreement',
+           'quantize_model',
+           ]
+
+QUANTIZATION_MODES = ('none', 'dynamic', 'static')
+
+
+def _sample_batches(data, n_sequences: int, batch_size: int):
+    """ Batches of the first n_sequences of a FASTA file or dataset. """
+    if isinstance(data, (str, Path)):
+        data = ProteinIterableDataset(data, f_format='fasta')
+    loader = DataLoader(data, batch_size=batch_size, collate_fn=collate_sequences)
+    return islice(loader, -(-n_sequences // batch_size))
+
+
+def _wrap_quantizable(module, qconfig):
+    """ Surround convolutions and linear layers with (de)quantization stubs. """
+    for name, child in module.named_children():
+        if isinstance(child, (torch.nn.Conv1d, torch.nn.Linear)):
+            wrapper = torch.quantization.QuantWrapper(child)
+            wrapper.qconfig = qconfig
+            setattr(module, name, wrapper)
+        else:
+            _wrap_quantizable(child, qconfig)
+
+
+def quantize_model(model, mode: str = 'dynamic', calibration_data=None,
+                   n_calibration_sequences: int = 1000, batch_size: int = 64,
+                   verbose: int = 0):
+    """ Quantize the weights (and activations) of a model to int8.
+
+    Quantized models run on CPU only.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model in evaluation mode, e.g. DeepNOG or DeepFam.
+        The model is modified in place.
+    mode : {'none', 'dynamic', 'static'}
+        'dynamic' quantizes the weights of linear layers (e.g. the large
+        classification layer), and quantizes their inputs on the fly.
+        'static' quantizes linear and convolutional layers, with
+        activation ranges calibrated on sample sequences.
+        'none' returns the model unchanged.
+    calibration_data : str, Path, or Dataset, optional
+        FASTA file or dataset of sample sequences. Required for 'static'.
+    n_calibration_sequences : int, optional
+        Number of sample sequences used for calibration
+    batch_size : int, optional
+        Number of sequences per calibration batch
+    verbose : int, optional
+        Verbosity
+
+    Returns
+    -------
+    model : torch.nn.Module
+        Quantized model
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f'Unknown quantization mode "{mode}". '
+                         f'Must be one of {QUANTIZATION_MODES}.')
+    if mode == 'none':
+        return model
+    if next(model.parameters()).device.type != 'cpu':
+        raise ValueError('Quantized models are only supported on CPU.')
+    if getattr(model, '_packed', None) is not None:
+        raise ValueError('Cannot quantize a model with packed convolutions.')
+
+    if mode == 'dynamic':
+        logger.info('Quantizing linear layers to int8 (dynamic)')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear},
+                                                   dtype=torch.qint8, inplace=True)
+
+    if calibration_data is None:
+        raise ValueError('Static quantization requires calibration data.')
+    logger.info(f'Quantizing convolutional and linear layers to int8 (static), '
+                f'calibrating on up to {n_calibration_sequences} sequences')
+    qconfig = torch.quantization.get_default_qconfig(torch.backends.quantized.engine)
+    _wrap_quantizable(model, qconfig)
+    with warnings.catch_warnings():
+        # Deprecation warnings of default observers
+        warnings.simplefilter('ignore', UserWarning)
+        torch.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for batch in _sample_batches(calibration_data, n_calibration_sequences, batch_size):
+            model(batch.sequences)
+    return torch.quantization.convert(model, inplace=True)
+
+
+def quantization_agreement(float_model, quantized_model, data,
+                           n_sequences: int = 1000, batch_size: int = 64) -> Dict:
+    """ Compare predictions of a quantized model with the float model.
+
+    Predictions of the float model serve as ground truth for
+    :func:`deepnog.utils.metrics.estimate_performance`.
+
+    Parameters
+    ----------
+    float_model : torch.nn.Module
+        Model before quantization
+    quantized_model : torch.nn.Module
+        Model after quantization (see :func:`quantize_model`)
+    data : str, Path, or Dataset
+        FASTA file or dataset of sample sequences
+    n_sequences : int, optional
+        Number of sample sequences
+    batch_size : int, optional
+        Number of sequences per batch
+
+    Returns
+    -------
+    perf : dict
+        Performance estimates of the quantized model, e.g. 'accuracy'
+        is the fraction of sequences with identical predictions.
+    """
+    preds = {'float': [], 'quantized': []}
+    with torch.no_grad():
+        for batch in _sample_batches(data, n_sequences, batch_size):
+            for key, model in [('float', float_model), ('quantized', quantized_model)]:
+                outputs = model(batch.sequences)
+                if not getattr(model, 'multi_output', False):
+                    outputs = [outputs]
+                # Models with several outputs: compare each (level, sequence) pair
+                preds[key].extend(torch.cat([output.argmax(dim=1)
+                                             for output in outputs]).tolist())
+    # Sequence ids in files may not be unique
+    sequence_ids = range(len(preds['float']))
+    df_true = pd.DataFrame({'sequence_id': sequence_ids, 'label': preds['float']})
+    df_pred = pd.DataFrame({'sequence_id': sequence_ids, 'prediction': preds['quantized']})
+    return estimate_performance(df_true=df_true, df_pred=df_pred)
@@ -0,0 +1,102 @@
+"""
+Date: 2026-10-18
+Description:
+    Test dynamic micro-batching of concurrent requests.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import pytest
+import torch
+
+from deepnog.data import ProteinIterableDataset
+from deepnog.learning import BatchingPredictor, predict
+from deepnog.tests.utils import get_deepnog_root
+from deepnog.utils import load_nn, read_fasta
+
+TESTS = get_deepnog_root()/"tests"
+WEIGHTS = TESTS/"parameters/test_deepnog.pthsmall"
+TEST_FILE = TESTS/"data/test_deepnog.faa"
+
+
+@pytest.fixture(scope='module')
+def model_dict():
+    return torch.load(WEIGHTS, map_location='cpu')
+
+
+@pytest.fixture(scope='module')
+def model(model_dict):
+    return load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+
+
+def _sequences():
+    return [residues for _, residues in read_fasta(TEST_FILE)]
+
+
+def test_batching_predictor_single_sequences(model, model_dict):
+    """ Without merging, predictions equal those of predict(). """
+    preds, confs, _, _ = predict(model, ProteinIterableDataset(TEST_FILE), batch_size=1,
+                                 num_workers=0, verbose=0)
+    class_labels = model_dict['classes']
+    with BatchingPredictor(model, class_labels, max_batch_size=1) as predictor:
+        results = predictor.predict(_sequences())
+    assert [label for label, _ in results] == [class_labels[p] for p in preds.tolist()]
+    assert [conf for _, conf in results] == pytest.approx(confs.tolist(), abs=1e-6)
+
+
+def test_batching_predictor_merges_concurrent_requests(model):
+    sequences = _sequences()
+    with BatchingPredictor(model, max_batch_size=16, max_wait_ms=100) as predictor:
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            results = list(executor.map(lambda s: predictor.submit(s).result(), sequences))
+    assert len(results) == len(sequences)
+    assert all(isinstance(label, int) and 0. <= conf <= 1. for label, conf in results)
+    assert predictor.n_batches < len(sequences)
+
+
+def test_batching_predictor_max_wait(model):
+    with BatchingPredictor(model, max_batch_size=1000, max_wait_ms=20) as predictor:
+        start = time.monotonic()
+        predictor.submit('MATTACKK').result(timeout=10)
+        # The batch is flushed by age, not by size
+        assert time.monotonic() - start < 5
+        assert predictor.n_batches == 1
+
+
+def test_batching_predictor_asyncio(model):
+    sequences = _sequences()[:20]
+
+    async def _predict_all(predictor):
+        return await asyncio.gather(*[predictor.predict_async(s) for s in sequences])
+
+    with BatchingPredictor(model, max_batch_size=8, max_wait_ms=50) as predictor:
+        results = asyncio.run(_predict_all(predictor))
+    assert len(results) == len(sequences)
+    assert predictor.n_batches <= len(sequences)
+
+
+def test_batching_predictor_errors_and_close(model):
+    class BrokenModel(torch.nn.Module):
+        softmax = torch.nn.Softmax(dim=1)
+
+        def __init__(self):
+            super().__init__()
+            self.linear = torch.nn.Linear(1, 1)
+
+        def forward(self, x):
+            raise RuntimeError('broken')
+
+    with BatchingPredictor(BrokenModel()) as predictor:
+        with pytest.raises(RuntimeError, match='broken'):
+            predictor.submit('MATTACKK').result(timeout=10)
+
+    predictor = BatchingPredictor(model, max_batch_size=100, max_wait_ms=60_000)
+    future = predictor.submit('MATTACKK')
+    predictor.close()  # pending sequences are still predicted
+    assert future.done()
+    with pytest.raises(RuntimeError, match='closed'):
+        predictor.submit('MATTACKK')
+
+    with pytest.raises(ValueError):
+        BatchingPredictor(model, max_batch_size=0)
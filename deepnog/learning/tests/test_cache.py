@@ -0,0 +1,175 @@
+"""
+Date: 2026-10-18
+Description:
+    Test caching predictions of duplicate sequences.
+"""
+from pathlib import Path
+import tempfile
+
+import numpy as np
+import pytest
+import torch
+
+from deepnog.data import ProteinIterableDataset
+from deepnog.learning import PersistentPredictionCache, PredictionCache, predict
+from deepnog.learning.cache import cache_namespace, sequence_digest
+from deepnog.tests.utils import get_deepnog_root
+from deepnog.utils import load_nn, read_fasta
+
+TESTS = get_deepnog_root()/"tests"
+WEIGHTS = TESTS/"parameters/test_deepnog.pthsmall"
+TEST_FILE = TESTS/"data/test_deepnog.faa"
+
+
+class _CountingModel(torch.nn.Module):
+    """ Count the sequences passed through a model. """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.softmax = model.softmax
+        self.n_sequences = 0
+
+    def forward(self, x):
+        self.n_sequences += len(x)
+        return self.model(x)
+
+
+@pytest.fixture(scope='module')
+def model():
+    model_dict = torch.load(WEIGHTS, map_location='cpu')
+    return load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+
+
+@pytest.fixture(scope='module')
+def redundant_file():
+    """ Each sequence of the test file three times, with distinct ids, shuffled. """
+    residues = [seq.decode() for _, seq in read_fasta(TEST_FILE)]
+    order = np.random.RandomState(0).permutation(3 * len(residues))
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        file = Path(tmpdir)/'redundant.faa'
+        with open(file, 'w') as f:
+            for i in order:
+                f.write(f'>copy{i}\n{residues[i % len(residues)]}\n')
+        yield file
+
+
+def test_sequence_digest():
+    assert sequence_digest([3, 4, 5]) == sequence_digest(np.array([3, 4, 5, 0, 0]))
+    assert sequence_digest([3, 4, 5]) != sequence_digest([3, 4, 5, 6])
+    assert len(sequence_digest([1])) == 16
+
+
+def test_prediction_cache_lru():
+    cache = PredictionCache(max_size=2)
+    for key in (b'a', b'b'):
+        cache.put(key, torch.tensor(0), torch.tensor(1.))
+    assert cache.get(b'a') is not None
+    cache.put(b'c', torch.tensor(0), torch.tensor(1.))
+    assert len(cache) == 2
+    assert b'a' in cache and b'c' in cache and b'b' not in cache
+    with pytest.raises(ValueError):
+        PredictionCache(max_size=0)
+
+
+@pytest.mark.parametrize('batch_size', [1, 16])
+def test_predict_with_cache(model, redundant_file, batch_size):
+    counting = _CountingModel(model)
+    preds, confs, ids, indices = predict(counting, ProteinIterableDataset(redundant_file),
+                                         batch_size=1, num_workers=0, verbose=0)
+    assert counting.n_sequences == 300
+
+    counting.n_sequences = 0
+    cache = PredictionCache()
+    preds_c, confs_c, ids_c, indices_c = predict(
+        counting, ProteinIterableDataset(redundant_file), batch_size=batch_size,
+        num_workers=0, verbose=0, cache=cache)
+    # Each unique sequence passes the network once
+    assert counting.n_sequences == cache.misses == len(cache) == 100
+    assert cache.hits == 200
+    assert ids_c == ids and indices_c == indices
+    np.testing.assert_array_equal(preds_c, preds)
+    np.testing.assert_allclose(confs_c, confs, rtol=1e-4)
+
+    # A second pass is answered from the cache entirely
+    counting.n_sequences = 0
+    preds_c, _, _, _ = predict(counting, ProteinIterableDataset(redundant_file),
+                               batch_size=batch_size, num_workers=0, verbose=0, cache=cache)
+    assert counting.n_sequences == 0
+    np.testing.assert_array_equal(preds_c, preds)
+
+
+def test_predict_with_cache_top_k(model, redundant_file):
+    preds, confs, _, _ = predict(model, ProteinIterableDataset(redundant_file), batch_size=1,
+                                 num_workers=0, verbose=0, top_k=2)
+    preds_c, confs_c, _, _ = predict(model, ProteinIterableDataset(redundant_file),
+                                     batch_size=1, num_workers=0, verbose=0, top_k=2,
+                                     cache=PredictionCache())
+    assert preds_c.shape == preds.shape == (300, 2)
+    np.testing.assert_array_equal(preds_c, preds)
+    np.testing.assert_allclose(confs_c, confs, rtol=1e-5)
+
+
+def test_persistent_cache(model, redundant_file):
+    preds, confs, _, _ = predict(model, ProteinIterableDataset(redundant_file), batch_size=1,
+                                 num_workers=0, verbose=0)
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        path = Path(tmpdir)/'cache/predictions.sqlite'
+        counting = _CountingModel(model)
+        with PersistentPredictionCache(path, cache_namespace('model', 1)) as cache:
+            preds_c, confs_c, _, _ = predict(counting, ProteinIterableDataset(redundant_file),
+                                             batch_size=1, num_workers=0, verbose=0,
+                                             cache=cache)
+            assert counting.n_sequences == len(cache) == 100
+        np.testing.assert_array_equal(preds_c, preds)
+        np.testing.assert_allclose(confs_c, confs, rtol=1e-5)
+
+        # Later runs with the same model reuse the stored predictions
+        counting.n_sequences = 0
+        with PersistentPredictionCache(path, cache_namespace('model', 1)) as cache:
+            preds_c, confs_c, _, _ = predict(counting, ProteinIterableDataset(redundant_file),
+                                             batch_size=16, num_workers=0, verbose=0,
+                                             cache=cache)
+            assert counting.n_sequences == 0 and cache.hits == 300
+        np.testing.assert_array_equal(preds_c, preds)
+        np.testing.assert_array_equal(confs_c, confs)
+
+        # Other models or settings do not
+        with PersistentPredictionCache(path, cache_namespace('model', 2)) as cache:
+            preds_c, _, _, _ = predict(counting, ProteinIterableDataset(redundant_file),
+                                       batch_size=16, num_workers=0, verbose=0, cache=cache)
+            assert counting.n_sequences == 100 and len(cache) == 200
+
+
+def test_persistent_cache_eviction():
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        path = Path(tmpdir)/'predictions.sqlite'
+        with PersistentPredictionCache(path, 'top2', max_size=3) as cache:
+            for i in range(5):
+                cache.put(sequence_digest([i + 1]), torch.tensor([i, 0]),
+                          torch.tensor([0.5, 0.25]))
+                if i == 2:
+                    # Recently used sequences are evicted last
+                    assert cache.get(sequence_digest([1])) is not None
+            assert len(cache) == 3
+            pred, conf = cache.get(sequence_digest([5]))
+            assert pred.tolist() == [4, 0] and conf.tolist() == [0.5, 0.25]
+            assert sequence_digest([1]) in cache
+            assert sequence_digest([2]) not in cache and sequence_digest([3]) not in cache
+
+
+def test_persistent_cache_eviction_after_overwrite():
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        path = Path(tmpdir)/'predictions.sqlite'
+        with PersistentPredictionCache(path, 'top1', max_size=3) as cache, \
+                PersistentPredictionCache(path, 'top1', max_size=3) as other:
+            for i in range(3):
+                cache.put(sequence_digest([i + 1]), torch.tensor(i), torch.tensor(0.5))
+            # Replacing stored sequences, also from another connection, evicts nothing
+            for _ in range(3):
+                cache.put(sequence_digest([1]), torch.tensor(0), torch.tensor(0.5))
+                other.put(sequence_digest([2]), torch.tensor(1), torch.tensor(0.5))
+            assert len(cache) == 3
+            assert all(sequence_digest([i + 1]) in cache for i in range(3))
+            cache.put(sequence_digest([4]), torch.tensor(3), torch.tensor(0.5))
+            assert len(cache) == 3
+            assert sequence_digest([3]) not in cache
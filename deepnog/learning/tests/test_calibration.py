@@ -0,0 +1,66 @@
+"""
+Date: 2026-10-18
+Description:
+    Test temperature scaling of prediction confidences.
+"""
+import numpy as np
+import pytest
+import torch
+
+from deepnog.data import ProteinIterableDataset
+from deepnog.data.dataset import collate_sequences
+from deepnog.learning import fit_temperature, predict
+from deepnog.tests.utils import get_deepnog_root
+
+TESTS = get_deepnog_root()/"tests"
+TRAINING_FASTA = TESTS/"data/test_training_dummy.faa"
+TRAINING_CSV = TESTS/"data/test_training_dummy.faa.csv"
+
+
+class _OverconfidentModel(torch.nn.Module):
+    """ Large logits depending on the first residue of a sequence only.
+
+    Sequences of one class are confidently misclassified.
+    """
+    def __init__(self, dataset, n_classes):
+        super().__init__()
+        self.logits = torch.nn.Parameter(torch.zeros(27, n_classes))
+        with torch.no_grad():
+            for sequence in dataset:
+                self.logits[sequence.encoded[0], sequence.label % 2] = 10.
+        self.softmax = torch.nn.Softmax(dim=1)
+
+    def forward(self, x):
+        return self.logits[x[:, 0].long()]
+
+
+def _labeled_dataset():
+    return ProteinIterableDataset(TRAINING_FASTA, labels_file=TRAINING_CSV)
+
+
+def test_fit_temperature():
+    n_classes = len(_labeled_dataset().label_encoder.classes_)
+    model = _OverconfidentModel(_labeled_dataset(), n_classes).eval()
+    temperature = fit_temperature(model, _labeled_dataset(), batch_size=4)
+
+    # Compare with the minimum negative log-likelihood on a grid of temperatures
+    batch = collate_sequences(list(_labeled_dataset()))
+    with torch.no_grad():
+        outputs = model(batch.sequences)
+    grid = np.logspace(-1, 3, 4000)
+    nll = [torch.nn.functional.cross_entropy(outputs / t, batch.labels).item() for t in grid]
+    assert temperature > 1.
+    assert temperature == pytest.approx(grid[np.argmin(nll)], rel=0.01)
+
+    # Temperatures calibrate confidences, but do not change predictions
+    preds, confs, _, _ = predict(model, _labeled_dataset(), num_workers=0, verbose=0)
+    preds_t, confs_t, _, _ = predict(model, _labeled_dataset(), num_workers=0, verbose=0,
+                                     temperature=temperature)
+    np.testing.assert_array_equal(preds_t, preds)
+    assert (confs_t <= confs).all() and (confs_t < confs).any()
+
+
+def test_fit_temperature_requires_labels():
+    model = _OverconfidentModel(_labeled_dataset(), 3).eval()
+    with pytest.raises(ValueError, match='labeled'):
+        fit_temperature(model, ProteinIterableDataset(TRAINING_FASTA))
@@ -0,0 +1,83 @@
+"""
+Date: 2026-10-18
+Description:
+    Test writing protein embeddings to memory-mapped arrays.
+"""
+from pathlib import Path
+import tempfile
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from deepnog.data import ProteinIterableDataset
+from deepnog.data.dataset import collate_sequences
+from deepnog.learning import embed
+from deepnog.learning.embedding import get_embedding_index_path
+from deepnog.tests.utils import get_deepnog_root
+from deepnog.utils import get_fasta_index, load_nn
+
+TESTS = get_deepnog_root()/"tests"
+WEIGHTS = TESTS/"parameters/test_deepnog.pthsmall"
+TEST_FILE = TESTS/"data/test_deepnog.faa"
+TEST_FILE_SKIP = TESTS/"data/test_skip_empty_sequences.faa"
+
+
+@pytest.fixture(scope='module')
+def model():
+    model_dict = torch.load(WEIGHTS, map_location='cpu')
+    return load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_embed(model, dtype, num_workers):
+    n_records = get_fasta_index(TEST_FILE).size - 1
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        out = Path(tmpdir)/'embeddings.npy'
+        result = embed(model, ProteinIterableDataset(TEST_FILE), out, n_sequences=n_records,
+                       batch_size=1, num_workers=num_workers, dtype=dtype, verbose=0)
+        assert result == out
+        embeddings = np.load(str(out), mmap_mode='r')
+        assert isinstance(embeddings, np.memmap)
+        assert embeddings.shape == (n_records, 1200) and embeddings.dtype == dtype
+        index = pd.read_csv(get_embedding_index_path(out), dtype={'sequence_id': str})
+        assert sorted(index.row) == list(range(n_records))
+
+        # Rows follow file order, and equal the embeddings of single sequences
+        sequences = list(ProteinIterableDataset(TEST_FILE))
+        index = index.sort_values('row')
+        assert index.sequence_id.tolist() == [sequence.id for sequence in sequences]
+        with torch.no_grad():
+            expected = torch.cat([model.embed(collate_sequences(sequence).sequences)
+                                  for sequence in sequences]).numpy()
+        np.testing.assert_allclose(embeddings, expected.astype(dtype), rtol=1e-5)
+        del embeddings
+
+
+def test_embed_skipped_sequences(model):
+    n_records = get_fasta_index(TEST_FILE_SKIP).size - 1
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        out = Path(tmpdir)/'embeddings.npy'
+        with pytest.warns(UserWarning, match='Skipped 20 sequences'):
+            embed(model, ProteinIterableDataset(TEST_FILE_SKIP), out,
+                  n_sequences=n_records, num_workers=2, verbose=0)
+        embeddings = np.load(str(out))
+        index = pd.read_csv(get_embedding_index_path(out), dtype={'sequence_id': str})
+        assert len(index) == n_records - 20
+        missing = np.setdiff1d(np.arange(n_records), index.row)
+        assert (embeddings[missing] == 0).all()
+        assert (embeddings[index.row].any(axis=1)).all()
+
+
+def test_embed_errors(model):
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir, \
+            warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        out = Path(tmpdir)/'embeddings.npy'
+        with pytest.raises(ValueError, match='data type'):
+            embed(model, ProteinIterableDataset(TEST_FILE), out, 100, dtype='int8')
+        with pytest.raises(ValueError, match='do not provide embeddings'):
+            embed(torch.nn.Linear(1, 1), ProteinIterableDataset(TEST_FILE), out, 100)
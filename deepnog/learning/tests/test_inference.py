@@ -5,6 +5,11 @@ Date: 2019-10-18
 Description:
     Test deepnog module and trained networks.
 """
+from io import StringIO
+import warnings
+
+import numpy as np
+import pandas as pd
 import pytest
 
 import torch.nn as nn
@@ -13,7 +18,8 @@ import torch
 from deepnog.data.dataset import ProteinIterableDataset
 from deepnog.learning import predict
 from deepnog.tests.utils import get_deepnog_root
-from deepnog.utils import create_df, load_nn, get_config
+from deepnog.utils import PredictionWriter, create_df, load_nn, get_config, prediction_columns
+from deepnog.utils.metrics import estimate_performance
 
 
 TESTS = get_deepnog_root()/"tests"
@@ -79,6 +85,52 @@ def test_predict(architecture, weights, data, fformat, tolerance):
     assert(sum((ids == preds.cpu()).long()) >= n - tolerance)
 
 
+@pytest.mark.parametrize("sort_window, max_tokens", [(4, None), (1000, None),
+                                                     (None, 500), (10, 5000)])
+def test_predict_sort_window(sort_window, max_tokens):
+    """ Test that length-bucketed batching yields the same predictions. """
+    module, cls = _get_module_cls_from_arch('deepnog')
+    device = torch.device('cpu')
+    model_dict = torch.load(weights_path, map_location=device)
+    model = load_nn((module, cls), model_dict, phase='infer', device=device)
+    class_labels = model_dict['classes']
+
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    df_plain = create_df(class_labels, *predict(model, dataset, device, batch_size=4))
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    df_sorted = create_df(class_labels, *predict(model, dataset, device, batch_size=4,
+                                                 sort_window=sort_window,
+                                                 max_tokens=max_tokens))
+    assert df_sorted['sequence_id'].tolist() == df_plain['sequence_id'].tolist()
+    assert df_sorted['prediction'].tolist() == df_plain['prediction'].tolist()
+    assert df_sorted['confidence'].values == pytest.approx(df_plain['confidence'].values,
+                                                           abs=1e-5)
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_predict_precision(batch_size):
+    """ Test that bfloat16 inference retains the accuracy on labeled sequences. """
+    model_dict = torch.load(weights_path, map_location='cpu')
+    model = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+    perf = {}
+    confs = {}
+    for precision in ['fp32', 'bf16']:
+        preds, confs[precision], ids, indices = predict(
+            model, ProteinIterableDataset(data_path), 'cpu', batch_size=batch_size,
+            num_workers=0, verbose=0, precision=precision)
+        # Sequence ids are the true labels, but not unique
+        df_true = pd.DataFrame({'sequence_id': indices, 'label': ids})
+        df_pred = pd.DataFrame({'sequence_id': indices, 'prediction': preds.numpy()})
+        perf[precision] = estimate_performance(df_true=df_true, df_pred=df_pred)
+    assert perf['bf16']['accuracy'] >= perf['fp32']['accuracy'] - 0.02
+    assert perf['bf16']['macro_f1'] >= perf['fp32']['macro_f1'] - 0.02
+    assert confs['bf16'].dtype == torch.float32
+    np.testing.assert_allclose(confs['bf16'], confs['fp32'], atol=1e-2)
+
+    with pytest.raises(ValueError, match='Unknown precision'):
+        predict(model, ProteinIterableDataset(data_path), 'cpu', precision='fp8')
+
+
 @pytest.mark.parametrize("architecture", ['deepnog', ])
 @pytest.mark.parametrize("weights", [weights_path, ])
 @pytest.mark.parametrize("data", [data_skip_path, ])
@@ -138,3 +190,189 @@ def test_create_df_with_duplicates():
     assert(df_confs[0] > 0.5)
     assert(df_confs[1] < 0.5)
     assert(df_confs[2] > 0.5)
+
+
+@pytest.mark.parametrize("threshold", [None, 0.5])
+@pytest.mark.parametrize("buffer_size", [4, 1000])
+def test_prediction_writer(threshold, buffer_size):
+    """ Test that streamed output equals the output of create_df. """
+    rng = np.random.RandomState(42)
+    class_labels = ['class0', 'class1', 'class2']
+    n = 100
+    preds = torch.tensor(rng.randint(3, size=n))
+    confs = torch.tensor(rng.rand(n), dtype=torch.float32)
+    ids = [f'sequence{i % 90}' for i in range(n)]  # with duplicates
+    indices = list(range(1, n + 1))
+
+    expected = StringIO()
+    with pytest.warns(UserWarning, match='Detected 10 duplicate'):
+        df = create_df(class_labels, preds, confs, ids, indices, threshold=threshold)
+    df.to_csv(expected, sep='\t', index=False, columns=['sequence_id', 'prediction', 'confidence'])
+
+    # Feed slightly out-of-order batches
+    order = np.arange(n).reshape(-1, 2)[:, ::-1].ravel()
+    out = StringIO()
+    with pytest.warns(UserWarning, match='Detected 10 duplicate'):
+        with PredictionWriter(out, class_labels, threshold=threshold, sep='\t',
+                              buffer_size=buffer_size) as writer:
+            for batch in np.array_split(order, 7):
+                writer.write(preds[batch], confs[batch],
+                             [ids[i] for i in batch], [indices[i] for i in batch])
+    assert writer.n_written == 90
+    assert writer.n_out_of_order == 0
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_prediction_writer_without_deduplication():
+    out = StringIO()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with PredictionWriter(out, ['class0', 'class1'], deduplicate=False) as writer:
+            writer.write(torch.tensor([0, 1, 1]), torch.ones(3), list('aba'), [1, 2, 3])
+    assert writer.n_written == 3 and writer.n_duplicates == 0
+    assert not writer._seen_ids
+    assert [line.split(',')[0] for line in out.getvalue().splitlines()[1:]] == list('aba')
+
+
+def test_prediction_writer_out_of_order():
+    out = StringIO()
+    with pytest.warns(UserWarning, match='out of file order'):
+        with PredictionWriter(out, ['class0', 'class1'], buffer_size=2) as writer:
+            writer.write(torch.tensor([0, 1, 0, 1]), torch.ones(4), list('abcd'), [2, 3, 4, 5])
+            writer.write(torch.tensor([1]), torch.ones(1), ['e'], [1])
+    assert writer.n_out_of_order == 1
+    assert out.getvalue().splitlines()[0] == 'sequence_id,prediction,confidence'
+
+
+@pytest.mark.parametrize("num_workers", [0, 2, 3])
+@pytest.mark.parametrize("sort_window", [None, 20])
+def test_predict_with_writer(num_workers, sort_window):
+    """ Test streaming predictions to a file in file order. """
+    module, cls = _get_module_cls_from_arch('deepnog')
+    device = torch.device('cpu')
+    model_dict = torch.load(weights_path, map_location=device)
+    model = load_nn((module, cls), model_dict, phase='infer', device=device)
+    class_labels = model_dict['classes']
+    columns = ['sequence_id', 'prediction', 'confidence']
+
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    df = create_df(class_labels, *predict(model, dataset, device, batch_size=8, num_workers=0))
+    expected = df.to_csv(index=False, columns=columns)
+
+    out = StringIO()
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    with PredictionWriter(out, class_labels, columns=columns, buffer_size=200) as writer:
+        result = predict(model, dataset, device, batch_size=8, num_workers=num_workers,
+                         sort_window=sort_window, writer=writer)
+    assert result == (None, None, None, None)
+    assert writer.n_out_of_order == 0
+    # Interleaved blocks are not set on the caller's dataset
+    assert dataset.block_size is None
+    # Tiny differences in confidence may arise from different zero-padding
+    streamed = out.getvalue().splitlines()
+    expected = expected.splitlines()
+    assert len(streamed) == len(expected)
+    for line, expected_line in zip(streamed[1:], expected[1:]):
+        assert line.split(',')[:2] == expected_line.split(',')[:2]
+
+
+@pytest.mark.parametrize("threshold", [None, [0.5, 0.1]])
+def test_predict_several_models(threshold):
+    """ Test predicting several levels in one pass over the data. """
+    module, cls = _get_module_cls_from_arch('deepnog')
+    device = torch.device('cpu')
+    model_dict = torch.load(weights_path, map_location=device)
+    model = load_nn((module, cls), model_dict, phase='infer', device=device)
+    class_labels = model_dict['classes']
+
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    preds, confs, ids, indices = predict(model, dataset, device, batch_size=8, num_workers=0)
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    preds2, confs2, ids2, indices2 = predict([model, model], dataset, device,
+                                             batch_size=8, num_workers=0)
+    assert preds2.shape == confs2.shape == (len(ids), 2)
+    assert ids2 == ids and indices2 == indices
+    for i in range(2):
+        np.testing.assert_array_equal(preds2[:, i], preds)
+        np.testing.assert_allclose(confs2[:, i], confs)
+
+    levels = ['1', '2']
+    df = create_df([class_labels] * 2, preds2, confs2, ids2, indices2,
+                   threshold=threshold, levels=levels)
+    assert list(df.columns) == ['index', 'sequence_id', 'tax', 'prediction', 'confidence']
+    assert df.tax.tolist() == levels * (len(df) // 2)
+    for i, level in enumerate(levels):
+        expected = create_df(class_labels, preds, confs, ids, indices,
+                             threshold=None if threshold is None else threshold[i])
+        np.testing.assert_array_equal(df[df.tax == level].prediction, expected.prediction)
+
+    # Streaming yields the same output
+    columns = ['sequence_id', 'tax', 'prediction', 'confidence']
+    out = StringIO()
+    with PredictionWriter(out, [class_labels] * 2, threshold=threshold,
+                          buffer_size=10, levels=levels) as writer:
+        writer.write(preds2, confs2, ids2, indices2)
+    assert out.getvalue() == df.to_csv(index=False, columns=columns)
+
+
+@pytest.mark.parametrize("top_k_format", ['long', 'wide'])
+def test_predict_top_k(top_k_format):
+    """ Test reporting the best classes per sequence and level. """
+    module, cls = _get_module_cls_from_arch('deepnog')
+    device = torch.device('cpu')
+    model_dict = torch.load(weights_path, map_location=device)
+    model = load_nn((module, cls), model_dict, phase='infer', device=device)
+    class_labels = model_dict['classes']
+
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    preds, confs, ids, indices = predict(model, dataset, device, batch_size=8, num_workers=0)
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    preds2, confs2, ids2, indices2 = predict(model, dataset, device, batch_size=8,
+                                             num_workers=0, top_k=2)
+    assert preds2.shape == confs2.shape == (len(ids), 2)
+    np.testing.assert_array_equal(preds2[:, 0], preds)
+    np.testing.assert_allclose(confs2[:, 0], confs)
+    np.testing.assert_allclose(confs2.sum(dim=1), 1., rtol=1e-5)
+    assert (preds2[:, 0] != preds2[:, 1]).all()
+    with pytest.raises(ValueError):
+        predict(model, ProteinIterableDataset(data_path), device, num_workers=0, top_k=3)
+
+    with pytest.warns(UserWarning, match='duplicate'):
+        df = create_df(class_labels, preds2, confs2, ids2, indices2,
+                       top_k=2, top_k_format=top_k_format)
+    with pytest.warns(UserWarning, match='duplicate'):
+        expected = create_df(class_labels, preds, confs, ids, indices)
+    columns = prediction_columns(top_k=2, top_k_format=top_k_format)
+    if top_k_format == 'long':
+        assert columns == ['sequence_id', 'rank', 'prediction', 'confidence']
+        assert len(df) == 2 * len(expected)
+        assert df['rank'].tolist() == [1, 2] * len(expected)
+        best = df[df['rank'] == 1]
+    else:
+        assert columns == ['sequence_id', 'prediction_1', 'confidence_1',
+                           'prediction_2', 'confidence_2']
+        assert len(df) == len(expected)
+        best = df.rename(columns={'prediction_1': 'prediction'})
+    np.testing.assert_array_equal(best.prediction, expected.prediction)
+    np.testing.assert_array_equal(best.sequence_id, expected.sequence_id)
+
+    # Several models, streamed
+    levels = ['1', '2']
+    dataset = ProteinIterableDataset(data_path, f_format='fasta')
+    preds3, confs3, ids3, indices3 = predict([model, model], dataset, device, batch_size=8,
+                                             num_workers=0, top_k=2, temperature=[1., 100.])
+    assert preds3.shape == (len(ids), 2, 2)
+    np.testing.assert_array_equal(preds3[:, 0], preds2)
+    np.testing.assert_array_equal(preds3[:, 1], preds2)
+    np.testing.assert_allclose(confs3[:, 0], confs2)
+    assert (confs3[:, 1, 0] <= confs2[:, 0]).all() and (confs3[:, 1, 0] < confs2[:, 0]).any()
+    with pytest.warns(UserWarning, match='duplicate'):
+        df = create_df([class_labels] * 2, preds3, confs3, ids3, indices3, levels=levels,
+                       top_k=2, top_k_format=top_k_format)
+    columns = prediction_columns(levels, top_k=2, top_k_format=top_k_format)
+    out = StringIO()
+    with pytest.warns(UserWarning, match='duplicate'):
+        with PredictionWriter(out, [class_labels] * 2, buffer_size=10, levels=levels,
+                              top_k=2, top_k_format=top_k_format) as writer:
+            writer.write(preds3, confs3, ids3, indices3)
+    assert out.getvalue() == df.to_csv(index=False, columns=columns)
@@ -0,0 +1,61 @@
+"""
+Date: 2026-10-18
+Description:
+    Test int8 quantization of trained networks.
+"""
+import numpy as np
+import pytest
+import torch
+
+from deepnog.learning import predict, quantization_agreement, quantize_model
+from deepnog.data import ProteinIterableDataset
+from deepnog.models.deepnog import MultiDeepNOG
+from deepnog.tests.utils import get_deepnog_root
+from deepnog.utils import load_nn
+
+TESTS = get_deepnog_root()/"tests"
+WEIGHTS = TESTS/"parameters/test_deepnog.pthsmall"
+TEST_FILE = TESTS/"data/test_deepnog.faa"
+
+
+@pytest.fixture(scope='module')
+def model_dict():
+    return torch.load(WEIGHTS, map_location='cpu')
+
+
+def _load(model_dict, **kwargs):
+    return load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu', **kwargs)
+
+
+@pytest.mark.parametrize('mode', ['dynamic', 'static'])
+def test_quantize_model(model_dict, mode):
+    float_model = _load(model_dict)
+    model = _load(model_dict, quantize=mode, calibration_data=TEST_FILE)
+    assert 'Quantized' in repr(model.classification1)
+    assert ('Quantized' in repr(model.conv1)) == (mode == 'static')
+    perf = quantization_agreement(float_model, model, TEST_FILE)
+    assert perf['accuracy'] > 0.8
+
+    # Quantized models work with the regular inference pipeline
+    dataset = ProteinIterableDataset(TEST_FILE)
+    preds, confs, _, _ = predict(model, dataset, num_workers=0, verbose=0)
+    assert preds.shape == confs.shape
+    assert np.all((confs.numpy() >= 0) & (confs.numpy() <= 1))
+
+
+def test_quantize_multi_output(model_dict):
+    fused = MultiDeepNOG([_load(model_dict), _load(model_dict)])
+    quantized = quantize_model(MultiDeepNOG([_load(model_dict), _load(model_dict)]),
+                               mode='static', calibration_data=TEST_FILE)
+    assert quantization_agreement(fused, quantized, TEST_FILE)['accuracy'] > 0.8
+
+
+def test_quantize_errors(model_dict):
+    model = _load(model_dict)
+    assert quantize_model(model, mode='none') is model
+    with pytest.raises(ValueError, match='Unknown quantization mode'):
+        quantize_model(model, mode='float16')
+    with pytest.raises(ValueError, match='calibration'):
+        quantize_model(model, mode='static')
+    with pytest.raises(ValueError):
+        _load(model_dict, quantize='dynamic', pack_convolutions=True)
@@ -2,8 +2,11 @@ from pathlib import Path
 import tempfile
 import pytest
 import numpy as np
+import torch
+import pandas as pd
 
 from deepnog.learning import fit
+from deepnog.utils.metrics import estimate_performance
 from deepnog.tests.utils import get_deepnog_root
 
 DEEPNOG_TESTS = get_deepnog_root()/"tests"
@@ -45,3 +48,64 @@ def test_shuffled_training(batch_size, num_workers):
         assert x.shape == (2, 30)
     np.testing.assert_equal(results.y_train_true.sum(), Y_TRUE.sum())  # order should be different
     np.testing.assert_equal(results.y_val_pred.sum(), Y_TRUE.sum())
+
+
+@pytest.mark.parametrize('iterable_dataset', [False, True])
+def test_max_tokens_training(iterable_dataset):
+    results = fit(architecture='deepnog',
+                  module='deepnog',
+                  cls='DeepNOG',
+                  training_sequences=TRAINING_FASTA,
+                  validation_sequences=TRAINING_FASTA,
+                  training_labels=TRAINING_CSV,
+                  validation_labels=TRAINING_CSV,
+                  data_loader_params={'num_workers': 0},
+                  max_tokens=500,
+                  iterable_dataset=iterable_dataset,
+                  learning_rate=1e-3,
+                  device='cpu',
+                  verbose=0,
+                  n_epochs=2,
+                  shuffle=True,
+                  random_seed=1,
+                  tensorboard_dir=None,
+                  save_each_epoch=False,
+                  )
+    for x in [results.y_train_true, results.y_train_pred, results.y_val_true, results.y_val_pred]:
+        assert x.shape == (2, 30)
+    np.testing.assert_equal(results.y_train_true.sum(), Y_TRUE.sum())
+    np.testing.assert_equal(results.y_val_true.sum(), Y_TRUE.sum())
+
+
+def test_mixed_precision_training():
+    def _val_performance(precision):
+        results = fit(architecture='deepnog',
+                      module='deepnog',
+                      cls='DeepNOG',
+                      training_sequences=TRAINING_FASTA,
+                      validation_sequences=TRAINING_FASTA,
+                      training_labels=TRAINING_CSV,
+                      validation_labels=TRAINING_CSV,
+                      data_loader_params={'batch_size': 4, 'num_workers': 0},
+                      learning_rate=1e-3,
+                      device='cpu',
+                      verbose=0,
+                      n_epochs=2,
+                      random_seed=1,
+                      tensorboard_dir=None,
+                      save_each_epoch=False,
+                      precision=precision,
+                      )
+        # Weights remain float32
+        assert all(p.dtype == torch.float32 for p in results.model.parameters())
+        sequence_ids = np.arange(results.y_val_true.shape[1])
+        df_true = pd.DataFrame({'sequence_id': sequence_ids, 'label': results.y_val_true[-1]})
+        df_pred = pd.DataFrame({'sequence_id': sequence_ids,
+                                'prediction': results.y_val_pred[-1]})
+        return estimate_performance(df_true=df_true, df_pred=df_pred)
+
+    perf_fp32 = _val_performance('fp32')
+    perf_bf16 = _val_performance('bf16')
+    assert perf_bf16['accuracy'] >= perf_fp32['accuracy'] - 0.05
+    with pytest.raises(ValueError, match='Unknown precision'):
+        _val_performance('fp16')
@@ -26,9 +26,10 @@ import numpy as np
 from tqdm.auto import tqdm
 
 from ..data import ProteinDataset, ProteinIterableDataset, ShuffledProteinIterableDataset
-from ..data import collate_sequences
+from ..data import PackedProteinDataset, is_packed_dataset
+from ..data import BucketBatchSampler, BucketedIterableDataset, collate_sequences
 from ..utils import count_parameters, get_config, get_logger, load_nn, set_device
-from ..utils import try_import_pytorch
+from ..utils import mixed_precision, try_import_pytorch
 
 torch = try_import_pytorch()
 from torch.optim import Adam, lr_scheduler  # noqa
@@ -63,6 +64,7 @@ def _train_and_validate_model(model: torch.nn.Module, criterion, optimizer,
                               save_each_epoch: bool = True,
                               out_dir: Path = None,
                               experiment_name: str = None,
+                              precision: str = 'fp32',
                               verbose: int = 2) -> train_val_result:
     """ Perform training and validation of a given model, data, and hyperparameters.
 
@@ -101,6 +103,9 @@ def _train_and_validate_model(model: torch.nn.Module, criterion, optimizer,
         Path to the output directory used to save models during training
     experiment_name : str
         Prefix of model files saved during training
+    precision : str, optional
+        Numerical precision of forward passes and losses,
+        'fp32' or 'bf16' (see :func:`deepnog.utils.mixed_precision`)
     verbose : int
         Increasing levels of messages
 
@@ -199,14 +204,15 @@ def _train_and_validate_model(model: torch.nn.Module, criterion, optimizer,
                     # forward pass;
                     # track history only during training
                     with torch.set_grad_enabled(phase == 'train'):
-                        outputs = model(inputs)
-                        _, preds = torch.max(outputs, 1)
-                        if l2_coeff is not None:
-                            loss_ce = criterion(outputs, labels.long())
-                            loss_reg = model.classification1.weight.pow(2).sum()
-                            loss = loss_ce + l2_coeff * loss_reg
-                        else:
-                            loss = criterion(outputs, labels.long())
+                        with mixed_precision(device, precision):
+                            outputs = model(inputs)
+                            _, preds = torch.max(outputs, 1)
+                            if l2_coeff is not None:
+                                loss_ce = criterion(outputs, labels.long())
+                                loss_reg = model.classification1.weight.pow(2).sum()
+                                loss = loss_ce + l2_coeff * loss_reg
+                            else:
+                                loss = criterion(outputs, labels.long())
                         # backward + optimize only if in training phase
                         if phase == 'train':
                             loss.backward()
@@ -331,7 +337,9 @@ def fit(architecture, module, cls,
         training_sequences, validation_sequences,
         training_labels, validation_labels, *,
         data_loader_params: dict = None,
+        max_tokens: int = None,
         iterable_dataset: bool = False,
+        shared_memory: bool = False,
         n_epochs: int = 15,
         shuffle: bool = False,
         learning_rate: float = 1e-2,
@@ -346,6 +354,7 @@ def fit(architecture, module, cls,
         out_dir: Path = None,
         experiment_name: str = None,
         config_file: str = None,
+        precision: str = 'fp32',
         verbose: int = 2,
         ) -> train_val_result:
     """ Perform training and validation of a given model, data, and hyperparameters.
@@ -360,19 +369,31 @@ def fit(architecture, module, cls,
         cls : str
             Python class name of the network (inside deepnog/models/{module}.py).
         training_sequences : str, Path
-            File with training set sequences
+            File with training set sequences,
+            or directory of a packed dataset (see :func:`deepnog.data.pack_dataset`)
         validation_sequences : str, Path
-            File with validation set sequences
+            File with validation set sequences, or directory of a packed dataset
         training_labels : str, Path
-            File with class labels (orthologous groups) of training sequences
+            File with class labels (orthologous groups) of training sequences.
+            Ignored for packed datasets, which contain their labels.
         validation_labels : str, Path
-            File with class labels (orthologous groups) of validation sequences
+            File with class labels (orthologous groups) of validation sequences.
+            Ignored for packed datasets, which contain their labels.
         data_loader_params : dict
             Parameters passed to PyTorch DataLoader construction
+        max_tokens : int, optional
+            If given, batch sequences of similar length, until the number of
+            residues in the zero-padded batch would exceed ``max_tokens``,
+            instead of using a fixed batch size. This keeps memory requirements
+            predictable regardless of sequence lengths.
         iterable_dataset : bool, default False
             Use an iterable dataset that does not load all sequences in advance.
             While this saves memory and does not involve the delay at start,
             random sampling is impaired, and requires a shuffle buffer.
+        shared_memory : bool, default False
+            Store the sequences of in-memory datasets in memory-mapped arrays,
+            which data loader workers share instead of copying
+            (see :class:`deepnog.data.ProteinDataset`).
         n_epochs : int
             Number of training passes over the complete training set
         shuffle : bool
@@ -405,6 +426,11 @@ def fit(architecture, module, cls,
             Prefix of model files saved during training
         config_file : str
             Override path to config file, e.g. for custom models in unit tests
+        precision : str, default 'fp32'
+            Numerical precision of forward passes and losses.
+            'bf16' runs matrix multiplications and convolutions in bfloat16
+            (mixed precision), which is considerably faster on CPUs with
+            AVX512-BF16/AMX support. Weights remain float32.
         verbose : int
             Increasing levels of messages
 
@@ -422,6 +448,9 @@ def fit(architecture, module, cls,
 
     device = set_device(device)
     logger.info(f'Training device: {device}')
+    # Raises ValueError for invalid precisions before any data is loaded
+    mixed_precision(device, precision)
+    logger.info(f'Training precision: {precision}')
     if random_seed is None:
         logger.info('Non-deterministic training mode (no random seed given).')
     else:
@@ -453,6 +482,10 @@ def fit(architecture, module, cls,
 
     # Set up training and validation data set with sequences and labels
     dataset: dict = {}
+    if iterable_dataset and (is_packed_dataset(training_sequences)
+                             or is_packed_dataset(validation_sequences)):
+        raise ValueError('Packed datasets are memory-mapped, and cannot be used '
+                         'with iterable_dataset=True.')
     if iterable_dataset:
         if shuffle:
             buffer_size = 2 ** 16
@@ -469,21 +502,55 @@ def fit(architecture, module, cls,
                                                 labels_file=validation_labels,
                                                 label_encoder=dataset['train'].label_encoder,
                                                 )
+        if data_loader_params['num_workers'] >= 2:
+            # Workers inherit the indices, instead of each scanning the files
+            for d in dataset.values():
+                d.load_index(verbose=verbose)
     else:
         with_shuffling = 'with shuffling' if shuffle else 'without shuffling'
         logger.info(f'Using in-memory dataset {with_shuffling}.')
         logger.info('Loading training dataset')
-        dataset['train'] = ProteinDataset(sequences=training_sequences,
-                                          labels=training_labels,
-                                          verbose=verbose)
+        if is_packed_dataset(training_sequences):
+            dataset['train'] = PackedProteinDataset(training_sequences, verbose=verbose)
+        else:
+            dataset['train'] = ProteinDataset(sequences=training_sequences,
+                                              labels=training_labels,
+                                              shared_memory=shared_memory,
+                                              verbose=verbose)
         logger.info('Loading validation dataset')
-        dataset['val'] = ProteinDataset(sequences=validation_sequences,
-                                        labels=validation_labels,
-                                        label_encoder=dataset['train'].label_encoder,
-                                        verbose=verbose)
+        if is_packed_dataset(validation_sequences):
+            dataset['val'] = PackedProteinDataset(validation_sequences,
+                                                  label_encoder=dataset['train'].label_encoder,
+                                                  verbose=verbose)
+        else:
+            dataset['val'] = ProteinDataset(sequences=validation_sequences,
+                                            labels=validation_labels,
+                                            label_encoder=dataset['train'].label_encoder,
+                                            shared_memory=shared_memory,
+                                            verbose=verbose)
         data_loader_params.update({'shuffle': shuffle})
-    data_loader = {phase: DataLoader(d, **data_loader_params)
-                   for phase, d in dataset.items()}
+    if max_tokens is None:
+        data_loader = {phase: DataLoader(d, **data_loader_params)
+                       for phase, d in dataset.items()}
+    else:
+        logger.info(f'Batching sequences of similar length with at most '
+                    f'{max_tokens} residues per batch.')
+        data_loader_params = {k: v for k, v in data_loader_params.items()
+                              if k not in ('batch_size', 'shuffle')}
+        if iterable_dataset:
+            data_loader = {phase: DataLoader(BucketedIterableDataset(d, max_tokens=max_tokens,
+                                                                     shuffle=shuffle),
+                                             batch_size=None,
+                                             **data_loader_params)
+                           for phase, d in dataset.items()}
+        else:
+            data_loader = {phase: DataLoader(d,
+                                             batch_sampler=BucketBatchSampler(
+                                                 d.lengths,
+                                                 max_tokens=max_tokens,
+                                                 shuffle=shuffle),
+                                             **data_loader_params)
+                           for phase, d in dataset.items()}
 
     # Deep network hyperparameter default values
     config = get_config(config_file)
@@ -542,6 +609,7 @@ def fit(architecture, module, cls,
                                        save_each_epoch=save_each_epoch,
                                        out_dir=out_dir,
                                        experiment_name=experiment_name,
+                                       precision=precision,
                                        verbose=verbose,
                                        )
     return result
@@ -7,7 +7,6 @@ from typing import Union
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.nn.functional import one_hot
 
 from .deepnog import AminoAcidWordEmbedding
 
@@ -39,6 +38,20 @@ class PseudoOneHotEncoding(nn.Module):
         super().__init__()
         self.num_classes = 27  # i.e. 26 letters ExtendedIUPAC plus zero-padding
         self.alphabet_size = 21  # after encoding
+        # Encoding of each letter as a row of a constant lookup table.
+        # Zero padding as well as O & U are encoded as zero vectors.
+        # Columns: Index    0  3  6  9 12 15 18
+        #          Letter   ACDEFGHIKLMNPQRSTVWYX
+        encoding = torch.zeros((self.num_classes, self.alphabet_size))
+        encoding[1:22] = torch.eye(self.alphabet_size)
+        # Treat B: D or N
+        encoding[22, [2, 11]] = 0.5
+        # Treat Z: E or Q
+        encoding[23, [3, 13]] = 0.5
+        # Treat J: I or L
+        encoding[24, [7, 9]] = 0.5
+        # Not a buffer, so that state dicts of trained models are unaffected
+        self.encoding = encoding
 
     def forward(self, sequence):
         """ Embedd a given sequence.
@@ -59,40 +72,10 @@ class PseudoOneHotEncoding(nn.Module):
             The sequence (densely) embedded in a space of dimension
             embedding_dim.
         """
-        # Fix type mismatch on Windows
+        # Fix type mismatch on Windows. A table lookup (instead of indexed
+        # assignment) also allows exporting the encoding to ONNX.
         x = sequence.long()
-        device = x.device
-
-        x = one_hot(x, num_classes=self.num_classes)
-        # Cut away one-hot encoding for zero padding as well as O & U
-        x = x[:, :, 1:25].float()
-        # Indices for b, z, j arrays below:
-        # Index    0  3  6  9 12 15 18 21 24
-        # Letter   ACDEFGHIKLMNPQRSTVWYXBZJ
-        # Treat B: D or N
-        b = torch.zeros((1, 24), device=device)
-        b[0, 2] = 0.5
-        b[0, 11] = 0.5
-        b_found = (x[:, :, 21] == 1).nonzero(as_tuple=False)
-        x[b_found[:, 0], b_found[:, 1]] = b
-        # Treat Z: E or Q
-        z = torch.zeros((1, 24), device=device)
-        z[0, 3] = 0.5
-        z[0, 13] = 0.5
-        z_found = (x[:, :, 22] == 1).nonzero(as_tuple=False)
-        x[z_found[:, 0], z_found[:, 1]] = z
-        # Treat J: I or L
-        j = torch.zeros((1, 24), device=device)
-        j[0, 7] = 0.5
-        j[0, 9] = 0.5
-        j_found = (x[:, :, 23] == 1).nonzero(as_tuple=False)
-        x[j_found[:, 0], j_found[:, 1]] = j
-        # Cut away B, Z, J to obtain
-        # Index    0  3  6  9 12 15 18 21
-        # Letter   ACDEFGHIKLMNPQRSTVWYX
-        x = x[:, :, :21]
-
-        return x
+        return nn.functional.embedding(x, self.encoding.to(x.device))
 
 
 class DeepFam(nn.Module):
@@ -6,9 +6,11 @@ Date: 2019-10-09
 Description: Convolutional networks for protein orthologous group assignment.
 """
 # SPDX-License-Identifier: BSD-3-Clause
+from copy import deepcopy
 
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 
 from ..data import gen_amino_acid_vocab
@@ -16,6 +18,7 @@ from ..data import gen_amino_acid_vocab
 
 __all__ = ['AminoAcidWordEmbedding',
            'DeepNOG',
+           'MultiDeepNOG',
            ]
 
 
@@ -59,6 +62,70 @@ class AminoAcidWordEmbedding(nn.Module):
         return x
 
 
+def _conv_max_pool(conv: nn.Conv1d, x, tile_length: int):
+    """ Maximum of a convolution over the sequence, computed in tiles.
+
+    Equivalent to ``conv(x).max(dim=2, keepdim=True)``, but only one tile
+    of ``tile_length`` output positions is materialized at a time.
+    """
+    # Quantized convolutions are wrapped by (de)quantization stubs
+    kernel_size = getattr(conv, 'module', conv).kernel_size[0]
+    n_out = x.shape[2] - kernel_size + 1
+    if n_out <= tile_length:
+        return conv(x).max(dim=2, keepdim=True)[0]
+    running_max = None
+    for start in range(0, n_out, tile_length):
+        x_tile = x[:, :, start:start + tile_length + kernel_size - 1]
+        tile_max = conv(x_tile).max(dim=2, keepdim=True)[0]
+        running_max = tile_max if running_max is None else torch.max(running_max, tile_max)
+    return running_max
+
+
+def _pack_convolutions(convs):
+    """ Zero-pad kernels to the largest kernel size, and concatenate them.
+
+    Returns the packed weight and bias, and the original kernel size
+    of each output channel.
+    """
+    max_kernel_size = max(conv.kernel_size[0] for conv in convs)
+    with torch.no_grad():
+        weight = torch.cat([F.pad(conv.weight, (0, max_kernel_size - conv.kernel_size[0]))
+                            for conv in convs], dim=0)
+        bias = torch.cat([conv.bias for conv in convs], dim=0)
+    kernel_sizes = torch.cat([torch.full((conv.out_channels, ), conv.kernel_size[0],
+                                         dtype=torch.long, device=weight.device)
+                              for conv in convs])
+    return weight, bias, kernel_sizes
+
+
+def _packed_conv_max_pool(x, weight, bias, kernel_sizes, tile_length: int):
+    """ Maximum of packed convolutions over the sequence, computed in tiles.
+
+    Kernels are zero-padded on the right, so that output position t of each
+    channel equals that of its original convolution, as long as t is a valid
+    position for the original kernel size. Invalid positions at the end of
+    the sequence are masked before taking the maximum.
+    """
+    max_kernel_size = weight.shape[2]
+    min_kernel_size = int(kernel_sizes.min())
+    length = x.shape[2]
+    n_out = length - min_kernel_size + 1
+    # Positions valid for all kernel sizes need no masking
+    n_valid_all = length - max_kernel_size + 1
+    n_valid = (length - kernel_sizes + 1).view(1, -1, 1)
+    x = F.pad(x, (0, max_kernel_size - min_kernel_size))
+    running_max = None
+    for start in range(0, n_out, tile_length):
+        stop = min(start + tile_length, n_out)
+        x_conv = F.conv1d(x[:, :, start:stop + max_kernel_size - 1], weight, bias)
+        if stop > n_valid_all:
+            positions = torch.arange(start, stop, device=x.device).view(1, 1, -1)
+            x_conv = x_conv.masked_fill(positions >= n_valid, float('-inf'))
+        tile_max = x_conv.max(dim=2, keepdim=True)[0]
+        running_max = tile_max if running_max is None else torch.max(running_max, tile_max)
+    return running_max
+
+
 class DeepNOG(nn.Module):
     """ Convolutional network for protein orthologous group prediction.
 
@@ -90,7 +157,16 @@ class DeepNOG(nn.Module):
     -----
     This architecture's working title was `DeepEncoding`. The old name was
     last available in  `deepnog 1.2.2`.
+
+    In evaluation mode with max pooling, the maximum is taken before the
+    SELU activation (which is monotonic), and computed over tiles of
+    ``inference_tile_length`` convolution outputs. Full activation maps are
+    thus never materialized, which cuts peak memory for long proteins.
+    After :meth:`pack_convolutions`, all kernel sizes are computed by one
+    wide convolution in this case.
     """
+    #: Number of convolution output positions computed at a time during inference
+    inference_tile_length = 1024
 
     def __init__(self, model_dict):
         super().__init__()
@@ -151,36 +227,96 @@ class DeepNOG(nn.Module):
         # Threshold for deciding below which confidence NN should be undecided
         if 'threshold' in model_dict:
             self.threshold = model_dict['threshold']
+        # Temperature for calibrated confidences (see learning.fit_temperature)
+        if 'temperature' in model_dict:
+            self.temperature = model_dict['temperature']
 
-    def forward(self, x):
-        """ Forward a batch of sequences through network.
+        # Packed convolutions for inference (see pack_convolutions)
+        self._packed = None
+
+    def pack_convolutions(self):
+        """ Concatenate all convolutions into one for faster inference.
+
+        Kernels are zero-padded to the largest kernel size, and concatenated
+        into a single convolution. Positions beyond the valid length of
+        smaller kernels are masked before pooling, so that outputs equal
+        those of separate convolutions. One large matrix multiplication
+        replaces one small multiplication per kernel size.
+
+        The packed weights are a copy, used in evaluation mode with max
+        pooling only. Call this method again after changing the weights
+        or moving the model to another device.
+
+        Returns
+        -------
+        self : DeepNOG
+        """
+        self._packed = _pack_convolutions([getattr(self, f'conv{i+1}')
+                                           for i in range(self.n_conv_layers)])
+        return self
+
+    def embed(self, x):
+        """ Pooled features of a batch of sequences.
+
+        The concatenated max-pooled convolution outputs are the input of the
+        classification layer. They serve as fixed-length protein embeddings,
+        e.g. for clustering (see ``deepnog embed``).
 
         Parameters
         ----------
         x : Tensor, shape (batch_size, sequence_len)
-            Sequence or batch of sequences to classify. Assumes they are
+            Sequence or batch of sequences to embed. Assumes they are
             translated using a vocabulary. (See gen_amino_acid_vocab in
             dataset.py)
 
         Returns
         -------
-        out : Tensor, shape (batch_size, n_classes)
-            Confidence of sequence(s) being in one of the n_classes.
+        out : Tensor, shape (batch_size, n_filters * n_conv_layers)
+            Protein embeddings
         """
         # Amino acid embedding
         x = self.encoding(x).permute(0, 2, 1).contiguous()
 
         # Convolution with variable kernel sizes and adaptive max pooling
         max_pool_layer = []
-        for i in range(self.n_conv_layers):
-            x_conv = getattr(self, f'conv{i+1}')(x)
-            x_conv = self.activation1(x_conv)
-            x_conv = self.pool1(x_conv)
-            max_pool_layer.append(x_conv)
+        fused = not self.training and isinstance(self.pool1, nn.AdaptiveMaxPool1d)
+        if fused and self._packed is not None:
+            # All kernel sizes in one wide convolution
+            x_conv = _packed_conv_max_pool(x, *self._packed, self.inference_tile_length)
+            max_pool_layer.append(self.activation1(x_conv))
+        else:
+            for i in range(self.n_conv_layers):
+                conv_layer = getattr(self, f'conv{i+1}')
+                if fused:
+                    # SELU is monotonic: pool first, activate the pooled values only
+                    x_conv = _conv_max_pool(conv_layer, x, self.inference_tile_length)
+                    x_conv = self.activation1(x_conv)
+                else:
+                    x_conv = conv_layer(x)
+                    x_conv = self.activation1(x_conv)
+                    x_conv = self.pool1(x_conv)
+                max_pool_layer.append(x_conv)
 
         # Concatenate max_pooling output of different convolutions
         x = torch.cat(max_pool_layer, dim=1)
-        x = x.view(-1, x.shape[1])
+        return x.view(-1, x.shape[1])
+
+    def forward(self, x):
+        """ Forward a batch of sequences through network.
+
+        Parameters
+        ----------
+        x : Tensor, shape (batch_size, sequence_len)
+            Sequence or batch of sequences to classify. Assumes they are
+            translated using a vocabulary. (See gen_amino_acid_vocab in
+            dataset.py)
+
+        Returns
+        -------
+        out : Tensor, shape (batch_size, n_classes)
+            Confidence of sequence(s) being in one of the n_classes.
+        """
+        x = self.embed(x)
 
         # Classification layer
         x = self.classification1(x)
@@ -188,3 +324,110 @@ class DeepNOG(nn.Module):
         # NOTE: v1.2.0 removed the softmax here. Must now be performed in
         # inference module (otherwise, cross entropy loss requires hacks)
         return x
+
+
+class MultiDeepNOG(nn.Module):
+    """ Several DeepNOG models evaluated in one pass (e.g. for several taxonomic levels).
+
+    The models must share their hyperparameters (embedding dimension,
+    kernel sizes, number of filters, pooling), but may differ in their
+    weights and number of classes. Their embeddings are concatenated into
+    one embedding, and the convolutions of each kernel size are stacked into
+    one grouped convolution, so that the pooled features of all models are
+    computed with a single, wider kernel call per kernel size.
+    Each model's classification layer is then applied to its share of the
+    features.
+
+    This module is meant for inference only (it has no dropout layer).
+    With max pooling, convolutions are pooled in tiles before the activation,
+    as in ``DeepNOG`` in evaluation mode.
+
+    Parameters
+    ----------
+    models : list of DeepNOG
+        Trained models
+
+    Raises
+    ------
+    ValueError
+        If the models do not share their architecture.
+    """
+    #: Forward returns one output per model
+    multi_output = True
+    #: Number of convolution output positions computed at a time
+    inference_tile_length = DeepNOG.inference_tile_length
+
+    def __init__(self, models):
+        super().__init__()
+        models = list(models)
+        if not models:
+            raise ValueError('At least one model is required.')
+        if not all(isinstance(m, DeepNOG) for m in models):
+            raise ValueError('All models must be DeepNOG models.')
+
+        def _architecture(m):
+            return (m.encoding.embedding.weight.shape,
+                    [getattr(m, f'conv{i+1}').weight.shape for i in range(m.n_conv_layers)],
+                    type(m.pool1))
+        first = models[0]
+        if any(_architecture(m) != _architecture(first) for m in models[1:]):
+            raise ValueError('Models must share embedding dimension, kernel sizes, '
+                             'number of filters, and pooling layer type.')
+
+        self.n_models = len(models)
+        self.n_conv_layers = first.n_conv_layers
+        self.n_filters = first.conv1.out_channels
+        self.n_classes = [m.n_classes for m in models]
+        with torch.no_grad():
+            # Concatenated embeddings: channel block j belongs to model j
+            self.embedding = nn.Embedding.from_pretrained(
+                torch.cat([m.encoding.embedding.weight for m in models], dim=1),
+                freeze=True)
+            for i in range(self.n_conv_layers):
+                convs = [getattr(m, f'conv{i+1}') for m in models]
+                conv_layer = nn.Conv1d(in_channels=self.n_models * convs[0].in_channels,
+                                       out_channels=self.n_models * self.n_filters,
+                                       kernel_size=convs[0].kernel_size,
+                                       groups=self.n_models)
+                conv_layer.weight.copy_(torch.cat([c.weight for c in convs], dim=0))
+                conv_layer.bias.copy_(torch.cat([c.bias for c in convs], dim=0))
+                self.add_module(f'conv{i+1}', conv_layer)
+        self.activation1 = nn.SELU()
+        self.pool1 = deepcopy(first.pool1)
+        self.classification = nn.ModuleList([deepcopy(m.classification1) for m in models])
+        self.softmax = nn.Softmax(dim=1)
+        self.to(first.conv1.weight.device)
+        self.eval()
+
+    def forward(self, x):
+        """ Forward a batch of sequences through all networks.
+
+        Parameters
+        ----------
+        x : Tensor, shape (batch_size, sequence_len)
+            Sequence or batch of sequences to classify. Assumes they are
+            translated using a vocabulary. (See gen_amino_acid_vocab in
+            dataset.py)
+
+        Returns
+        -------
+        out : list of Tensor, shape (batch_size, n_classes)
+            Output of each model (before softmax)
+        """
+        x = self.embedding(x.long()).permute(0, 2, 1).contiguous()
+
+        # One grouped convolution per kernel size for all models
+        max_pool_layer = []
+        fused = isinstance(self.pool1, nn.AdaptiveMaxPool1d)
+        for i in range(self.n_conv_layers):
+            conv_layer = getattr(self, f'conv{i+1}')
+            if fused:
+                x_conv = _conv_max_pool(conv_layer, x, self.inference_tile_length)
+                x_conv = self.activation1(x_conv)
+            else:
+                x_conv = self.pool1(self.activation1(conv_layer(x)))
+            max_pool_layer.append(x_conv.view(-1, self.n_models, self.n_filters))
+        # Features of model j in the same order as in DeepNOG.forward
+        x = torch.cat(max_pool_layer, dim=2)
+
+        return [layer(x[:, j]) for j, layer in enumerate(self.classification)]
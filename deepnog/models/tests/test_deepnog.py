@@ -3,10 +3,12 @@ import pytest
 from tempfile import TemporaryDirectory
 import numpy as np
 import pandas as pd
+import torch
 
 from deepnog.data import ProteinIterableDataset
 from deepnog.learning import fit, predict
-from deepnog.utils import create_df, get_config
+from deepnog.models.deepnog import DeepNOG, MultiDeepNOG
+from deepnog.utils import create_df, get_config, load_nn
 
 DEEPNOG_ROOT = Path(__file__).parent.parent.parent.absolute()
 TRAINING_FASTA = DEEPNOG_ROOT/"tests/data/test_training_dummy.faa"
@@ -53,3 +55,104 @@ def test_fit_model_and_predict(architecture):
                            left_on="protein_id",
                            right_on="sequence_id")
         np.testing.assert_array_equal(df.prediction, df.eggnog_id)
+
+
+def _deepnog_model(n_classes, seed, **kwargs):
+    torch.manual_seed(seed)
+    model_dict = dict(n_classes=n_classes, encoding_dim=10, kernel_size=[8, 12, 24],
+                      n_filters=16, dropout=0.3, pooling_layer_type='max')
+    model_dict.update(kwargs)
+    model = DeepNOG(model_dict)
+    for p in model.parameters():  # avoid trivial (e.g. all-zero) biases
+        p.data.normal_(0., 0.1)
+    return model.eval()
+
+
+def test_multi_deepnog():
+    """ The fused model computes the same outputs as separate models. """
+    models = [_deepnog_model(n_classes, seed) for seed, n_classes in enumerate([5, 3, 7])]
+    fused = MultiDeepNOG(models)
+    x = torch.randint(1, 26, (4, 50))
+    with torch.no_grad():
+        outputs = fused(x)
+        assert len(outputs) == len(models)
+        for model, output in zip(models, outputs):
+            expected = model(x)
+            assert output.shape == expected.shape
+            np.testing.assert_allclose(output, expected, rtol=1e-4, atol=1e-5)
+
+    # predict() treats the fused model like the list of models
+    dataset = ProteinIterableDataset(TRAINING_FASTA)
+    preds, confs, ids, _ = predict(fused, dataset, num_workers=0, verbose=0)
+    dataset = ProteinIterableDataset(TRAINING_FASTA)
+    preds_list, confs_list, ids_list, _ = predict(models, dataset, num_workers=0, verbose=0)
+    assert ids == ids_list
+    np.testing.assert_array_equal(preds, preds_list)
+    np.testing.assert_allclose(confs, confs_list, rtol=1e-4)
+
+
+def test_multi_deepnog_requires_same_architecture():
+    with pytest.raises(ValueError):
+        MultiDeepNOG([])
+    with pytest.raises(ValueError):
+        MultiDeepNOG([_deepnog_model(5, 0), _deepnog_model(5, 1, n_filters=8)])
+    with pytest.raises(ValueError):
+        MultiDeepNOG([_deepnog_model(5, 0), _deepnog_model(5, 1, kernel_size=[8, 12])])
+
+
+@pytest.mark.parametrize('tile_length', [1, 7, 100, 1024])
+@pytest.mark.parametrize('sequence_length', [36, 50, 333])
+def test_fused_conv_max_pool(tile_length, sequence_length):
+    """ Pooling before SELU in tiles gives the same outputs as the training path. """
+    model = _deepnog_model(5, 0)
+    model.inference_tile_length = tile_length
+    x = torch.randint(1, 26, (3, sequence_length))
+    with torch.no_grad():
+        fused = model.eval()(x)
+        model.train()
+        expected = model(x)
+    np.testing.assert_allclose(fused, expected, rtol=1e-5, atol=1e-6)
+
+    fused_levels = MultiDeepNOG([model.eval(), _deepnog_model(3, 1)])
+    fused_levels.inference_tile_length = tile_length
+    with torch.no_grad():
+        np.testing.assert_allclose(fused_levels(x)[0], expected, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize('tile_length', [1, 13, 1024])
+@pytest.mark.parametrize('sequence_length', [36, 37, 50, 333])
+def test_packed_convolutions(tile_length, sequence_length):
+    """ One wide convolution gives the same outputs as separate convolutions. """
+    model = _deepnog_model(5, 0)
+    x = torch.randint(1, 26, (3, sequence_length))
+    with torch.no_grad():
+        expected = model(x)
+        model.pack_convolutions()
+        model.inference_tile_length = tile_length
+        packed = model(x)
+        # Training does not use the packed weights
+        model.train()
+        trained = model(x)
+    np.testing.assert_allclose(packed, expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(trained, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_load_nn_pack_convolutions():
+    weights = DEEPNOG_ROOT/"tests/parameters/test_deepnog.pthsmall"
+    model_dict = torch.load(weights, map_location='cpu')
+    model = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer')
+    packed = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', pack_convolutions=True)
+    assert model._packed is None and packed._packed is not None
+    x = torch.randint(1, 26, (2, 100))
+    with torch.no_grad():
+        np.testing.assert_allclose(packed(x), model(x), rtol=1e-5, atol=1e-6)
+
+
+def test_embed():
+    """ Embeddings are the inputs of the classification layer. """
+    model = _deepnog_model(5, 0).eval()
+    x = torch.randint(1, 26, (3, 100))
+    with torch.no_grad():
+        embeddings = model.embed(x)
+        assert embeddings.shape == (3, model.classification1.in_features)
+        np.testing.assert_allclose(model.classification1(embeddings), model(x))
@@ -0,0 +1,8 @@
+from .server import ModelCache, make_server
+from ..utils.imports import try_import_pytorch
+
+__all__ = ['ModelCache',
+           'make_server',
+           ]
+
+try_import_pytorch()
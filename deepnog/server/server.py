@@ -0,0 +1,318 @@
+"""
+Date: 2026-10-18
+
+Description:
+
+    Persistent inference server keeping recently used models in memory.
+
+    Sequences are posted in FASTA format over HTTP (TCP or Unix socket),
+    and predictions are returned in the CSV format of ``deepnog infer``.
+"""
+# SPDX-License-Identifier: BSD-3-Clause
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import os
+from pathlib import Path
+import socket
+import socketserver
+import stat
+import threading
+from typing import List, NamedTuple, Tuple, Union
+from urllib.parse import parse_qs, urlparse
+
+from ..learning import BatchingPredictor
+from ..utils import create_df, get_config, get_exported_path, get_logger, get_weights_path
+from ..utils import is_current_export, load_nn, read_fasta, set_device, try_import_pytorch
+
+torch = try_import_pytorch()
+
+__all__ = ['ModelCache',
+           'make_server',
+           ]
+
+SEPARATORS = {'csv': ',', 'tsv': '\t', 'legacy': ';'}
+
+cached_model = NamedTuple('cached_model',
+                          [('model', torch.nn.Module),
+                           ('class_labels', list),
+                           ('threshold', Union[float, None]),
+                           ('predictor', BatchingPredictor)])
+
+
+class ModelCache:
+    """ Least-recently-used cache of ready-to-use models.
+
+    Models are identified by database, taxonomic level, and architecture,
+    and loaded upon first use (downloading weights, if necessary).
+
+    Parameters
+    ----------
+    capacity : int, optional
+        Maximum number of models kept in memory
+    device : str or torch.device, optional
+        Device for inference
+    batch_size : int, optional
+        Maximum number of sequences per forward pass.
+        Sequences from concurrent requests are batched together.
+    max_wait_ms : float, optional
+        Maximum time (in milliseconds) a sequence waits for further
+        sequences to fill its batch (see :class:`deepnog.learning.BatchingPredictor`)
+    data_home : str, optional
+        Directory of network weights (see :func:`deepnog.utils.get_data_home`)
+    verbose : int, optional
+        Verbosity
+    """
+    def __init__(self, capacity: int = 4, device='auto', batch_size: int = 64,
+                 max_wait_ms: float = 5., data_home: str = None, verbose: int = 0):
+        if capacity < 1:
+            raise ValueError(f'Cache capacity must be at least one, got {capacity}.')
+        self.capacity = capacity
+        self.device = set_device(device)
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.data_home = data_home
+        self.verbose = verbose
+        self.config = get_config()
+        self._models = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def keys(self) -> List[Tuple[str, str, str]]:
+        """ Database, taxonomic level, and architecture of the cached models,
+        from least to most recently used. """
+        with self._lock:
+            return list(self._models)
+
+    def get(self, database: str, tax: str, architecture: str = 'deepnog') -> cached_model:
+        """ Get a model from the cache, loading it if necessary.
+
+        Raises ValueError for databases, taxonomic levels, and architectures
+        not listed in the deepnog configuration.
+        """
+        key = (database, str(tax), architecture)
+        self._check_model(*key)
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is not None:
+                self._models.move_to_end(key)
+                return entry
+            loading = self._loading.setdefault(key, threading.Lock())
+        # Load each model once, without blocking requests for other models
+        with loading:
+            with self._lock:
+                entry = self._models.get(key)
+            if entry is None:
+                evicted = []
+                try:
+                    entry = self._load(*key)
+                finally:
+                    # Publish the model and drop its loading lock at once,
+                    # so that concurrent requests find either of them
+                    with self._lock:
+                        self._loading.pop(key, None)
+                        if entry is not None:
+                            self._models[key] = entry
+                            evicted = [self._models.popitem(last=False)[1]
+                                       for _ in range(len(self._models) - self.capacity)]
+                for old_entry in evicted:
+                    old_entry.predictor.close()
+        return entry
+
+    def _check_model(self, database: str, tax: str, architecture: str):
+        """ Only accept models of the configuration, as their names become file paths. """
+        try:
+            levels = self.config['database'][database]
+        except (KeyError, TypeError):
+            raise ValueError(f'Unknown database: {database}') from None
+        if tax not in [str(level) for level in levels]:
+            raise ValueError(f'Unknown taxonomic level of {database}: {tax}')
+        if architecture not in self.config['architecture']:
+            raise ValueError(f'Unknown architecture: {architecture}')
+
+    def _load(self, database: str, tax: str, architecture: str) -> cached_model:
+        logger = get_logger(__name__, verbose=self.verbose)
+        arch = self.config['architecture'][architecture]
+        weights_path = get_weights_path(database=database, level=tax,
+                                        architecture=architecture,
+                                        data_home=self.data_home,
+                                        verbose=self.verbose)
+        if not Path(weights_path).is_file():
+            raise ValueError(f'No {architecture} model available for '
+                             f'{database} (tax {tax}).')
+        logger.info(f'Loading {database} (tax {tax}) {architecture} model')
+        exported_path = get_exported_path(weights_path)
+        if is_current_export(exported_path, weights_path):
+            # Frozen TorchScript model created by 'deepnog export'
+            model = load_nn(architecture=(arch['module'], arch['class']),
+                            model_dict=exported_path,
+                            phase='infer',
+                            device=self.device)
+            class_labels = model.classes
+        else:
+            model_dict = torch.load(weights_path, map_location=self.device)
+            model = load_nn(architecture=(arch['module'], arch['class']),
+                            model_dict=model_dict,
+                            phase='infer',
+                            device=self.device)
+            class_labels = model_dict['classes']
+        threshold = getattr(model, 'threshold', None)
+        return cached_model(model=model,
+                            class_labels=class_labels,
+                            threshold=None if threshold is None else float(threshold),
+                            predictor=BatchingPredictor(model, device=self.device,
+                                                        max_batch_size=self.batch_size,
+                                                        max_wait_ms=self.max_wait_ms))
+
+    def close(self):
+        """ Remove all models from the cache. """
+        with self._lock:
+            for entry in self._models.values():
+                entry.predictor.close()
+            self._models.clear()
+
+
+def _predict_fasta(cache: ModelCache, fasta: bytes, database: str = 'eggNOG5',
+                   tax: str = '2', architecture: str = 'deepnog',
+                   confidence_threshold: str = None, outformat: str = 'csv') -> str:
+    """ Predict the sequences of a FASTA document, and return CSV output. """
+    try:
+        separator = SEPARATORS[outformat]
+    except KeyError:
+        raise ValueError(f'Unknown output format: {outformat}') from None
+    entry = cache.get(database, tax, architecture)
+    if confidence_threshold is not None:
+        threshold = float(confidence_threshold)
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f'Invalid confidence threshold specified: '
+                             f'{threshold} not in range (0, 1].')
+    else:
+        threshold = entry.threshold
+
+    records = [(i, sequence_id, residues)
+               for i, (sequence_id, residues) in enumerate(read_fasta(BytesIO(fasta)), 1)
+               if sequence_id != '']
+    try:
+        futures = [entry.predictor.submit(residues) for _, _, residues in records]
+    except RuntimeError:
+        # The model was evicted from the cache meanwhile: load it again
+        entry = cache.get(database, tax, architecture)
+        futures = [entry.predictor.submit(residues) for _, _, residues in records]
+    results = [future.result() for future in futures]
+    df = create_df(entry.class_labels,
+                   torch.tensor([pred for pred, _ in results], dtype=torch.long),
+                   torch.tensor([conf for _, conf in results], dtype=torch.float32),
+                   [sequence_id for _, sequence_id, _ in records],
+                   [index for index, _, _ in records],
+                   threshold=threshold)
+    return df.to_csv(sep=separator, index=False,
+                     columns=['sequence_id', 'prediction', 'confidence'])
+
+
+class _PredictionRequestHandler(BaseHTTPRequestHandler):
+    """ Handle prediction requests.
+
+    ``POST /predict?database=eggNOG5&tax=2`` with FASTA in the request body
+    returns predictions in CSV format. Further optional query parameters
+    are architecture, confidence_threshold, and outformat (csv, tsv, legacy).
+    ``GET /health`` returns the models currently held in memory.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/health':
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        models = ''.join(f'{database},{tax},{arch}\n'
+                         for database, tax, arch in self.server.cache.keys())
+        self._send(HTTPStatus.OK, f'ok\n{models}', 'text/plain')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/predict':
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        fasta = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            csv = _predict_fasta(self.server.cache, fasta, **params)
+        except (TypeError, ValueError) as e:
+            self.send_error(HTTPStatus.BAD_REQUEST, explain=str(e))
+        except Exception as e:
+            self.server.logger.error(f'Prediction failed: {e!r}')
+            self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, explain=str(e))
+        else:
+            self._send(HTTPStatus.OK, csv, 'text/csv')
+
+    def _send(self, status, text: str, content_type: str):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix-socket'
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(f'{self.address_string()} - {format % args}')
+
+
+class _UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def make_server(cache: ModelCache, host: str = '127.0.0.1', port: int = 8000,
+                socket_path: str = None, verbose: int = 0) -> ThreadingHTTPServer:
+    """ Create an HTTP server answering prediction requests.
+
+    Parameters
+    ----------
+    cache : ModelCache
+        Cache of models used to answer requests
+    host : str, optional
+        Host name or IP address to listen on
+    port : int, optional
+        TCP port to listen on. Use 0 to pick any free port.
+    socket_path : str, optional
+        If given, listen on this Unix socket instead of a TCP port
+    verbose : int, optional
+        Verbosity
+
+    Returns
+    -------
+    server : http.server.ThreadingHTTPServer
+        Call ``serve_forever()`` to start answering requests
+        (see :class:`_PredictionRequestHandler` for the API).
+    """
+    if socket_path is not None:
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)  # left over from a previous server
+        server = _UnixHTTPServer(str(socket_path), _PredictionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), _PredictionRequestHandler)
+    server.daemon_threads = True
+    server.cache = cache
+    server.logger = get_logger(__name__, verbose=verbose)
+    return server
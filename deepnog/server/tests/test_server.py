@@ -0,0 +1,207 @@
+"""
+Date: 2026-10-18
+Description:
+    Test the inference server.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from io import StringIO
+from pathlib import Path
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import warnings
+
+import pandas as pd
+import pytest
+import torch
+
+from deepnog.data import ProteinIterableDataset
+from deepnog.learning import predict
+from deepnog.server import ModelCache, make_server
+from deepnog.server.server import _predict_fasta
+from deepnog.tests.utils import get_deepnog_root
+from deepnog.utils import ExportedModel, create_df, export_model, load_nn
+
+TESTS = get_deepnog_root()/"tests"
+WEIGHTS = TESTS/"parameters/test_deepnog.pthsmall"
+TEST_FILE = TESTS/"data/test_inference_short.faa"
+
+
+@pytest.fixture
+def data_home():
+    """ Data directory with test weights for two taxonomic levels. """
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_data_dir_') as tmpdir:
+        for tax in ['1', '2']:
+            weights_dir = Path(tmpdir)/'eggNOG5'/tax
+            weights_dir.mkdir(parents=True)
+            shutil.copy(WEIGHTS, weights_dir/'deepnog.pth')
+        yield tmpdir
+
+
+def _serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def _expected_csv(sep=','):
+    model_dict = torch.load(WEIGHTS)
+    model = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+    dataset = ProteinIterableDataset(TEST_FILE, f_format='fasta')
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)
+        df = create_df(model_dict['classes'],
+                       *predict(model, dataset, device='cpu', batch_size=1, verbose=0))
+    return df.to_csv(sep=sep, index=False, columns=['sequence_id', 'prediction', 'confidence'])
+
+
+def test_model_cache(data_home):
+    cache = ModelCache(capacity=1, device='cpu', data_home=data_home)
+    first = cache.get('eggNOG5', '1')
+    assert cache.get('eggNOG5', 1) is first
+    cache.get('eggNOG5', '2')
+    assert cache.keys() == [('eggNOG5', '2', 'deepnog')]
+    # Evicted models are shut down
+    with pytest.raises(RuntimeError):
+        first.predictor.submit('MATTACKK')
+    with pytest.raises(ValueError, match='Unknown taxonomic level'):
+        cache.get('eggNOG5', '3', 'deepnog')
+    with pytest.raises(ValueError, match='Unknown database'):
+        cache.get('../../outside', '2')
+    with pytest.raises(ValueError, match='Unknown architecture'):
+        cache.get('eggNOG5', '2', 'no_such_architecture')
+    assert sorted(p.name for p in Path(data_home).iterdir()) == ['eggNOG5']
+    cache.close()
+    assert len(cache) == 0
+
+
+def test_model_cache_loads_once(data_home, monkeypatch):
+    cache = ModelCache(device='cpu', data_home=data_home)
+    load = cache._load
+    loaded = []
+
+    def _slow_load(*key):
+        entry = load(*key)
+        time.sleep(0.05)
+        loaded.append(key)
+        return entry
+
+    monkeypatch.setattr(cache, '_load', _slow_load)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            entries = list(executor.map(lambda _: cache.get('eggNOG5', '2'), range(32)))
+        assert loaded == [('eggNOG5', '2', 'deepnog')]
+        assert all(entry is entries[0] for entry in entries)
+        assert not cache._loading
+    finally:
+        cache.close()
+
+
+def test_model_cache_failed_load(data_home, monkeypatch):
+    cache = ModelCache(device='cpu', data_home=data_home)
+
+    def _fail(*args):
+        raise ValueError('No deepnog model')
+
+    monkeypatch.setattr(cache, '_load', _fail)
+    for _ in range(2):
+        with pytest.raises(ValueError, match='No deepnog model'):
+            cache.get('eggNOG5', '2')
+    assert not cache._loading
+    monkeypatch.undo()
+    assert cache.get('eggNOG5', '2') is not None
+    cache.close()
+
+
+@pytest.mark.parametrize('outformat, sep', [('csv', ','), ('tsv', '\t')])
+def test_http_server(data_home, outformat, sep):
+    cache = ModelCache(capacity=2, device='cpu', batch_size=1, data_home=data_home)
+    server = make_server(cache, port=0)
+    _serve(server)
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        with urlopen(f'{url}/predict?database=eggNOG5&tax=2&outformat={outformat}',
+                     data=TEST_FILE.read_bytes()) as response:
+            assert response.status == 200
+            assert response.read().decode() == _expected_csv(sep)
+        with urlopen(f'{url}/health') as response:
+            assert response.read().decode() == 'ok\neggNOG5,2,deepnog\n'
+        for query in ['tax=2&outformat=xml', 'tax=2&confidence_threshold=2', 'tax=99',
+                      'database=..%2F..%2Fx&tax=2', 'tax=..%2F1']:
+            with pytest.raises(HTTPError) as e:
+                urlopen(f'{url}/predict?{query}', data=b'>a\nMA\n')
+            assert e.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        cache.close()
+
+
+def test_concurrent_requests_are_merged(data_home):
+    cache = ModelCache(capacity=1, device='cpu', batch_size=32, data_home=data_home)
+    server = make_server(cache, port=0)
+    _serve(server)
+    url = f'http://127.0.0.1:{server.server_port}/predict?tax=2'
+    fasta = TEST_FILE.read_bytes()
+    expected = pd.read_csv(StringIO(_expected_csv()))
+
+    def _request(_):
+        with urlopen(url, data=fasta) as response:
+            return pd.read_csv(StringIO(response.read().decode()))
+
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(_request, range(16)))
+    finally:
+        server.shutdown()
+        server.server_close()
+        cache.close()
+    for df in results:
+        pd.testing.assert_series_equal(df.sequence_id, expected.sequence_id)
+        # Predictions may differ slightly due to zero-padding in larger batches
+        assert (df.prediction == expected.prediction).mean() > 0.9
+
+
+def test_unix_socket_server(data_home):
+    if not hasattr(socket, 'AF_UNIX'):
+        pytest.skip('Unix sockets not available')
+
+    class UnixHTTPConnection(HTTPConnection):
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+
+    with tempfile.TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        socket_path = str(Path(tmpdir)/'deepnog.sock')
+        cache = ModelCache(device='cpu', batch_size=1, data_home=data_home)
+        server = make_server(cache, socket_path=socket_path)
+        _serve(server)
+        try:
+            connection = UnixHTTPConnection('localhost')
+            connection.request('POST', '/predict?tax=2', body=TEST_FILE.read_bytes())
+            response = connection.getresponse()
+            assert response.status == 200
+            assert response.read().decode() == _expected_csv()
+        finally:
+            server.shutdown()
+            server.server_close()
+            cache.close()
+        assert not Path(socket_path).exists()
+
+
+def test_model_cache_loads_exported_models(data_home):
+    model_dict = torch.load(WEIGHTS)
+    model = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer', device='cpu')
+    export_model(model, Path(data_home)/'eggNOG5'/'2'/'deepnog.pt', model_dict['classes'])
+    cache = ModelCache(device='cpu', batch_size=1, data_home=data_home)
+    try:
+        assert isinstance(cache.get('eggNOG5', '2').model, ExportedModel)
+        assert not isinstance(cache.get('eggNOG5', '1').model, ExportedModel)
+        assert _predict_fasta(cache, TEST_FILE.read_bytes()) == _expected_csv()
+    finally:
+        cache.close()
@@ -1,22 +1,52 @@
 from .bio import EXTENDED_IUPAC_PROTEIN_ALPHABET, SeqIO, parse
+from .bio import build_fasta_index, get_fasta_index, is_compressed, open_binary, read_fasta
+from .bio import split_fasta_record
 from .config import get_config
-from .imports import try_import_pytorch
-from .io_utils import create_df, get_data_home, get_weights_path
+from .imports import try_import_onnxruntime, try_import_pytorch
+from .io_utils import PredictionWriter, create_df, get_data_home, get_weights_path
+from .io_utils import file_digest, file_fingerprint, prediction_columns, read_manifest
+from .io_utils import write_manifest
+from .io_utils import read_labels
 from .logger import get_logger
 from .sync import SynchronizedCounter
-from .network import count_parameters, load_nn, set_device
+from .network import ExportedModel, count_parameters, export_model, get_exported_path
+from .network import is_current_export
+from .network import OnnxModel, load_exported, load_nn, set_device
+from .network import PRECISIONS, mixed_precision
 
-__all__ = ['count_parameters',
+__all__ = ['build_fasta_index',
+           'count_parameters',
            'create_df',
            'EXTENDED_IUPAC_PROTEIN_ALPHABET',
+           'export_model',
+           'ExportedModel',
+           'file_digest',
+           'file_fingerprint',
            'get_config',
            'get_data_home',
+           'get_exported_path',
+           'get_fasta_index',
            'get_logger',
            'get_weights_path',
+           'is_compressed',
+           'is_current_export',
+           'load_exported',
            'load_nn',
+           'mixed_precision',
+           'OnnxModel',
+           'open_binary',
            'parse',
+           'prediction_columns',
+           'PredictionWriter',
+           'PRECISIONS',
+           'read_fasta',
+           'read_labels',
+           'read_manifest',
            'SeqIO',
            'set_device',
+           'split_fasta_record',
            'SynchronizedCounter',
+           'try_import_onnxruntime',
            'try_import_pytorch',
+           'write_manifest',
            ]
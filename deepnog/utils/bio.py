@@ -1,13 +1,27 @@
+from contextlib import nullcontext
 from functools import partial
 import gzip
+from hashlib import sha1
 import lzma
+import os
 from pathlib import Path
-from typing import Iterator
+from typing import BinaryIO, Iterator, Tuple, Union
 import warnings
 
+import numpy as np
+
+from .io_utils import get_data_home
+from .logger import get_logger
+
 __all__ = ['EXTENDED_IUPAC_PROTEIN_ALPHABET',
            'SeqIO',
+           'build_fasta_index',
+           'get_fasta_index',
+           'is_compressed',
+           'open_binary',
            'parse',
+           'read_fasta',
+           'split_fasta_record',
            ]
 
 # Bio.Alphabet.ExtendendIUPACProtein (deprecated in 2020)
@@ -44,3 +58,179 @@ def parse(p: Path, fformat: str = 'fasta', alphabet=None) -> Iterator:
     else:
         _open = open
     return SeqIO.parse(_open(str(p)), format=fformat, alphabet=alphabet)
+
+
+def is_compressed(p: Union[Path, str]) -> bool:
+    """ Whether a sequence file is gzip or xz compressed (judging from its suffix). """
+    return Path(p).suffix in ['.gz', '.gzip', '.xz', '.lzma']
+
+
+def open_binary(p: Union[Path, str]) -> BinaryIO:
+    """ Open a possibly compressed sequence file for binary reading.
+
+    Compression is detected from the file suffix in the same way as in
+    :func:`parse`. Offsets in the returned file object always refer to
+    the uncompressed byte stream.
+    """
+    p = Path(p)
+    if p.suffix in ['.gz', '.gzip']:
+        return gzip.open(str(p), mode='rb')
+    elif p.suffix in ['.xz', '.lzma']:
+        return lzma.open(str(p), mode='rb')
+    else:
+        return open(str(p), mode='rb')
+
+
+def split_fasta_record(raw: bytes) -> Tuple[str, bytes]:
+    """ Split a single raw FASTA record into identifier and residues.
+
+    The identifier is the first word of the title line, exactly as
+    in Biopython's FASTA parser. Empty titles yield an empty identifier.
+
+    Parameters
+    ----------
+    raw : bytes
+        One FASTA record, with or without the '>' of its title line.
+
+    Returns
+    -------
+    id, residues : str, bytes
+        Sequence identifier and the residues with whitespace removed.
+    """
+    title_end = raw.find(b'\n')
+    if title_end == -1:
+        title_end = len(raw)
+    title = raw[1 if raw[:1] == b'>' else 0:title_end].split(None, 1)
+    sequence_id = title[0].decode() if title else ''
+    return sequence_id, raw[title_end + 1:].translate(None, b' \t\r\n')
+
+
+def read_fasta(p: Union[Path, str, BinaryIO],
+               chunk_size: int = 2**20) -> Iterator[Tuple[str, bytes]]:
+    """ Read a possibly compressed FASTA file without creating SeqRecords.
+
+    This lean reader is considerably faster than :func:`parse`,
+    and should be preferred whenever only identifiers and residues
+    are required.
+
+    Parameters
+    ----------
+    p : Path, str, or binary file object
+        Path to a FASTA file (plain, gzip, or xz),
+        or an uncompressed binary stream (e.g. io.BytesIO), which is not closed
+    chunk_size : int, optional
+        Number of bytes read at once
+
+    Yields
+    ------
+    id, residues : str, bytes
+        Identifier (first word of the title line) and residues
+        (whitespace removed) of each record in the file.
+    """
+    with (nullcontext(p) if hasattr(p, 'read') else open_binary(p)) as f:
+        leftover = b''
+        first = True
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            records = (leftover + chunk).split(b'\n>')
+            # The last record may continue in the next chunk
+            leftover = records.pop()
+            if first and records:
+                # Skip any text before the first record
+                if not records[0].startswith(b'>'):
+                    records.pop(0)
+                first = False
+            for raw in records:
+                yield split_fasta_record(raw)
+        if leftover and (not first or leftover.startswith(b'>')):
+            yield split_fasta_record(leftover)
+
+
+def build_fasta_index(p: Union[Path, str], chunk_size: int = 2**24) -> np.ndarray:
+    """ Find the byte offsets of all records in a FASTA file.
+
+    Parameters
+    ----------
+    p : Path or str
+        Path to a possibly compressed FASTA file
+    chunk_size : int, optional
+        Number of bytes scanned at once
+
+    Returns
+    -------
+    offsets : np.ndarray, shape (n_records + 1,)
+        Offsets of each record's title line in the uncompressed byte stream.
+        The last element is the total uncompressed size, so that record
+        ``i`` spans the bytes ``offsets[i]:offsets[i+1]``.
+    """
+    offsets = []
+    previous = ord('\n')  # a title may start at the very first byte
+    position = 0
+    with open_binary(p) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            buffer = np.frombuffer(chunk, dtype=np.uint8)
+            after_newline = np.empty(buffer.size, dtype=bool)
+            after_newline[0] = previous == ord('\n')
+            after_newline[1:] = buffer[:-1] == ord('\n')
+            is_title = (buffer == ord('>')) & after_newline
+            offsets.append(np.flatnonzero(is_title) + position)
+            position += buffer.size
+            previous = buffer[-1]
+    offsets.append(np.array([position]))
+    return np.concatenate(offsets).astype(np.int64)
+
+
+def _fasta_index_path(p: Path, data_home: Union[Path, str, None]) -> Path:
+    key = sha1(str(p.resolve()).encode()).hexdigest()
+    return get_data_home(data_home)/'index'/f'{key}.npz'
+
+
+def get_fasta_index(p: Union[Path, str], data_home: Union[Path, str, None] = None,
+                    verbose: int = 0) -> np.ndarray:
+    """ Get the record offsets of a FASTA file, building the index if necessary.
+
+    Indices are stored in the 'index' subfolder of the deepnog data home
+    (see :func:`deepnog.utils.get_data_home`), and rebuilt whenever size
+    or modification time of the sequence file change.
+
+    Parameters
+    ----------
+    p : Path or str
+        Path to a possibly compressed FASTA file
+    data_home : str, optional
+        Specify another folder for storing the index.
+    verbose : int
+        Increasing levels of messages
+
+    Returns
+    -------
+    offsets : np.ndarray, shape (n_records + 1,)
+        See :func:`build_fasta_index`.
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    p = Path(p)
+    stat = p.stat()
+    index_file = _fasta_index_path(p, data_home)
+    try:
+        with np.load(str(index_file)) as index:
+            if index['size'] == stat.st_size and index['mtime'] == stat.st_mtime_ns:
+                logger.debug(f'Using FASTA index {index_file}')
+                return index['offsets']
+    except (OSError, KeyError, ValueError):
+        pass
+
+    logger.info(f'Building FASTA index of {p} ...')
+    offsets = build_fasta_index(p)
+    index_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first, so that concurrent readers
+    # never see a partially written index.
+    tmp_file = index_file.with_name(f'{index_file.stem}.{os.getpid()}.tmp.npz')
+    np.savez(str(tmp_file), offsets=offsets, size=stat.st_size, mtime=stat.st_mtime_ns)
+    os.replace(str(tmp_file), str(index_file))
+    logger.debug(f'Saved FASTA index to {index_file}')
+    return offsets
@@ -1,4 +1,5 @@
-__all__ = ['try_import_pytorch',
+__all__ = ['try_import_onnxruntime',
+           'try_import_pytorch',
            ]
 
 
@@ -18,3 +19,20 @@ def try_import_pytorch():
                "please install its requirement pytorch with:\n"
                "$ conda install pytorch -c pytorch")
         raise ImportError(msg) from e
+
+
+def try_import_onnxruntime():
+    """ Try to import onnxruntime, and raise helpful error.
+
+    Notes
+    -----
+    onnxruntime is an optional dependency for running exported
+    ONNX models (``deepnog infer --backend onnx``).
+    """
+    try:
+        import onnxruntime
+        return onnxruntime
+    except ImportError as e:
+        msg = ("\nThe ONNX backend requires onnxruntime. Please install it with:\n"
+               "$ pip install onnxruntime")
+        raise ImportError(msg) from e
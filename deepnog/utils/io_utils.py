@@ -8,15 +8,20 @@ Description:
     Input/output helper functions
 """
 # SPDX-License-Identifier: BSD-3-Clause
+import hashlib
+import heapq
+import json
+import os
 from os import environ
 from pathlib import Path
 import shutil
-from typing import List
+from typing import List, Union
 from urllib.error import URLError
 from urllib.request import urlopen
 from urllib.parse import urljoin
 import warnings
 
+import numpy as np
 import pandas as pd
 
 from deepnog.utils.logger import get_logger
@@ -25,17 +30,60 @@ from .imports import try_import_pytorch
 torch = try_import_pytorch()
 from torch import Tensor  # noqa
 
-__all__ = ['create_df',
+__all__ = ['PredictionWriter',
+           'create_df',
+           'file_digest',
+           'file_fingerprint',
            'get_data_home',
            'get_weights_path',
+           'prediction_columns',
+           'read_labels',
+           'read_manifest',
+           'write_manifest',
            ]
 
 DEEPNOG_REMOTE_DEFAULT = ('https://fileshare.csb.univie.ac.at/'
                           'deepnog/parameters/')
+TOP_K_FORMATS = ('long', 'wide')
+
+
+def prediction_columns(levels: List[str] = None, top_k: int = 1,
+                       top_k_format: str = 'long') -> List[str]:
+    """ Default output columns of predictions.
+
+    Parameters
+    ----------
+    levels : list of str, optional
+        Taxonomic levels of predictions from several models (column 'tax')
+    top_k : int, optional
+        Number of best classes reported per sequence (and level)
+    top_k_format : {'long', 'wide'}, optional
+        Report the ``top_k`` best classes in one row each (column 'rank'),
+        or in columns 'prediction_1', 'confidence_1', 'prediction_2', etc.
+
+    Returns
+    -------
+    columns : list of str
+    """
+    if top_k_format not in TOP_K_FORMATS:
+        raise ValueError(f'Unknown top-k format "{top_k_format}". '
+                         f'Must be one of {TOP_K_FORMATS}.')
+    columns = ['sequence_id']
+    if levels is not None:
+        columns.append('tax')
+    if top_k == 1:
+        columns += ['prediction', 'confidence']
+    elif top_k_format == 'long':
+        columns += ['rank', 'prediction', 'confidence']
+    else:
+        for rank in range(1, top_k + 1):
+            columns += [f'prediction_{rank}', f'confidence_{rank}']
+    return columns
 
 
 def create_df(class_labels: list, preds: Tensor, confs: Tensor, ids: List[str],
-              indices: List[int], threshold: float = None):
+              indices: List[int], threshold: float = None, levels: List[str] = None,
+              top_k: int = 1, top_k_format: str = 'long', deduplicate: bool = True):
     """ Creates one dataframe storing all relevant prediction information.
 
     The rows in the returned dataframe have the same order as the
@@ -46,45 +94,53 @@ def create_df(class_labels: list, preds: Tensor, confs: Tensor, ids: List[str],
     ----------
     class_labels : list
         Store class name corresponding to an output node of the network.
-    preds : torch.Tensor, shape (n_samples,)
-        Stores the index of the output-node with the highest activation
-    confs : torch.Tensor, shape (n_samples,)
-        Stores the confidence in the prediction
+        One list per level, if ``levels`` are given.
+    preds : torch.Tensor, shape (n_samples,) or (n_samples, n_levels)
+        Stores the index of the output-node with the highest activation.
+        With ``top_k > 1``, an additional last dimension holds the indices
+        of the ``top_k`` best output-nodes (see :func:`deepnog.learning.predict`).
+    confs : torch.Tensor, shape (n_samples,) or (n_samples, n_levels)
+        Stores the confidence in the prediction (same shape as ``preds``)
     ids : list[str]
         Stores the (possible empty) protein labels extracted from data
         file.
     indices : list[int]
         Stores the unique indices of sequences mapping to their position
         in the file
-    threshold : float
+    threshold : float, or list of float
         If given, prediction labels and confidences are set to '' if
         confidence in prediction is not at least threshold.
+        One threshold per level may be given, if ``levels`` are given.
+    levels : list of str, optional
+        Taxonomic levels of predictions from several models.
+        The data frame then holds one row per sequence and level,
+        with the level in column 'tax'.
+    top_k : int, optional
+        Number of best classes per sequence in ``preds`` and ``confs``
+    top_k_format : {'long', 'wide'}, optional
+        With ``top_k > 1``, hold one row per sequence and rank (column 'rank'),
+        or one row per sequence with columns 'prediction_1', 'confidence_1',
+        'prediction_2', etc. (see :func:`prediction_columns`).
+    deduplicate : bool, optional
+        Remove duplicate sequences (defined by their sequence_id),
+        keeping the first among the duplicates.
 
     Returns
     -------
     df : pandas.DataFrame
         Stores prediction information about the input protein sequences.
-        Duplicates (defined by their sequence_id) have been removed from df.
+        Duplicates (defined by their sequence_id) have been removed from df,
+        unless ``deduplicate`` is False.
     """
-    confs = confs.cpu().numpy()
-    if threshold is not None:
-        # Set empty label and confidence if prediction confidence below
-        # threshold of model
-        labels = [class_labels[pred] if conf >= threshold
-                  else '' for pred, conf in zip(preds, confs)]
-        confs = [str(conf) if conf >= threshold
-                 else '' for conf in confs]
-    else:
-        labels = [class_labels[int(pred)] for pred in preds]
-    # Create prediction results frame
-    df = pd.DataFrame(data={'index': indices,
-                            'sequence_id': ids,
-                            'prediction': labels,
-                            'confidence': confs})
-    df.sort_values(by='index', axis=0, inplace=True)
+    df = _prediction_frame(class_labels, preds.cpu().numpy(), confs.cpu().numpy(),
+                           ids, indices, threshold, levels, top_k, top_k_format)
+    if not deduplicate:
+        return df
+    subset = [column for column in ['sequence_id', 'tax', 'rank'] if column in df]
+    duplicate_mask = df.duplicated(subset=subset, keep='first')
     # Remove duplicate sequences
-    duplicate_mask = df.sequence_id.duplicated(keep='first')
-    n_duplicates = sum(duplicate_mask)
+    rows_per_sequence = len(df) // len(ids) if len(ids) else 1
+    n_duplicates = sum(duplicate_mask) // rows_per_sequence
     if n_duplicates > 0:
         warnings.warn(f'Detected {n_duplicates} duplicate sequences based on '
                       f'their extracted sequence id. Keeping the first '
@@ -94,6 +150,221 @@ def create_df(class_labels: list, preds: Tensor, confs: Tensor, ids: List[str],
     return df
 
 
+def _prediction_frame(class_labels: list, preds: np.ndarray, confs: np.ndarray,
+                      ids: List[str], indices: List[int], threshold: float = None,
+                      levels: List[str] = None, top_k: int = 1,
+                      top_k_format: str = 'long') -> pd.DataFrame:
+    """ Data frame of predictions sorted by index (see :func:`create_df`). """
+    if top_k_format not in TOP_K_FORMATS:
+        raise ValueError(f'Unknown top-k format "{top_k_format}". '
+                         f'Must be one of {TOP_K_FORMATS}.')
+    if levels is None:
+        levels = [None]
+        class_labels = [class_labels]
+    preds = preds.reshape(len(indices), len(levels), top_k)
+    confs = confs.reshape(len(indices), len(levels), top_k)
+    if not isinstance(threshold, (list, tuple)):
+        threshold = [threshold] * len(levels)
+    frames = []
+    for i, level in enumerate(levels):
+        wide = {}
+        for rank in range(top_k):
+            rank_confs = confs[:, i, rank]
+            if threshold[i] is not None:
+                # Set empty label and confidence if prediction confidence below
+                # threshold of model
+                labels = [class_labels[i][pred] if conf >= threshold[i]
+                          else '' for pred, conf in zip(preds[:, i, rank], rank_confs)]
+                rank_confs = [str(conf) if conf >= threshold[i]
+                              else '' for conf in rank_confs]
+            else:
+                labels = [class_labels[i][pred] for pred in preds[:, i, rank]]
+            if top_k > 1 and top_k_format == 'wide':
+                wide[f'prediction_{rank + 1}'] = labels
+                wide[f'confidence_{rank + 1}'] = rank_confs
+                continue
+            # Create prediction results frame
+            df = pd.DataFrame(data={'index': indices,
+                                    'sequence_id': ids,
+                                    'prediction': labels,
+                                    'confidence': rank_confs})
+            if top_k > 1:
+                df.insert(2, 'rank', rank + 1)
+            if level is not None:
+                df.insert(2, 'tax', level)
+            frames.append(df)
+        if wide:
+            df = pd.DataFrame(data={'index': indices, 'sequence_id': ids, **wide})
+            if level is not None:
+                df.insert(2, 'tax', level)
+            frames.append(df)
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    # Stable sort keeps the order of levels (and ranks) for each sequence
+    df.sort_values(by='index', axis=0, inplace=True, kind='mergesort')
+    return df
+
+
+class PredictionWriter:
+    """ Write predictions to a CSV file as they are computed.
+
+    In contrast to :func:`create_df`, predictions are not kept in memory
+    for the whole input file. Rows are held in a reorder buffer keyed on
+    their sequence position (index), and written in file order once the
+    buffer is full (and upon closing). Duplicate sequence ids are filtered
+    on the fly, keeping the first sequence among the duplicates.
+    The filter remembers each written id, that is, its memory grows with
+    the number of unique ids. Disable it with ``deduplicate=False`` for
+    constant memory.
+    The output is identical to writing the data frame returned by
+    :func:`create_df`, as long as sequences arrive out of order by no more
+    than ``buffer_size`` positions.
+
+    Parameters
+    ----------
+    file : str, Path, or file-like
+        Output file path, or an open text stream (e.g. sys.stdout)
+    class_labels : list
+        Class names corresponding to the output nodes of the network.
+        One list per level, if ``levels`` are given.
+    threshold : float, or list of float, optional
+        If given, prediction labels and confidences are set to '' if
+        confidence in prediction is not at least threshold.
+    sep : str, optional
+        Field separator
+    columns : list of str, optional
+        Output columns among 'index', 'sequence_id', 'prediction', 'confidence'
+        (see :func:`prediction_columns` for the default)
+    buffer_size : int, optional
+        Maximum number of rows held in the reorder buffer
+    append : bool, optional
+        Append to an existing output file. The header is only written
+        to empty files, and sequence ids already present in the file
+        count as duplicates.
+    deduplicate : bool, optional
+        Filter duplicate sequence ids. If False, all rows are written.
+    levels : list of str, optional
+        Taxonomic levels of predictions from several models. Predictions
+        then have shape (n_samples, n_levels), and are written in long
+        format with one row per sequence and level (column 'tax').
+    top_k : int, optional
+        Number of best classes per sequence in the predictions
+        (see :func:`create_df`)
+    top_k_format : {'long', 'wide'}, optional
+        Format of the ``top_k`` best classes (see :func:`create_df`)
+
+    Examples
+    --------
+    >>> with PredictionWriter('out.csv', class_labels) as writer:  # doctest: +SKIP
+    ...     predict(model, dataset, writer=writer)
+    """
+    def __init__(self, file, class_labels: list, threshold: float = None,
+                 sep: str = ',', columns: List[str] = None,
+                 buffer_size: int = 2 ** 18, append: bool = False,
+                 levels: List[str] = None, top_k: int = 1, top_k_format: str = 'long',
+                 deduplicate: bool = True):
+        if columns is None:
+            columns = prediction_columns(levels, top_k, top_k_format)
+        self.class_labels = class_labels
+        self.threshold = threshold
+        self.sep = sep
+        self.columns = columns
+        self.buffer_size = buffer_size
+        self.levels = levels
+        self.top_k = top_k
+        self.top_k_format = top_k_format
+        self.deduplicate = deduplicate
+
+        self._seen_ids = set()
+        self._header = True
+        if hasattr(file, 'write'):
+            self._file = file
+            self._close_file = False
+        else:
+            if append and Path(file).is_file() and Path(file).stat().st_size > 0:
+                if deduplicate and 'sequence_id' in columns:
+                    existing = pd.read_csv(file, sep=sep, usecols=['sequence_id'],
+                                           dtype=object, keep_default_na=False)
+                    self._seen_ids.update(existing.sequence_id)
+                self._header = False
+            self._file = open(file, 'a' if append else 'w')
+            self._close_file = True
+        self._buffer = []
+        self._last_index = 0
+        self.n_written = 0
+        self.n_duplicates = 0
+        self.n_out_of_order = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, preds: Tensor, confs: Tensor, ids: List[str], indices: List[int]):
+        """ Add a batch of predictions (see :func:`create_df` for parameters). """
+        preds = preds.cpu().tolist()
+        confs = confs.cpu().tolist()
+        for row in zip(indices, ids, preds, confs):
+            heapq.heappush(self._buffer, row)
+        if len(self._buffer) > self.buffer_size:
+            self._flush(len(self._buffer) - self.buffer_size // 2)
+
+    def _flush(self, n_rows: int):
+        rows = []
+        for _ in range(n_rows):
+            index, sequence_id, pred, conf = heapq.heappop(self._buffer)
+            if index < self._last_index:
+                self.n_out_of_order += 1
+            else:
+                self._last_index = index
+            if self.deduplicate:
+                if sequence_id in self._seen_ids:
+                    self.n_duplicates += 1
+                    continue
+                self._seen_ids.add(sequence_id)
+            rows.append((index, sequence_id, pred, conf))
+        if not rows and not self._header:
+            return
+
+        indices, ids, preds, confs = zip(*rows) if rows else ([], [], [], [])
+        preds = np.array(preds, dtype=np.int64)
+        confs = np.array(confs, dtype=np.float32)
+        df = _prediction_frame(self.class_labels, preds, confs, ids, indices,
+                               self.threshold, self.levels, self.top_k, self.top_k_format)
+        df.to_csv(self._file, sep=self.sep, index=False, columns=self.columns,
+                  header=self._header)
+        self._header = False
+        self.n_written += len(rows)
+
+    def flush(self):
+        """ Write all buffered rows, and commit them to disk.
+
+        Call this only when all predictions up to the current point have
+        been written, e.g. after completing a range of input records.
+        """
+        self._flush(len(self._buffer))
+        self._file.flush()
+        if self._close_file:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """ Write all remaining rows, and close the output file. """
+        if self._file is None:
+            return
+        self.flush()
+        if self._close_file:
+            self._file.close()
+        self._file = None
+        if self.n_duplicates > 0:
+            warnings.warn(f'Detected {self.n_duplicates} duplicate sequences based on '
+                          f'their extracted sequence id. Keeping the first '
+                          f'sequence among the duplicates when writing prediction '
+                          f'output file.')
+        if self.n_out_of_order > 0:
+            warnings.warn(f'{self.n_out_of_order} predictions were written out of '
+                          f'file order. Consider increasing the buffer size.')
+
+
 def get_data_home(data_home: str = None, verbose: int = 0) -> Path:
     """Return the path of the deepnog data dir.
 
@@ -187,3 +458,158 @@ def get_weights_path(database: str, level: str, architecture: str,
                       f"`download_if_missing` is False")
 
     return weights_file
+
+
+def file_digest(path, chunk_size: int = 2 ** 20) -> str:
+    """ Identify a file by a hash of its full content.
+
+    In contrast to :func:`file_fingerprint`, any change of the file
+    (e.g. retrained weights of identical size) changes the digest.
+
+    Parameters
+    ----------
+    path : str, Path
+        File to hash
+    chunk_size : int, optional
+        Number of bytes read at a time
+
+    Returns
+    -------
+    digest : str
+        Hex digest of the file content
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, n_bytes: int = 2 ** 20) -> str:
+    """ Identify a file by its size and a hash of its first and last bytes.
+
+    Cheap to compute for very large files, and robust to copying the file
+    (in contrast to modification times).
+
+    Parameters
+    ----------
+    path : str, Path
+        File to fingerprint
+    n_bytes : int, optional
+        Number of bytes hashed at the start and end of the file
+
+    Returns
+    -------
+    fingerprint : str
+        Size and hex digest separated by a colon
+    """
+    size = Path(path).stat().st_size
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(n_bytes))
+        if size > n_bytes:
+            f.seek(max(n_bytes, size - n_bytes))
+            digest.update(f.read(n_bytes))
+    return f'{size}:{digest.hexdigest()}'
+
+
+def read_manifest(path) -> Union[dict, None]:
+    """ Read the progress manifest of a chunked inference run.
+
+    Returns
+    -------
+    manifest : dict or None
+        The manifest, or None if the file does not exist
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(path, manifest: dict):
+    """ Atomically (over)write the progress manifest of a chunked inference run. """
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    with tmp.open('w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _labels_cache_path(p: Path, data_home: Union[Path, str, None]) -> Path:
+    key = hashlib.sha1(str(p.resolve()).encode()).hexdigest()
+    return get_data_home(data_home)/'index'/f'{key}.labels.parquet'
+
+
+def _read_labels_csv(p: Path) -> pd.DataFrame:
+    # Class names are read as categorical, everything else as str.
+    # Unnamed label columns are expected last (see ProteinDataset).
+    columns = pd.read_csv(p, index_col=0, compression='infer', nrows=0).columns
+    label_column = 'eggnog_id' if 'eggnog_id' in columns else columns[-1]
+    dtype = {column: str for column in columns}
+    dtype[label_column] = 'category'
+    try:
+        # Multi-threaded parsing, if pyarrow is available
+        return pd.read_csv(p, index_col=0, compression='infer', dtype=dtype, engine='pyarrow')
+    except (ImportError, ValueError, TypeError):
+        return pd.read_csv(p, index_col=0, compression='infer', dtype=dtype)
+
+
+def read_labels(p: Union[Path, str], cache: bool = True,
+                data_home: Union[Path, str, None] = None, verbose: int = 0) -> pd.DataFrame:
+    """ Read a CSV file of orthologous group labels.
+
+    Class names (column 'eggnog_id', or the last column) are read as
+    categorical data, all other columns as str. If a parquet engine
+    (e.g. pyarrow) is available, the labels are also stored as parquet
+    in the 'index' subfolder of the deepnog data home, and read from there
+    as long as size and modification time of the CSV file do not change.
+
+    Parameters
+    ----------
+    p : Path or str
+        Path to a possibly compressed CSV file with header line and index column
+    cache : bool, optional
+        Use and create the parquet copy, if possible
+    data_home : str, optional
+        Specify another folder for storing the parquet copy.
+    verbose : int
+        Increasing levels of messages
+
+    Returns
+    -------
+    labels : pd.DataFrame
+        Labels indexed by the first column of the file
+    """
+    logger = get_logger(__name__, verbose=verbose)
+    p = Path(p)
+    if not cache:
+        return _read_labels_csv(p)
+    stat = p.stat()
+    cache_file = _labels_cache_path(p, data_home)
+    signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+    try:
+        with open(cache_file.with_suffix('.signature')) as f:
+            if f.read() == signature:
+                labels = pd.read_parquet(cache_file)
+                logger.debug(f'Using cached labels {cache_file}')
+                return labels
+    except (OSError, ImportError, ValueError):
+        pass
+
+    labels = _read_labels_csv(p)
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Replace atomically, so that concurrent readers never see a partial file
+        tmp_file = cache_file.with_name(f'{cache_file.stem}.{os.getpid()}.tmp.parquet')
+        labels.to_parquet(tmp_file)
+        os.replace(str(tmp_file), str(cache_file))
+        with open(cache_file.with_suffix('.signature'), 'w') as f:
+            f.write(signature)
+        logger.debug(f'Cached labels in {cache_file}')
+    except (OSError, ImportError, ValueError):
+        pass  # No parquet engine, or read-only data home
+    return labels
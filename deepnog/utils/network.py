@@ -8,20 +8,42 @@ Description:
      Various utility functions
 """
 # SPDX-License-Identifier: BSD-3-Clause
+from contextlib import nullcontext
 from importlib import import_module
+from io import BytesIO
+import json
 from pathlib import Path
 from typing import Sequence, Union
+import warnings
+
+import numpy as np
 
 from . import get_logger
 from . import try_import_pytorch
+from .imports import try_import_onnxruntime
 
 torch = try_import_pytorch()
 
 __all__ = ['set_device',
            'count_parameters',
+           'export_model',
+           'ExportedModel',
+           'get_exported_path',
+           'is_current_export',
+           'load_exported',
            'load_nn',
+           'mixed_precision',
+           'OnnxModel',
+           'PRECISIONS',
            ]
 
+#: Name of the metadata file stored within exported models
+EXPORT_METADATA = 'deepnog.json'
+#: File suffixes of exported models
+EXPORT_SUFFIXES = {'torchscript': '.pt', 'onnx': '.onnx'}
+#: Numerical precisions of training and inference
+PRECISIONS = ('fp32', 'bf16')
+
 
 def count_parameters(model, tunable_only: bool = True) -> int:
     """ Count the number of parameters in the given model.
@@ -84,8 +106,40 @@ def set_device(device: Union[str, torch.device]) -> torch.device:
     return device
 
 
+def mixed_precision(device: Union[str, torch.device], precision: str = 'fp32'):
+    """ Context for forward passes (and losses) in the given numerical precision.
+
+    With 'bf16', matrix multiplications and convolutions run in bfloat16
+    under :func:`torch.autocast`, while weights, gradients, and numerically
+    sensitive operations (e.g. softmax, losses) remain float32.
+    This is considerably faster on CPUs with native bfloat16 support
+    (AVX512-BF16, AMX) and recent GPUs, at the cost of slightly different outputs.
+
+    Parameters
+    ----------
+    device : [str, torch.device]
+        Device of the model
+    precision : str, optional
+        One of 'fp32' (no change) or 'bf16'
+
+    Returns
+    -------
+    context : context manager
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision "{precision}", must be one of {PRECISIONS}.')
+    if precision == 'fp32':
+        return nullcontext()
+    if not hasattr(torch, 'autocast'):
+        raise ValueError(f'Precision "{precision}" requires PyTorch 1.10 or later, '
+                         f'found {torch.__version__}.')
+    return torch.autocast(torch.device(device).type, dtype=torch.bfloat16)
+
+
 def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, phase: str = 'eval',
-            device: Union[torch.device, str] = 'cpu', verbose: int = 0):
+            device: Union[torch.device, str] = 'cpu', verbose: int = 0,
+            pack_convolutions: bool = False, quantize: str = 'none',
+            calibration_data=None):
     """ Import NN architecture and set loaded parameters.
 
     Parameters
@@ -95,9 +149,11 @@ def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, ph
         E.g. 'deepnog' will load deepnog.models.deepnog.deepnog.
         Otherwise, separate module and class name of deep network to import.
         E.g. ('deepthought', 'DeepNettigkeit') will load deepnog.models.deepthought.DeepNettigkeit.
-    model_dict : dict, optional
+    model_dict : dict, str, or Path, optional
         Dictionary holding all parameters and hyper-parameters of the model.
         Required during inference, optional for training.
+        Alternatively, path to a model exported with :func:`export_model`
+        (``deepnog export``) for inference, in TorchScript or ONNX format.
     phase : ['train', 'infer', 'eval']
         Set network in training or inference=evaluation mode with effects on
         storing gradients, dropout, etc.
@@ -105,6 +161,15 @@ def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, ph
         Device to load the model into.
     verbose : int
         Increasingly verbose logging
+    pack_convolutions : bool, optional
+        Concatenate the convolutions of different kernel sizes into one
+        wide convolution for inference, if the model supports this
+        (see :meth:`deepnog.models.deepnog.DeepNOG.pack_convolutions`).
+    quantize : {'none', 'dynamic', 'static'}, optional
+        Quantize the model to int8 for CPU inference
+        (see :func:`deepnog.learning.quantization.quantize_model`).
+    calibration_data : str, Path, or Dataset, optional
+        Sample sequences for calibration of static quantization
 
     Returns
     -------
@@ -114,6 +179,14 @@ def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, ph
     """
     logger = get_logger(__name__, verbose=verbose)
 
+    if isinstance(model_dict, (str, Path)):
+        if not phase.lower().startswith(('eval', 'infer')):
+            raise ValueError('Exported models are for inference only.')
+        if pack_convolutions or quantize != 'none':
+            raise ValueError('Exported models cannot be packed or quantized.')
+        logger.debug(f'Loading exported model from {model_dict}')
+        return load_exported(model_dict, device=device)
+
     if isinstance(architecture, (str, Path)):
         module = str(architecture)
         cls = str(architecture)
@@ -134,6 +207,17 @@ def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, ph
                                'during inference.') from e
     # Move to GPU, if selected
     model.to(device)
+    if quantize != 'none':
+        if pack_convolutions:
+            raise ValueError('Packed convolutions cannot be quantized.')
+        if not phase.lower().startswith(('eval', 'infer')):
+            raise ValueError('Quantized models are for inference only.')
+    if pack_convolutions:
+        try:
+            model.pack_convolutions()
+            logger.debug('Packed convolutions into one wide convolution.')
+        except AttributeError:
+            logger.warning(f'{cls} does not support packed convolutions.')
     # Inform neural network layers to be in evaluation or training mode
     if phase.lower().startswith('train'):
         logger.debug('Setting model.train() mode')
@@ -144,4 +228,180 @@ def load_nn(architecture: Union[str, Sequence[str]], model_dict: dict = None, ph
     else:
         raise ValueError(f'Unknown phase "{phase}". '
                          f'Must be "train", "infer", or "eval".')
+    if quantize != 'none':
+        from ..learning.quantization import quantize_model
+        model = quantize_model(model, mode=quantize, calibration_data=calibration_data,
+                               verbose=verbose)
     return model
+
+
+class ExportedModel(torch.nn.Module):
+    """ Model loaded from a TorchScript file created by :func:`export_model`.
+
+    Parameters
+    ----------
+    module : torch.jit.ScriptModule
+        Frozen TorchScript module
+    classes : list
+        Class names corresponding to the output nodes of the network
+    threshold : float, optional
+        Confidence threshold of the original model
+    temperature : float, optional
+        Temperature for calibrated confidences of the original model
+    """
+    def __init__(self, module, classes, threshold: float = None, temperature: float = None):
+        super().__init__()
+        self.module = module
+        self.classes = classes
+        if threshold is not None:
+            self.threshold = threshold
+        if temperature is not None:
+            self.temperature = temperature
+        self.softmax = torch.nn.Softmax(dim=1)
+
+    def forward(self, x):
+        return self.module(x)
+
+
+class OnnxModel(torch.nn.Module):
+    """ Model exported to ONNX, run with onnxruntime on CPU.
+
+    Behaves like a PyTorch model during inference (e.g. in
+    :func:`deepnog.learning.predict`): it takes a batch of encoded sequences,
+    and returns the network output as a tensor. Graph optimizations and
+    threading are handled by onnxruntime.
+
+    Parameters
+    ----------
+    file : str or Path
+        Model exported with ``export_model(..., export_format='onnx')``
+    num_threads : int, optional
+        Number of threads per operator. By default, onnxruntime decides.
+    """
+    def __init__(self, file: Union[str, Path], num_threads: int = None):
+        super().__init__()
+        ort = try_import_onnxruntime()
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(str(file), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = json.loads(self.session.get_modelmeta().custom_metadata_map[EXPORT_METADATA])
+        self.classes = metadata['classes']
+        if metadata.get('threshold') is not None:
+            self.threshold = metadata['threshold']
+        if metadata.get('temperature') is not None:
+            self.temperature = metadata['temperature']
+        self.softmax = torch.nn.Softmax(dim=1)
+
+    def forward(self, x):
+        output, = self.session.run(None, {self.input_name: x.cpu().numpy().astype(np.int64)})
+        return torch.from_numpy(output)
+
+
+def get_exported_path(weights_path: Union[str, Path], export_format: str = 'torchscript'
+                      ) -> Path:
+    """ Path of the exported model next to a weights file (see ``deepnog export``). """
+    return Path(weights_path).with_suffix(EXPORT_SUFFIXES[export_format])
+
+
+def is_current_export(exported_path: Union[str, Path], weights_path: Union[str, Path]) -> bool:
+    """ Whether an exported model exists, and is not older than its weights. """
+    exported_path = Path(exported_path)
+    return (exported_path.is_file()
+            and exported_path.stat().st_mtime >= Path(weights_path).stat().st_mtime)
+
+
+def export_model(model, file: Union[str, Path], class_labels: Sequence,
+                 threshold: float = None, example_length: int = 100,
+                 export_format: str = 'torchscript') -> Path:
+    """ Export a model for inference as a frozen TorchScript or ONNX file.
+
+    The model is traced with an example batch. TorchScript models are frozen,
+    so that weights become constants, and the TorchScript compiler can fuse
+    operations. ONNX models have dynamic batch and sequence length axes,
+    and run with onnxruntime (see :class:`OnnxModel`).
+    Exported models run without the Python code of the architecture,
+    and are loaded with :func:`load_nn` or :func:`load_exported`.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model, e.g. loaded with :func:`load_nn`
+    file : str or Path
+        Output file, by convention with suffix '.pt'
+    class_labels : sequence
+        Class names corresponding to the output nodes of the network
+    threshold : float, optional
+        Confidence threshold stored along with the model.
+        The temperature of the model (if any) is stored as well.
+    example_length : int, optional
+        Length of the example sequences used for tracing
+    export_format : {'torchscript', 'onnx'}, optional
+        Format of the exported model. ONNX export requires the onnx package.
+
+    Returns
+    -------
+    file : Path
+        The exported model
+    """
+    if export_format not in EXPORT_SUFFIXES:
+        raise ValueError(f'Unknown export format "{export_format}". '
+                         f'Must be one of {list(EXPORT_SUFFIXES)}.')
+    model = model.eval()
+    device = next(model.parameters()).device
+    example = torch.randint(1, 26, (2, example_length), device=device)
+    temperature = getattr(model, 'temperature', None)
+    metadata = {'classes': [str(c) for c in class_labels],
+                'threshold': None if threshold is None else float(threshold),
+                'temperature': None if temperature is None else float(temperature)}
+    file = Path(file)
+    with torch.no_grad(), warnings.catch_warnings():
+        # Tracing warns about Python control flow, which depends on
+        # hyperparameters only (or is valid for all sequence lengths)
+        warnings.simplefilter('ignore', torch.jit.TracerWarning)
+        if export_format == 'onnx':
+            import onnx
+            buffer = BytesIO()
+            torch.onnx.export(model, example, buffer,
+                              input_names=['sequences'],
+                              output_names=['output'],
+                              dynamic_axes={'sequences': {0: 'batch', 1: 'length'},
+                                            'output': {0: 'batch'}})
+            onnx_model = onnx.load_from_string(buffer.getvalue())
+            onnx.helper.set_model_props(onnx_model, {EXPORT_METADATA: json.dumps(metadata)})
+            onnx.save(onnx_model, str(file))
+            return file
+        traced = torch.jit.freeze(torch.jit.trace(model, example))
+    torch.jit.save(traced, str(file),
+                   _extra_files={EXPORT_METADATA: json.dumps(metadata)})
+    return file
+
+
+def load_exported(file: Union[str, Path], device: Union[torch.device, str] = 'cpu'):
+    """ Load a model exported with :func:`export_model`.
+
+    Parameters
+    ----------
+    file : str or Path
+        Exported model
+    device : [str, torch.device]
+        Device to load the model into
+
+    Returns
+    -------
+    model : ExportedModel or OnnxModel
+        Model in evaluation mode, with class names in ``model.classes``.
+        ONNX models (suffix '.onnx') run on CPU regardless of ``device``.
+    """
+    if Path(file).suffix == EXPORT_SUFFIXES['onnx']:
+        return OnnxModel(file).eval()
+    extra_files = {EXPORT_METADATA: ''}
+    module = torch.jit.load(str(file), map_location=device, _extra_files=extra_files)
+    metadata = json.loads(extra_files[EXPORT_METADATA])
+    model = ExportedModel(module, classes=metadata['classes'],
+                          threshold=metadata.get('threshold'),
+                          temperature=metadata.get('temperature'))
+    return model.eval()
@@ -1,14 +1,21 @@
+from io import BytesIO
 from itertools import product
 import logging
+import os
 from pathlib import Path
 import pytest
+import shutil
 from tempfile import TemporaryDirectory
+import numpy as np
 import torch
 import yaml
 
 from deepnog.utils import count_parameters, load_nn, set_device
+from deepnog.utils import ExportedModel, OnnxModel, export_model, get_exported_path
 from deepnog.utils import get_logger, get_weights_path, get_config
 from deepnog.utils import parse
+from deepnog.utils import build_fasta_index, get_fasta_index, open_binary, read_fasta
+from deepnog.utils import file_digest, file_fingerprint, read_labels, split_fasta_record
 
 GPU_AVAILABLE = torch.cuda.is_available()
 TEST_STR = 'krawutzi'
@@ -189,3 +196,159 @@ def test_parse():
     assert n_sequences == 1_289, 'Incorrect number of sequences from plain fasta file'
     for a, b in [(0, 1), (1, 2), (2, 0)]:
         assert len(fasta_set[a].intersection(fasta_set[b])) == n_sequences
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.xz'])
+@pytest.mark.parametrize('chunk_size', [7, 2**20])
+def test_read_fasta(suffix, chunk_size):
+    f = TESTS/f'data/GCF_000007025.1.faa{suffix}'
+    expected = [(rec.id, str(rec.seq)) for rec in parse(f, 'fasta')]
+    observed = [(sequence_id, residues.decode())
+                for sequence_id, residues in read_fasta(f, chunk_size=chunk_size)]
+    assert observed == expected
+
+
+def test_read_fasta_corner_cases():
+    with TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        f = Path(tmpdir)/'corner_cases.faa'
+        f.write_bytes(b'text before first record\n'
+                      b'>first description\r\nMAT TAC\r\nKK\r\n'
+                      b'>\nMA\n\n'
+                      b'>last')
+        for chunk_size in [1, 5, 1000]:
+            observed = list(read_fasta(f, chunk_size=chunk_size))
+            expected = [(rec.id, str(rec.seq).encode()) for rec in parse(f, 'fasta')]
+            assert observed == expected
+            assert observed == [('first', b'MATTACKK'), ('', b'MA'), ('last', b'')]
+            # Binary streams are read, but not closed
+            stream = BytesIO(f.read_bytes())
+            assert list(read_fasta(stream, chunk_size=chunk_size)) == observed
+            assert not stream.closed
+
+
+@pytest.mark.parametrize('suffix', ['', '.gz', '.xz'])
+def test_fasta_index(suffix):
+    f = TESTS/f'data/GCF_000007025.1.faa{suffix}'
+    records = list(parse(f, 'fasta'))
+    offsets = build_fasta_index(f, chunk_size=1000)  # records span chunks
+    assert offsets.size == len(records) + 1
+    np.testing.assert_array_equal(offsets, build_fasta_index(f))
+    with open_binary(f) as fh:
+        for i, rec in enumerate(records):
+            fh.seek(offsets[i])
+            sequence_id, residues = split_fasta_record(fh.read(offsets[i + 1] - offsets[i]))
+            assert sequence_id == rec.id
+            assert residues.decode() == str(rec.seq)
+
+
+def test_get_fasta_index():
+    with TemporaryDirectory(prefix='deepnog_test_data_dir_') as tmpdir:
+        f = Path(tmpdir)/'sequences.faa'
+        shutil.copy(TESTS/'data/test_skip_empty_sequences.faa', f)
+        offsets = get_fasta_index(f, data_home=tmpdir)
+        assert offsets.size == 90 + 1
+        index_files = list((Path(tmpdir)/'index').iterdir())
+        assert len(index_files) == 1
+        np.testing.assert_array_equal(get_fasta_index(f, data_home=tmpdir), offsets)
+
+        # Index is rebuilt, when the sequence file changes
+        with f.open('a') as fh:
+            fh.write('>appended\nMATTAC\n')
+        stat = f.stat()
+        os.utime(f, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        offsets_changed = get_fasta_index(f, data_home=tmpdir)
+        assert offsets_changed.size == offsets.size + 1
+        assert offsets_changed[-1] == f.stat().st_size
+
+
+def test_export_model():
+    model_dict = torch.load(WEIGHTS_PATH, map_location='cpu')
+    model = load_nn(('deepnog', 'DeepNOG'), model_dict, phase='infer')
+    with TemporaryDirectory(prefix='deepnog_pytest_') as d:
+        exported_path = get_exported_path(Path(d)/'deepnog.pth')
+        assert exported_path.name == 'deepnog.pt'
+        export_model(model, exported_path, model_dict['classes'], threshold=0.5)
+        exported = load_nn(('deepnog', 'DeepNOG'), exported_path, phase='infer')
+        assert isinstance(exported, ExportedModel)
+        assert exported.classes == list(model_dict['classes'])
+        assert exported.threshold == 0.5
+        # Sequence lengths differ from the example used for tracing
+        for length in [36, 100, 2000]:
+            x = torch.randint(1, 26, (3, length))
+            with torch.no_grad():
+                np.testing.assert_allclose(exported.softmax(exported(x)),
+                                           model.softmax(model(x)), rtol=1e-5, atol=1e-6)
+        with pytest.raises(ValueError):
+            load_nn(('deepnog', 'DeepNOG'), exported_path, phase='train')
+        with pytest.raises(ValueError):
+            load_nn(('deepnog', 'DeepNOG'), exported_path, phase='infer', quantize='dynamic')
+
+
+@pytest.mark.parametrize('architecture', ['deepnog', 'deepfam', 'deepfam_light',
+                                          'DeepFamAblation1', 'DeepFamAblation123'])
+def test_export_onnx(architecture):
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    config = get_config(DEEPNOG_ROOT/"config/deepnog_custom_config.yml")
+    model_dict = dict(config['architecture'][architecture], n_classes=7)
+    module, cls = model_dict['module'], model_dict['class']
+    model = load_nn((module, cls), model_dict, phase='train').eval()
+    classes = [f'OG{i}' for i in range(7)]
+    with TemporaryDirectory(prefix='deepnog_pytest_') as d:
+        exported_path = get_exported_path(Path(d)/'deepnog.pth', export_format='onnx')
+        export_model(model, exported_path, classes, export_format='onnx')
+        exported = load_nn((module, cls), exported_path, phase='infer')
+        assert isinstance(exported, OnnxModel)
+        assert exported.classes == classes
+        assert not hasattr(exported, 'threshold')
+        # Dynamic batch and length axes
+        for batch_size, length in [(1, 36), (5, 1234)]:
+            x = torch.randint(1, 26, (batch_size, length))
+            with torch.no_grad():
+                np.testing.assert_allclose(exported(x), model(x), rtol=1e-4, atol=1e-4)
+
+
+def test_read_labels():
+    with TemporaryDirectory(prefix='deepnog_pytest_') as d:
+        csv = Path(d)/'labels.csv'
+        csv.write_text(',protein_id,eggnog_id\n0,p1,COG2\n1,p2,COG1\n2,p3,COG2\n')
+        labels = read_labels(csv, cache=False)
+        assert labels.protein_id.tolist() == ['p1', 'p2', 'p3']
+        assert labels.eggnog_id.dtype == 'category'
+        assert labels.eggnog_id.cat.categories.tolist() == ['COG1', 'COG2']
+
+        # Unnamed columns, classes expected last
+        csv.write_text('index,id,og\n0,0001,COG2\n1,0002,COG1\n')
+        labels = read_labels(csv, cache=False)
+        assert labels.id.tolist() == ['0001', '0002']
+        assert labels.og.dtype == 'category'
+
+
+def test_read_labels_cache():
+    pytest.importorskip('pyarrow')
+    with TemporaryDirectory(prefix='deepnog_pytest_') as d:
+        csv = Path(d)/'labels.csv'
+        csv.write_text(',protein_id,eggnog_id\n0,p1,COG2\n1,p2,COG1\n')
+        labels = read_labels(csv, data_home=d)
+        assert list((Path(d)/'index').glob('*.labels.parquet'))
+        cached = read_labels(csv, data_home=d)
+        assert cached.eggnog_id.dtype == 'category'
+        assert cached.equals(labels)
+
+        # Changed files are read again
+        csv.write_text(',protein_id,eggnog_id\n0,p1,COG3\n')
+        assert read_labels(csv, data_home=d).eggnog_id.tolist() == ['COG3']
+
+
+def test_file_digest():
+    with TemporaryDirectory(prefix='deepnog_test_') as tmpdir:
+        path = Path(tmpdir)/'weights.pth'
+        content = bytearray(5 * 2 ** 20)
+        path.write_bytes(content)
+        digest, fingerprint = file_digest(path), file_fingerprint(path)
+        # Changes beyond the first and last MiB only alter the full digest
+        content[2 * 2 ** 20] = 1
+        path.write_bytes(content)
+        assert file_fingerprint(path) == fingerprint
+        assert file_digest(path) != digest
+        assert file_digest(path, chunk_size=1000) == file_digest(path)
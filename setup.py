@@ -51,6 +51,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type='text/markdown',
     install_requires=install_requires,
+    extras_require={'onnx': ['onnx', 'onnxruntime']},
     url='',
     packages=setuptools.find_packages(),
     package_data={